@@ -1,23 +1,69 @@
 import random
 import json
+import math
 import os
 import sys
 import time
-
-REQUEST_SETTINGS = None
-
-# Determine session id from environment or argv (subprocess mode)
-SESSION_ID = os.environ.get('SESSION_ID') if os.environ.get('SESSION_ID') else (sys.argv[1] if len(sys.argv) > 1 else None)
+import threading
+from collections import OrderedDict, defaultdict
+
+import pepesettings
+
+# Settings snapshot (pepesettings.Settings) of the current generate()/resize()/
+# generate_region() run; None outside a run, see current_settings()
+SETTINGS = None
+# Optional zero-arg callable set by generate(); returns True once this run has been superseded
+CANCEL_CHECK = None
+# Optional callable(tiles, regions) set by generate(sink=...): streaming mode, see _flush_strip
+STRIP_SINK = None
+# True while laying out the repeating block of a periodic ("wallpaper") pattern: the
+# touching-colors check then also looks across the block's edges, see block_settings()
+PERIODIC = False
+# Progressive mode (generate(progress=...)): list the layout pass queues region fills on
+# instead of writing tiles; _fill_queued() materializes them afterwards
+FILL_QUEUE = None
+PROGRESS = None
+# Tiles per progress('fill', ...) call in progressive mode
+PROGRESS_BATCH_TILES = int(os.environ.get('PROGRESS_BATCH_TILES', 5000))
+
+
+class GenerationCancelled(Exception):
+    """Raised inside a generation run when CANCEL_CHECK reports it was superseded."""
+
+
+def _check_cancelled():
+    if CANCEL_CHECK is not None and CANCEL_CHECK():
+        raise GenerationCancelled()
+
+# Session files: importing this module has no side effects. Paths default to the shared
+# files next to the script; a session is picked only when run as a script (see __main__)
+SESSION_ID = None
 BASE_DIR = os.path.dirname(__file__)
 USER_DATA_DIR = os.path.join(BASE_DIR, 'user_data')
-os.makedirs(USER_DATA_DIR, exist_ok=True)
-DATA_FILE = os.path.join(USER_DATA_DIR, f"data_{SESSION_ID}.json") if SESSION_ID else os.path.join(BASE_DIR, "data.json")
-PATTERN_FILE = os.path.join(USER_DATA_DIR, f"pattern_{SESSION_ID}.json") if SESSION_ID else os.path.join(BASE_DIR, "pattern.json")
-REGIONS_FILE = os.path.join(USER_DATA_DIR, f"regions_{SESSION_ID}.json") if SESSION_ID else os.path.join(BASE_DIR, "regions.json")
+DATA_FILE = PATTERN_FILE = REGIONS_FILE = RUN_MARKER = DONE_MARKER = None
+
+
+def configure_session(session_id=None):
+    """Point DATA_FILE / PATTERN_FILE / REGIONS_FILE and the status markers at session_id's
+    files in user_data (or the shared ones when session_id is empty)."""
+    global SESSION_ID, DATA_FILE, PATTERN_FILE, REGIONS_FILE, RUN_MARKER, DONE_MARKER
+    SESSION_ID = session_id or None
+    if SESSION_ID:
+        DATA_FILE = os.path.join(USER_DATA_DIR, f"data_{SESSION_ID}.json")
+        PATTERN_FILE = os.path.join(USER_DATA_DIR, f"pattern_{SESSION_ID}.json")
+        REGIONS_FILE = os.path.join(USER_DATA_DIR, f"regions_{SESSION_ID}.json")
+        # Generation status marker files (used by Flask /generate/status)
+        RUN_MARKER = os.path.join(USER_DATA_DIR, f"generate_{SESSION_ID}.running")
+        DONE_MARKER = os.path.join(USER_DATA_DIR, f"generate_{SESSION_ID}.done")
+    else:
+        DATA_FILE = os.path.join(BASE_DIR, "data.json")
+        PATTERN_FILE = os.path.join(BASE_DIR, "pattern.json")
+        REGIONS_FILE = os.path.join(BASE_DIR, "regions.json")
+        RUN_MARKER = os.path.join(BASE_DIR, 'generate.running')
+        DONE_MARKER = os.path.join(BASE_DIR, 'generate.done')
+
 
-# Generation status marker files (used by Flask /generate/status)
-RUN_MARKER = os.path.join(USER_DATA_DIR, f"generate_{SESSION_ID}.running") if SESSION_ID else os.path.join(BASE_DIR, 'generate.running')
-DONE_MARKER = os.path.join(USER_DATA_DIR, f"generate_{SESSION_ID}.done") if SESSION_ID else os.path.join(BASE_DIR, 'generate.done')
+configure_session()
 
 def _mark_generation_done():
     """Create a 'done' marker and remove the 'running' marker if present."""
@@ -33,71 +79,155 @@ def _mark_generation_done():
         pass
 
 
-def draw0(self,x,y,xdist,ydist):
-    # print("Tile = Padrão Triangulos || rotation angle = 0, || Coordenates :",x+xdist+1,y+ydist+1,"|| color_fundo:",self.CorFundo, "color_padrão:",self.CorPattern)
-    gridValues[x+xdist+1][y+ydist+1].append({
-    "tile": "Padrao Triangulos",
-    "rotation": 0,
-    "coordinates": (x+xdist+1, y+ydist+1),
-    "color_fundo": self.CorFundo,
-    "color_padrao": self.CorPattern,
-    "region_id": getattr(self, "region_id", None)
-})
-
-def draw90(self,x,y,xdist,ydist):
-    # print("Tile = Padrão Triangulos || rotation angle = 90, || Coordenates :",x+xdist+1,y+ydist+1,"|| color_fundo:",self.CorFundo, "color_padrão:",self.CorPattern)
-    gridValues[x+xdist+1][y+ydist+1].append({
-    "tile": "Padrao Triangulos",
-    "rotation": 90,
-    "coordinates": (x+xdist+1, y+ydist+1),
-    "color_fundo": self.CorFundo,
-    "color_padrao": self.CorPattern,
-    "region_id": getattr(self, "region_id", None)
-})
-
-def drawsquare_0(self,x,y,xdist,ydist):
-    # print("Tile = Padrão Quadrado || rotation angle = 0 || Coordenates :",x+xdist+1,y+ydist+1,"|| color_fundo:",self.CorFundo, "color_padrão:",self.CorPattern)
-    gridValues[x+xdist+1][y+ydist+1].append({
-    "tile": "Padrao Quadrado",
-    "rotation": 0,
-    "coordinates": (x+xdist+1, y+ydist+1),
-    "color_fundo": self.CorFundo,
-    "color_padrao": self.CorPattern,
-    "region_id": getattr(self, "region_id", None)
-})
-
-def drawsquare_90(self,x,y,xdist,ydist):
-    # print("Tile = Padrão Quadrado || rotation angle = 90 || Coordenates :",x+xdist+1,y+ydist+1,"|| color_fundo:",self.CorFundo, "color_padrão:",self.CorPattern)
-    gridValues[x+xdist+1][y+ydist+1].append({
-    "tile": "Padrao Quadrado",
-    "rotation": 90,
-    "coordinates": (x+xdist+1, y+ydist+1),
-    "color_fundo": self.CorFundo,
-    "color_padrao": self.CorPattern,
-    "region_id": getattr(self, "region_id", None)
-})
-
-def drawsquare_180(self,x,y,xdist,ydist):
-    # print("Tile = Padrão Quadrado || rotation angle = 180 || Coordenates :",x+xdist+1,y+ydist+1,"|| color_fundo:",self.CorFundo, "color_padrão:",self.CorPattern)
-    gridValues[x+xdist+1][y+ydist+1].append({
-    "tile": "Padrao Quadrado",
-    "rotation": 180,
-    "coordinates": (x+xdist+1, y+ydist+1),
-    "color_fundo": self.CorFundo,
-    "color_padrao": self.CorPattern,
-    "region_id": getattr(self, "region_id", None)
-})
-
-def drawsquare_270(self,x,y,xdist,ydist):
-    # print("Tile = Padrão Quadrado || rotation angle = 270, || Coordenates :",x+xdist+1,y+ydist+1,"|| color_fundo:",self.CorFundo, "color_padrão:",self.CorPattern)
-    gridValues[x+xdist+1][y+ydist+1].append({
-    "tile": "Padrao Quadrado",
-    "rotation": 270,
-    "coordinates": (x+xdist+1, y+ydist+1),
-    "color_fundo": self.CorFundo,
-    "color_padrao": self.CorPattern,
-    "region_id": getattr(self, "region_id", None)
-})
+# Variant motifs. Every fill variant is a periodic arrangement of tile orientations:
+# row ydist of a region uses motif[ydist % len(motif)], cell xdist of that row uses
+# row[xdist % len(row)]. Tables are compiled once at import into tuples of
+# (tile, rotation) pairs; forked workers (gunicorn, the generator daemon) share them.
+_TRIANGLES = "Padrao Triangulos"
+_SQUARE = "Padrao Quadrado"
+
+# aleluia_triangulos variants that draw a random_start bit before filling: (motif if 0, motif if 1).
+# Variant 2 picks every cell at random and has no table.
+_TRIANGLE_START_MOTIFS = {
+    1: ([[0]], [[90]]),
+    3: ([[90, 0]], [[0, 90]]),
+    4: ([[90], [0]], [[0], [90]]),
+    5: ([[90, 0], [0, 90]], [[0, 90], [90, 0]]),
+}
+_TRIANGLE_MOTIFS = {
+    6: [[0, 0, 90, 90], [90, 90, 0, 0]],
+    7: [[0, 0, 90, 90], [0, 0, 90, 90], [90, 90, 0, 0], [90, 90, 0, 0]],
+}
+# aleluia_quadrados variant 1 cycles 0/90/180/270 through the cells in fill order instead
+_SQUARE_CYCLE = [0, 90, 180, 270]
+_SQUARE_MOTIFS = {
+    2: [[0]],
+    3: [[90]],
+    4: [[0, 90], [270, 180]],
+    5: [[0, 90], [180, 270]],
+    6: [[180, 0], [90, 270]],
+    7: [[180, 0], [0, 180]],
+    8: [[90, 270, 270, 90]],
+    9: [[0, 0, 270, 90], [180, 180, 270, 90], [270, 90, 0, 0], [270, 90, 180, 180]],
+    10: [[90, 90, 0, 180], [270, 270, 0, 180], [0, 180, 90, 90], [0, 180, 270, 270]],
+    11: [[0, 180], [90, 90]],
+    12: [[0, 180, 0, 180, 180, 0, 180, 0],
+         [90, 90, 90, 90, 270, 270, 270, 270],
+         [0, 180, 0, 180, 180, 0, 180, 0],
+         [270, 90, 90, 270, 90, 270, 270, 90],
+         [90, 270, 270, 90, 270, 90, 90, 270],
+         [180, 0, 180, 0, 0, 180, 0, 180],
+         [90, 90, 90, 90, 270, 270, 270, 270],
+         [180, 0, 180, 0, 0, 180, 0, 180]],
+    13: [[90, 270], [90, 270], [270, 90], [270, 270]],
+    14: [[90, 90], [270, 90], [90, 90], [90, 270]],
+}
+
+
+def _compile_motif(tile, rows):
+    return tuple(tuple((tile, rotation) for rotation in row) for row in rows)
+
+
+_TRIANGLE_START_MOTIFS = {v: tuple(_compile_motif(_TRIANGLES, m) for m in pair) for v, pair in _TRIANGLE_START_MOTIFS.items()}
+_TRIANGLE_MOTIFS = {v: _compile_motif(_TRIANGLES, m) for v, m in _TRIANGLE_MOTIFS.items()}
+_TRIANGLE_CELLS = ((_TRIANGLES, 0), (_TRIANGLES, 90))
+_SQUARE_CYCLE = tuple((_SQUARE, rotation) for rotation in _SQUARE_CYCLE)
+_SQUARE_MOTIFS = {v: _compile_motif(_SQUARE, m) for v, m in _SQUARE_MOTIFS.items()}
+
+
+# Region-fill flyweights. A fill depends only on (shape, variant, random_start bit, width,
+# height): which tile and rotation each cell gets relative to the region's corner. RandomNum
+# keeps region sizes to a few values, so most regions reuse a fill computed earlier; colors
+# and the region id are applied when the cached cells are copied into the grid. Variant 2 of
+# aleluia_triangulos draws every cell at random and is not cached.
+FILL_CACHE_MAX_ENTRIES = int(os.environ.get('FILL_CACHE_MAX_ENTRIES', 2048))
+FILL_CACHE_MAX_CELLS = int(os.environ.get('FILL_CACHE_MAX_CELLS', 2000000))
+_fill_cache = OrderedDict()
+_fill_cache_lock = threading.Lock()
+_fill_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'cells': 0}
+
+
+def _build_fill(shape, variant, start, Xtimes, Ytimes):
+    """((xdist, ydist, tile, rotation), ...) for one fill, column by column."""
+    if shape == "aleluia_quadrados" and variant == 1:
+        # cycles through the cells in row order, so it depends on the width as well
+        return tuple((xdist, ydist) + _SQUARE_CYCLE[(ydist * Xtimes + xdist) % 4]
+                     for xdist in range(Xtimes) for ydist in range(Ytimes))
+    if shape == "aleluia_quadrados":
+        motif = _SQUARE_MOTIFS[variant]
+    elif start is not None:
+        motif = _TRIANGLE_START_MOTIFS[variant][start]
+    else:
+        motif = _TRIANGLE_MOTIFS[variant]
+    cells = []
+    for xdist in range(Xtimes):
+        for ydist in range(Ytimes):
+            row = motif[ydist % len(motif)]
+            cells.append((xdist, ydist) + row[xdist % len(row)])
+    return tuple(cells)
+
+
+def region_fill(shape, variant, start, Xtimes, Ytimes):
+    """Cached _build_fill() (bounded LRU by entries and by total cells)."""
+    key = (shape, variant, start, Xtimes, Ytimes)
+    with _fill_cache_lock:
+        cells = _fill_cache.get(key)
+        if cells is not None:
+            _fill_cache.move_to_end(key)
+            _fill_cache_stats['hits'] += 1
+            return cells
+        _fill_cache_stats['misses'] += 1
+    cells = _build_fill(shape, variant, start, Xtimes, Ytimes)
+    with _fill_cache_lock:
+        if key not in _fill_cache and len(cells) <= FILL_CACHE_MAX_CELLS:
+            _fill_cache[key] = cells
+            _fill_cache_stats['cells'] += len(cells)
+            while len(_fill_cache) > FILL_CACHE_MAX_ENTRIES or _fill_cache_stats['cells'] > FILL_CACHE_MAX_CELLS:
+                _, old = _fill_cache.popitem(last=False)
+                _fill_cache_stats['cells'] -= len(old)
+                _fill_cache_stats['evictions'] += 1
+    return cells
+
+
+def fill_cache_stats():
+    with _fill_cache_lock:
+        stats = dict(_fill_cache_stats, entries=len(_fill_cache))
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+    return stats
+
+
+def _put_fill(self, x, y, cells):
+    _check_cancelled()
+    fill = (self.CorFundo, self.CorPattern, getattr(self, "region_id", None), x, y, cells)
+    if FILL_QUEUE is not None:
+        FILL_QUEUE.append(fill)
+    else:
+        _write_fill(*fill)
+
+
+def _write_fill(fundo, padrao, region_id, x, y, cells, out=None):
+    """Copy a fill's cells into gridValues at (x, y) in the region's colors (entries are
+    also appended to out when given)."""
+    last = None
+    for xdist, ydist, tile, rotation in cells:
+        if xdist != last:
+            last = xdist
+            gx = x+xdist+1
+            column = gridValues[gx]
+        gy = y+ydist+1
+        entry = {
+            "tile": tile,
+            "rotation": rotation,
+            "coordinates": (gx, gy),
+            "color_fundo": fundo,
+            "color_padrao": padrao,
+            "region_id": region_id,
+        }
+        column[gy].append(entry)
+        if out is not None:
+            out.append(entry)
+
 
 class PatternStyles:
     def __init__(self,CorFundo,CorPattern,Filletes,patternEssencials,PepeQuad1,PepeQuad2, region_id=None):
@@ -118,78 +248,18 @@ class PatternStyles:
         x,y,sizeX,sizeY = self.Filletes[-1]
         Xtimes = int(sizeX / (self.largTela/self.divLarg))
         Ytimes = int(sizeY / (self.altTela/self.divAlt))
-        if random_pattern == 1:
+        if random_pattern in _TRIANGLE_START_MOTIFS:
             random_start = random.randint(0,1)
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if random_start == 0:
-                        draw0(self,x,y,xdist,ydist)
-                    else:
-                        draw90(self,x,y,xdist,ydist)
+            _put_fill(self, x, y, region_fill("aleluia_triangulos", random_pattern, random_start, Xtimes, Ytimes))
         elif random_pattern == 2:
+            cells = []
             for ydist in range(Ytimes):
+                _check_cancelled()
                 for xdist in range(Xtimes):
-                    random_number = random.randint(0,1)
-                    if random_number == 0:
-                        draw0(self,x,y,xdist,ydist)
-                    else :
-                        draw90(self,x,y,xdist,ydist)
-        elif random_pattern== 3:
-            random_start = random.randint(0,1)
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if xdist%2 == random_start:
-                        draw90(self,x,y,xdist,ydist)
-                    else:
-                        draw0(self,x,y,xdist,ydist)
-        elif random_pattern== 4:
-            random_start = random.randint(0,1)
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%2 == random_start:
-                        draw90(self,x,y,xdist,ydist)
-                    else:
-                        draw0(self,x,y,xdist,ydist)
-        elif random_pattern== 5:
-            random_start = random.randint(0,1)
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%2 == 0:
-                        if xdist%2== random_start:
-                            draw90(self,x,y,xdist,ydist)
-                        else:
-                            draw0(self,x,y,xdist,ydist)
-                    else:
-                        if xdist%2== random_start:
-                            draw0(self,x,y,xdist,ydist)
-                        else:
-                            draw90(self,x,y,xdist,ydist)
-        elif random_pattern== 6:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%2 == 0:
-                        if xdist%4 <= 1:
-                            draw0(self,x,y,xdist,ydist)
-                        else:
-                            draw90(self,x,y,xdist,ydist)
-                    else:
-                        if xdist%4 <= 1:
-                            draw90(self,x,y,xdist,ydist)
-                        else:
-                            draw0(self,x,y,xdist,ydist)
-        elif random_pattern== 7:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%4 < 2 :
-                        if xdist%4 < 2:
-                            draw0(self,x,y,xdist,ydist)
-                        else:
-                            draw90(self,x,y,xdist,ydist)
-                    else:
-                        if xdist%4 < 2:
-                            draw90(self,x,y,xdist,ydist)
-                        else:
-                            draw0(self,x,y,xdist,ydist)
+                    cells.append((xdist, ydist) + _TRIANGLE_CELLS[random.randint(0,1)])
+            _put_fill(self, x, y, cells)
+        elif random_pattern in _TRIANGLE_MOTIFS:
+            _put_fill(self, x, y, region_fill("aleluia_triangulos", random_pattern, None, Xtimes, Ytimes))
         self.chosen_variant = random_pattern
         return random_pattern
     def aleluia_quadrados(self, variant=None):
@@ -197,427 +267,98 @@ class PatternStyles:
         x,y,sizeX,sizeY = self.Filletes[-1]
         Xtimes = int(sizeX / (self.largTela/self.divLarg))
         Ytimes = int(sizeY / (self.altTela/self.divAlt))
-        
-        if random_pattern == 1:
-            times = 0
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if times%4==0:
-                        drawsquare_0(self,x,y,xdist,ydist)
-                    elif times%4==1:
-                        drawsquare_90(self,x,y,xdist,ydist)
-                    elif times%4==2:
-                        drawsquare_180(self,x,y,xdist,ydist)
-                    elif times%4==3:
-                        drawsquare_270(self,x,y,xdist,ydist)
-                    times = times + 1
-        
-        if random_pattern == 2:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    drawsquare_0(self,x,y,xdist,ydist)
-                    
-        if random_pattern == 3:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    drawsquare_90(self,x,y,xdist,ydist)
-                    
-        if random_pattern == 4:
-            times = 0
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%2== 0:
-                        if xdist%2 == 0:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                    else:
-                        if xdist%2 == 0:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                            
-        if random_pattern == 5:
-            times = 0
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%2== 0:
-                        if xdist%2 == 0:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                    else:
-                        if xdist%2 == 0:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_270(self,x,y,xdist,ydist)
-        
-        if random_pattern == 6:
-            times = 0
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%2== 0:
-                        if xdist%2 == 0:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                    else:
-                        if xdist%2 == 0:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                            
-        if random_pattern == 7:
-            times = 0
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%2== 0:
-                        if xdist%2 == 0:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                    else:
-                        if xdist%2 == 0:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                            
-        if random_pattern == 8:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if xdist%4==0:
-                        drawsquare_90(self,x,y,xdist,ydist)
-                    elif xdist%4==1:
-                        drawsquare_270(self,x,y,xdist,ydist)
-                    elif xdist%4==2:
-                        drawsquare_270(self,x,y,xdist,ydist)
-                    elif xdist%4==3:
-                        drawsquare_90(self,x,y,xdist,ydist)
-                        
-        if random_pattern == 9:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%4==0:
-                        if xdist%4==0:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%4==1:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%4==2:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%4==3:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                    if ydist%4==1:
-                        if xdist%4==0:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%4==1:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%4==2:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%4==3:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                    if ydist%4==2:
-                        if xdist%4==0:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%4==1:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%4==2:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%4==3:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                    if ydist%4==3:
-                        if xdist%4==0:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%4==1:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%4==2:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%4==3:
-                            drawsquare_180(self,x,y,xdist,ydist)
-        
-        if random_pattern == 10:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%4==0:
-                        if xdist%4==0:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%4==1:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%4==2:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%4==3:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                    if ydist%4==1:
-                        if xdist%4==0:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%4==1:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%4==2:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%4==3:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                    if ydist%4==2:
-                        if xdist%4==0:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%4==1:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%4==2:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%4==3:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                    if ydist%4==3:
-                        if xdist%4==0:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%4==1:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%4==2:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%4==3:
-                            drawsquare_270(self,x,y,xdist,ydist)
-        
-        if random_pattern == 11:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%2==0:
-                        if xdist%2==0:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%2==1:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                    if ydist%2==1:
-                        drawsquare_90(self,x,y,xdist,ydist)
-                        
-        if random_pattern == 12:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%8==0:
-                        if xdist%8==0:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==1:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==2:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==3:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==4:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==5:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==6:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==7:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                    elif ydist%8==1:
-                        if xdist%8==0:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==1:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==2:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==3:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==4:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==5:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==6:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==7:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                    elif ydist%8==2:
-                        if xdist%8==0:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==1:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==2:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==3:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==4:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==5:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==6:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==7:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                    elif ydist%8==3:
-                        if xdist%8==0:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==1:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==2:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==3:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==4:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==5:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==6:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==7:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                    elif ydist%8==4:
-                        if xdist%8==0:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==1:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==2:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==3:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==4:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==5:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==6:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==7:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                    elif ydist%8==5:
-                        if xdist%8==0:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==1:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==2:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==3:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==4:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==5:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==6:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==7:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                    elif ydist%8==6:
-                        if xdist%8==0:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==1:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==2:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==3:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        elif xdist%8==4:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==5:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==6:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        elif xdist%8==7:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                    elif ydist%8==7:
-                        if xdist%8==0:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==1:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==2:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==3:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==4:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==5:
-                            drawsquare_180(self,x,y,xdist,ydist)
-                        elif xdist%8==6:
-                            drawsquare_0(self,x,y,xdist,ydist)
-                        elif xdist%8==7:
-                            drawsquare_180(self,x,y,xdist,ydist)
-        if random_pattern == 13:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%4== 0:
-                        if xdist%2 == 0:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                    elif ydist%4 == 1:
-                        if xdist%2 == 0:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                    elif ydist%4 == 2:
-                        if xdist%2 == 0:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                    elif ydist%4 == 3:
-                        drawsquare_270(self,x,y,xdist,ydist)
-        
-        if random_pattern == 14:
-            for ydist in range(Ytimes):
-                for xdist in range(Xtimes):
-                    if ydist%4== 0:
-                        drawsquare_90(self,x,y,xdist,ydist)
-                        
-                    elif ydist%4 == 1:
-                        if xdist%2 == 0:
-                            drawsquare_270(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                    elif ydist%4 == 2:
-                        drawsquare_90(self,x,y,xdist,ydist)
-                    elif ydist%4 == 3:
-                        if xdist%2 == 0:
-                            drawsquare_90(self,x,y,xdist,ydist)
-                        else:
-                            drawsquare_270(self,x,y,xdist,ydist)
+        if random_pattern == 1 or random_pattern in _SQUARE_MOTIFS:
+            _put_fill(self, x, y, region_fill("aleluia_quadrados", random_pattern, None, Xtimes, Ytimes))
         self.chosen_variant = random_pattern
         return random_pattern
-                    
 
-def get_canvas_dimensions():
+
+_dimensions_from_settings = pepesettings.dimensions
+
+
+# Wallpaper mode: settings {"periodic": true, "period_width": mm, "period_height": mm}.
+# Only one block of the canvas is laid out and stored; the canvas repeats it on both axes.
+PERIOD_DEFAULT_MM = 1000
+
+
+def block_settings(settings):
+    """The settings a run lays out: settings itself, or in wallpaper mode a copy whose canvas
+    is the repeating block (period_width x period_height, never larger than the canvas)."""
+    data = settings if isinstance(settings, dict) else {}
+    if not data.get("periodic"):
+        return data
+    block = dict(data)
+    for size_key, period_key in (("canvas_width", "period_width"), ("canvas_height", "period_height")):
+        try:
+            canvas = int(data.get(size_key, 500))
+        except (TypeError, ValueError):
+            canvas = 500
+        try:
+            period = int(data.get(period_key) or PERIOD_DEFAULT_MM)
+        except (TypeError, ValueError):
+            period = PERIOD_DEFAULT_MM
+        block[size_key] = min(canvas, period)
+    return block
+
+
+def periodic_layout(settings):
+    """{'block_cols', 'block_rows', 'cols', 'rows'} (grid units) of a wallpaper-mode settings
+    dict, or None when the pattern covers the canvas itself."""
+    data = settings if isinstance(settings, dict) else {}
+    if not data.get("periodic"):
+        return None
     try:
-        if REQUEST_SETTINGS:
-            data = REQUEST_SETTINGS
-            altTela = int(data.get("canvas_height", 500))
-            largTela = int(data.get("canvas_width", 500))
-            altTela = max(100, min(10000000, altTela))
-            largTela = max(100, min(10000000, largTela))
-        else:
-            with open(DATA_FILE, "r") as f:
-                data = json.load(f)
-                altTela = int(data.get("canvas_height", 500))
-                largTela = int(data.get("canvas_width", 500))
-                altTela = max(100, min(10000000, altTela))
-                largTela = max(100, min(10000000, largTela))
-    except (FileNotFoundError, ValueError, json.JSONDecodeError):
-        altTela = 500
-        largTela = 500
-    canvas_dividend = 50
-    divLarg = int((largTela/canvas_dividend)/2)
-    divAlt = int((altTela/canvas_dividend)/2)
-    return altTela, largTela, divAlt, divLarg
+        _, _, rows, cols = _dimensions_from_settings(data)
+        _, _, block_rows, block_cols = _dimensions_from_settings(block_settings(data))
+    except (TypeError, ValueError):
+        return None
+    return {"block_cols": block_cols, "block_rows": block_rows, "cols": cols, "rows": rows}
+
+
+def _run_settings(settings):
+    """Snapshot a run lays out from (see block_settings); None for empty settings, which
+    leaves the run reading DATA_FILE."""
+    data = block_settings(settings)
+    return pepesettings.from_dict(data) if data else None
+
+
+def current_settings():
+    """Settings of the current run, or outside one (subprocess mode) of DATA_FILE."""
+    if SETTINGS is not None:
+        return SETTINGS
+    return pepesettings.load(DATA_FILE)
+
+
+def get_canvas_dimensions():
+    return current_settings().dims
+
+
+# Relative cost of one region (color pick + touching-colors check) versus drawing one tile,
+# and the fixed per-run overhead (grid setup, palette, collecting the pattern), in tile units
+REGION_COST_WEIGHT = 8
+BASE_RUN_COST = 2000
+
+
+def estimate_generation_cost(settings):
+    """Up-front size of generate(settings) without running it (no globals touched).
+
+    Returns {'tiles', 'regions', 'cost'}: tiles is divAlt x divLarg as in
+    get_canvas_dimensions(); regions assumes the average knob-dependent step that
+    StartPepeFunction.start() draws on each axis; cost is in tile units.
+    """
+    block = pepesettings.from_dict(block_settings(settings))
+    divAlt, divLarg = block.rows, block.cols
+    tiles = divAlt * divLarg
+    step = max(1.0, sum(base_RandomNum) / len(base_RandomNum) + block.knob)
+    regions = int(math.ceil(divLarg / step) * math.ceil(divAlt / step)) if tiles else 0
+    return {"tiles": tiles, "regions": regions, "cost": BASE_RUN_COST + tiles + REGION_COST_WEIGHT * regions}
 
 
 def get_final_pepecolors():
+    # The palette is unique, and a single color gets a different second one: PepeAI.GetColors
+    # draws until background and motif differ, which never happens with one distinct color
     FinalPepeColors = {}
-    All_Colors = []
-    try:
-        if REQUEST_SETTINGS:
-            data = REQUEST_SETTINGS
-        else:
-            with open(DATA_FILE, "r") as f:
-                data = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        data = {}
-
-    # Support both legacy string format ("#hex" or "off") and new object format:
-    # button_n: { state: "on"|"off", color: "#hex" }
-    for key, value in data.items():
-        if not key.startswith("button_"):
-            continue
-        # new object format
-        if isinstance(value, dict):
-            state = value.get("state")
-            color = value.get("color")
-            if state == "on" and color:
-                All_Colors.append(color)
-        else:
-            # legacy string format
-            if isinstance(value, str) and value != "off":
-                All_Colors.append(value)
+    All_Colors = current_settings().palette
     if not All_Colors:
         FinalPepeColors[0] = "black"
         FinalPepeColors[1] = "white"
@@ -626,7 +367,7 @@ def get_final_pepecolors():
     for index, color in enumerate(selected_colors):
         FinalPepeColors[index] = color
     if len(FinalPepeColors) < 2:
-        additional_color = random.choice(["black", "white"])
+        additional_color = random.choice([c for c in ("black", "white") if c != All_Colors[0]])
         FinalPepeColors[len(FinalPepeColors)] = additional_color
     return FinalPepeColors
 
@@ -636,22 +377,16 @@ canIgobackintoFuture = False
 gofoward = True
 isdrawn = 0
 
-altTela,largTela,divAlt,divLarg = get_canvas_dimensions()
+# Canvas dimensions of the current run (set by StartPepeFunction, read by PepeDrawer) and
+# its palette (set by set_new_colors()); nothing is read from disk at import
+altTela = largTela = divAlt = divLarg = None
 Filletes = []
 ADN = []
-FinalPepeColors = get_final_pepecolors()
+FinalPepeColors = {}
 
 base_RandomNum = [1, 2]
 def get_knob_value():
-    try:
-        if REQUEST_SETTINGS:
-            return int(REQUEST_SETTINGS.get("knob_down", 0))
-        with open(DATA_FILE, "r") as f:
-            data = json.load(f)
-            return int(data.get("knob_down", 0))
-    except (FileNotFoundError, ValueError, json.JSONDecodeError):
-        return 0
-    return 0
+    return current_settings().knob
 
 
 def set_new_colors():
@@ -674,32 +409,7 @@ class PepeAI:
             self.colorPattern = random.choice(self.pepeCores)
             self.colorFundo = random.choice(self.pepeCores)
     def GetPatternShape(self):
-        try:
-            if REQUEST_SETTINGS:
-                data = REQUEST_SETTINGS
-                switch_value = data.get("switch", None)
-                slider_value = int(data.get("slider", 50))
-            else:
-                with open(DATA_FILE, "r") as f:
-                    data = json.load(f)
-                    switch_value = data.get("switch", None)
-                    slider_value = int(data.get("slider", 50))
-            if switch_value == "left":
-                self.ShapeComand = "aleluia_quadrados"
-            elif switch_value == "right":
-                self.ShapeComand = "aleluia_triangulos"
-            elif switch_value == "center":
-                # Keep it simple: random choice weighted by slider (original code had an unclear block)
-                if slider_value <= 50:
-                    # bias toward squares
-                    self.ShapeComand = random.choice(["aleluia_quadrados", "aleluia_triangulos"])
-                else:
-                    self.ShapeComand = random.choice(["aleluia_triangulos", "aleluia_quadrados"])
-            else:
-                self.ShapeComand = random.choice(("aleluia_triangulos", "aleluia_quadrados"))
-            return
-        except (FileNotFoundError, json.JSONDecodeError, ValueError):
-            self.ShapeComand = random.choice(("aleluia_triangulos", "aleluia_quadrados"))
+        self.ShapeComand = pepesettings.pick_shape(current_settings())
 
 
 class PepeDrawer:
@@ -748,6 +458,8 @@ def check_for_touching_colors(self, ADN, NewPepe, a, y, NewNum):
         if (x2 >= self.Xpoints[a-1] and x1 <= self.Xpoints[a] and 
             (y1 < y + NewNum and y + NewNum > y1)):
             touched_colors.append((cor_cobaia, cor2_cobaia, pattern_cobaia))
+        elif PERIODIC and _touches_across_wrap(self, a, y, NewNum, x1, y1, x2, y2):
+            touched_colors.append((cor_cobaia, cor2_cobaia, pattern_cobaia))
         tester_i += 1
     nbr_touched_colors = len(touched_colors)
     cancel_operation = 0
@@ -764,37 +476,66 @@ def check_for_touching_colors(self, ADN, NewPepe, a, y, NewNum):
         cancel_operation += 1
     return NewPepe
 
+def _touches_across_wrap(self, a, y, NewNum, x1, y1, x2, y2):
+    """Periodic mode: does the new region touch ADN entry (x1, y1)-(x2, y2) through the block's
+    edges? The block repeats, so its right/left and bottom/top edges meet on the canvas: the
+    entry is tried shifted by one block on either axis and both (edges and corners count),
+    so a region is checked against the opposite edge whichever of the two is placed first."""
+    left, right, bottom = self.Xpoints[a-1], self.Xpoints[a], y + NewNum
+    for dx in (-self.divLarg, 0, self.divLarg):
+        for dy in (-self.divAlt, 0, self.divAlt):
+            if (dx or dy) and x2 + dx >= left and x1 + dx <= right and y2 + dy >= y and y1 + dy <= bottom:
+                return True
+    return False
+
 class StartPepeFunction:
-    def __init__(self):
+    def __init__(self, areas=None, first_region_id=1, neighbors=()):
+        """Lay out and fill the whole canvas, or only areas ((x_from, y_from, x_to, y_to) in
+        0-based grid units) when extending an existing layout (see resize()). neighbors are
+        ADN entries of kept regions the new ones must not repeat colors with."""
         self.Xpoints = [] 
         set_ADN_to_nothing()
+        ADN.extend(neighbors)
         self.altTela, self.largTela, self.divAlt, self.divLarg = get_canvas_dimensions()
         # Initialize gridValues here
-        global gridValues
-        gridValues = [[[] for _ in range(self.divAlt + 2)] for _ in range(self.divLarg + 2)]
+        global gridValues, altTela, largTela, divAlt, divLarg
+        altTela, largTela, divAlt, divLarg = self.altTela, self.largTela, self.divAlt, self.divLarg
+        if STRIP_SINK is not None or areas is not None:
+            # Streaming, or only some areas: allocate just the columns that get drawn
+            gridValues = defaultdict(lambda: defaultdict(list))
+        else:
+            gridValues = [[[] for _ in range(self.divAlt + 2)] for _ in range(self.divLarg + 2)]
         print("\nPadrão com ", self.divAlt*self.divLarg, " mosaicos || largura:", self.largTela, "altura:", self.altTela, "\n")
-        self.start()
-    def start(self):
+        self.region_counter = first_region_id
+        for area in (areas if areas is not None else [(0, 0, self.divLarg, self.divAlt)]):
+            self.start(*area)
+    def start(self, x_from=0, y_from=0, x_to=None, y_to=None):
+        x_to = self.divLarg if x_to is None else x_to
+        y_to = self.divAlt if y_to is None else y_to
         knob_value = get_knob_value()
         RandomNum = [num + knob_value for num in base_RandomNum]
-        x = 0
-        region_counter = 1
-        while x < self.divLarg:
+        x = x_from
+        region_counter = self.region_counter
+        self.Xpoints = []
+        while x < x_to:
             self.Xpoints.append(x)
             NewNum = random.choice(RandomNum)
             x = x + NewNum
-        self.Xpoints.append(self.divLarg)
+        self.Xpoints.append(x_to)
         self.rowNumber = len(self.Xpoints)
         a = 0
         while a < self.rowNumber-1:
             a = a + 1
+            # Column-strip boundary: stop early if a newer request superseded this run
+            _check_cancelled()
             self.Ypoints = []
-            y = 0
-            while y < self.divAlt:
+            y = y_from
+            while y < y_to:
+                _check_cancelled()
                 self.Ypoints.append(y)
                 NewNum = random.choice(RandomNum)
-                if y + NewNum > self.divAlt:
-                    NewNum = self.divAlt - y
+                if y + NewNum > y_to:
+                    NewNum = y_to - y
                 NewPepe = PepeAI()
                 NewPepe = check_for_touching_colors(self,ADN,NewPepe,a,y,NewNum)
                 # Compute 1-based bounds
@@ -820,6 +561,60 @@ class StartPepeFunction:
                 REGIONS.append(region_entry)
                 region_counter += 1
                 y = y + NewNum
+            if STRIP_SINK is not None:
+                _flush_strip(self.Xpoints[a-1], self.Xpoints[a])
+        self.region_counter = region_counter
+
+
+def _tile_record(entry, i, j):
+    t = dict(entry)
+    t["grid_x"] = i
+    t["grid_y"] = j
+    # Remove 'coordinates' tuple to avoid duplication (optional)
+    if "coordinates" in t:
+        del t["coordinates"]
+    return t
+
+
+def _flush_strip(x_from, x_to):
+    """Streaming mode: hand the finished column strip (grid columns x_from+1..x_to) and its
+    regions to STRIP_SINK, then drop them.
+
+    Tiles come out in the same column-major order draw_pepe() uses. Only regions of the
+    strip just finished can touch the next one, so older ADN entries are dropped too;
+    the touching-colors check sees the same candidates and consumes the same random
+    numbers, so a seed gives the same pattern in both modes.
+    """
+    tiles = []
+    for i in range(x_from + 1, x_to + 1):
+        col = gridValues.pop(i, None)
+        if not col:
+            continue
+        for j in sorted(col):
+            for entry in col[j]:
+                tiles.append(_tile_record(entry, i, j))
+    STRIP_SINK(tiles, list(REGIONS))
+    del REGIONS[:]
+    del Filletes[:]
+    # (periodic blocks keep their first strip: the last one wraps around to touch it)
+    ADN[:] = [dna for dna in ADN if dna[3][0] >= x_to or (PERIODIC and dna[2][0] == 0)]
+
+def _fill_queued():
+    """Progressive mode, second pass: the layout is complete (REGIONS), hand it to
+    PROGRESS('layout', regions, []), then write the queued fills in layout order, passing
+    each batch of new grid entries to PROGRESS('fill', regions_done, entries)."""
+    global FILL_QUEUE
+    queue, FILL_QUEUE = FILL_QUEUE, None
+    PROGRESS('layout', list(REGIONS), [])
+    batch = []
+    for done, fill in enumerate(queue, 1):
+        _check_cancelled()
+        _write_fill(*fill, out=batch)
+        if len(batch) >= PROGRESS_BATCH_TILES:
+            PROGRESS('fill', done, batch)
+            batch = []
+    PROGRESS('fill', len(queue), batch)
+
 
 def draw_pepe(write_to_file=True):
     # reset regions for a fresh run
@@ -827,21 +622,20 @@ def draw_pepe(write_to_file=True):
     REGIONS = []
     set_new_colors()
     StartPepeFunction()
+    if FILL_QUEUE is not None:
+        _fill_queued()
+    if STRIP_SINK is not None:
+        # Everything already went to the sink strip by strip
+        return None
     # Collect all non-empty grid values
     pattern_data = []
     for i, col in enumerate(gridValues):
         for j, cell in enumerate(col):
             if cell:  # Only add non-empty cells
                 for entry in cell:
-                    entry_with_coords = dict(entry)
-                    entry_with_coords["grid_x"] = i
-                    entry_with_coords["grid_y"] = j
-                    # Remove 'coordinates' tuple to avoid duplication (optional)
-                    if "coordinates" in entry_with_coords:
-                        del entry_with_coords["coordinates"]
-                    pattern_data.append(entry_with_coords)
+                    pattern_data.append(_tile_record(entry, i, j))
     if write_to_file:
-        # Ensure user_data directory exists (should already)
+        # Ensure user_data directory exists (created here, not at import)
         os.makedirs(os.path.dirname(PATTERN_FILE), exist_ok=True)
         # Write the pattern to file, then mark generation done
         with open(PATTERN_FILE, "w") as f:
@@ -859,15 +653,31 @@ def draw_pepe(write_to_file=True):
          return pattern_data
 
 
-def generate(settings=None, seed=None):
+def generate(settings=None, seed=None, cancel=None, sink=None, progress=None):
     """
     Minimal adapter for Flask:
       - settings: dict (same structure previously stored in data.json)
-      - returns: pattern_data (list of tile dicts)
+      - cancel: optional zero-arg callable; when it returns True the run stops at the next
+        column strip / region / fill row and GenerationCancelled is raised
+      - sink: optional callable(tiles, regions); streaming mode for canvases too large to
+        hold in memory: each finished column strip is passed to it and then discarded
+      - progress: optional callable(stage, regions_or_count, entries); progressive mode (not
+        with sink): the whole layout is computed first and passed as progress('layout',
+        regions, []), then regions are filled in layout order and every batch of new tiles is
+        passed as progress('fill', regions_filled, entries) (grid entries with 'coordinates'
+        instead of grid_x/grid_y). Fills are only deferred, so a seed gives the same pattern
+      - returns: pattern_data (list of tile dicts), or None when streaming
+    In wallpaper mode (settings["periodic"]) only the repeating block is generated, with
+    colors checked across its edges so copies of it join seamlessly (see periodic_layout).
     """
-    global REQUEST_SETTINGS, gridValues, Filletes, ADN, FinalPepeColors, canIgoback, canIgobackintoFuture, gofoward, isdrawn
+    global SETTINGS, CANCEL_CHECK, STRIP_SINK, PERIODIC, PROGRESS, FILL_QUEUE, gridValues, Filletes, ADN, FinalPepeColors, canIgoback, canIgobackintoFuture, gofoward, isdrawn
     # Reset any global state we reuse
-    REQUEST_SETTINGS = settings or {}
+    SETTINGS = _run_settings(settings)
+    PERIODIC = bool((settings or {}).get("periodic"))
+    CANCEL_CHECK = cancel
+    STRIP_SINK = sink
+    PROGRESS = progress if sink is None else None
+    FILL_QUEUE = [] if PROGRESS is not None else None
     Filletes = []
     ADN = []
     set_new_colors()
@@ -880,65 +690,136 @@ def generate(settings=None, seed=None):
     # Ensure gridValues exists and is cleared by StartPepeFunction, but set to empty here
     gridValues = {}
     # Run generator but ask it to return data instead of writing files
-    pattern = draw_pepe(write_to_file=False)
-    # Clean up / reset REQUEST_SETTINGS to avoid bleed
-    REQUEST_SETTINGS = None
+    try:
+        pattern = draw_pepe(write_to_file=False)
+    finally:
+        # Clean up / reset SETTINGS to avoid bleed
+        SETTINGS = None
+        CANCEL_CHECK = None
+        STRIP_SINK = None
+        PERIODIC = False
+        PROGRESS = None
+        FILL_QUEUE = None
     return pattern
 
+def resize(pattern, regions, settings=None, seed=None, cancel=None):
+    """
+    Fit an existing layout to settings' canvas instead of regenerating it:
+      - regions entirely inside the new grid are kept as they are, regions crossing the new
+        right/bottom edge are clipped, regions beyond it are dropped (with their tiles)
+      - when the canvas grows, only the exposed strips (right: full new height; bottom:
+        under the kept columns) are laid out and filled, as generate() would; kept regions
+        along the old edge seed the touching-colors check
+      - returns (pattern, regions); new regions get ids after the largest kept id
+    Fills are anchored at a region's top-left corner, so kept tiles stay valid when clipped.
+    In wallpaper mode the layout is the repeating block: it is fitted to the new block size,
+    which is unchanged (nothing to do) unless the canvas became smaller than one period.
+    """
+    global SETTINGS, CANCEL_CHECK, PERIODIC, Filletes, REGIONS, gridValues
+    SETTINGS = _run_settings(settings)
+    PERIODIC = bool((settings or {}).get("periodic"))
+    CANCEL_CHECK = cancel
+    try:
+        _, _, rows, cols = get_canvas_dimensions()
+        old_cols = max([int(r['x2']) for r in regions] or [0])
+        old_rows = max([int(r['y2']) for r in regions] or [0])
+        keep_cols, keep_rows = min(old_cols, cols), min(old_rows, rows)
+        kept = []
+        neighbors = []
+        for r in regions:
+            if int(r['x1']) > cols or int(r['y1']) > rows:
+                continue
+            r = dict(r, x2=min(int(r['x2']), cols), y2=min(int(r['y2']), rows))
+            kept.append(r)
+            grows = (cols > old_cols and r['x2'] == keep_cols) or (rows > old_rows and r['y2'] == keep_rows)
+            # A periodic block's new edge strips also touch its first column / row (wrap-around)
+            wraps = PERIODIC and (cols > old_cols or rows > old_rows) and (int(r['x1']) == 1 or int(r['y1']) == 1)
+            if grows or wraps:
+                # ADN form: 0-based start corner, 1-based (exclusive) end corner
+                neighbors.append((r.get('color_fundo'), r.get('color_padrao'), (int(r['x1']) - 1, int(r['y1']) - 1),
+                                  (r['x2'], r['y2']), r.get('shape')))
+        tiles = [t for t in pattern if int(t.get('grid_x') or 0) <= cols and int(t.get('grid_y') or 0) <= rows]
+        areas = []
+        if cols > old_cols:
+            areas.append((old_cols, 0, cols, rows))
+        if rows > old_rows:
+            areas.append((0, old_rows, keep_cols, rows))
+        REGIONS = []
+        if areas:
+            Filletes = []
+            # Seed first: the palette shuffle is part of what a seed reproduces
+            if seed is not None:
+                try:
+                    random.seed(int(seed))
+                except Exception:
+                    pass
+            set_new_colors()
+            StartPepeFunction(areas=areas, first_region_id=max([int(r['id']) for r in kept] or [0]) + 1,
+                              neighbors=neighbors)
+            for i in sorted(gridValues):
+                col = gridValues[i]
+                for j in sorted(col):
+                    for entry in col[j]:
+                        tiles.append(_tile_record(entry, i, j))
+            gridValues = {}
+        return tiles, kept + REGIONS
+    finally:
+        SETTINGS = None
+        CANCEL_CHECK = None
+        PERIODIC = False
+
 def generate_region(region_id, x1_1b, y1_1b, x2_1b, y2_1b, shape, variant, color_fundo, color_padrao, settings=None, seed=None):
     """
     Generate tiles for a single region (bounds are 1-based inclusive).
     Returns a flat list of tile dicts with grid_x/y and region_id set.
     """
     # Ensure canvas/grid settings align with current data
-    global REQUEST_SETTINGS, gridValues, Filletes
-    prev_settings = REQUEST_SETTINGS
-    REQUEST_SETTINGS = settings or {}
-    # Deterministic seed (prefer provided, else derive from region)
-    if seed is not None:
-        try:
-            random.seed(int(seed))
-        except Exception:
-            pass
-    # compute grid dims
-    at, lt, da, dl = get_canvas_dimensions()
-    # prepare state
-    gridValues = [[[] for _ in range(da + 2)] for _ in range(dl + 2)]
-    Filletes = []
-    # Convert 1-based bounds back to 0-based for PatternStyles baseline x,y
-    x0 = max(0, int(x1_1b) - 1)
-    y0 = max(0, int(y1_1b) - 1)
-    sizeX_tiles = max(0, int(x2_1b) - int(x1_1b) + 1)
-    sizeY_tiles = max(0, int(y2_1b) - int(y1_1b) + 1)
-    # pixel sizes for fillete
-    realX = sizeX_tiles * (lt / dl)
-    realY = sizeY_tiles * (at / da)
-    Filletes.append((x0, y0, realX, realY))
-    patternEssencials = [dl, da, lt, at]
-    patrao = PatternStyles(color_fundo, color_padrao, Filletes, patternEssencials, (x0, y0), (x0+sizeX_tiles, y0+sizeY_tiles), region_id=region_id)
-    if shape == "aleluia_quadrados":
-        patrao.aleluia_quadrados(variant)
-    else:
-        patrao.aleluia_triangulos(variant)
-    # Flatten just this grid
-    tiles = []
-    for i, col in enumerate(gridValues):
-        for j, cell in enumerate(col):
-            if cell:
-                for entry in cell:
-                    t = dict(entry)
-                    t["grid_x"] = i
-                    t["grid_y"] = j
-                    if "coordinates" in t:
-                        del t["coordinates"]
-                    tiles.append(t)
-    # restore REQUEST_SETTINGS
-    REQUEST_SETTINGS = prev_settings
-    return tiles
+    global SETTINGS, gridValues, Filletes
+    prev_settings = SETTINGS
+    SETTINGS = _run_settings(settings)
+    try:
+        # Deterministic seed (prefer provided, else derive from region)
+        if seed is not None:
+            try:
+                random.seed(int(seed))
+            except Exception:
+                pass
+        # compute grid dims
+        at, lt, da, dl = get_canvas_dimensions()
+        # prepare state: only the region's own columns get allocated, not the whole canvas
+        gridValues = defaultdict(lambda: defaultdict(list))
+        Filletes = []
+        # Convert 1-based bounds back to 0-based for PatternStyles baseline x,y
+        x0 = max(0, int(x1_1b) - 1)
+        y0 = max(0, int(y1_1b) - 1)
+        sizeX_tiles = max(0, int(x2_1b) - int(x1_1b) + 1)
+        sizeY_tiles = max(0, int(y2_1b) - int(y1_1b) + 1)
+        # pixel sizes for fillete
+        realX = sizeX_tiles * (lt / dl)
+        realY = sizeY_tiles * (at / da)
+        Filletes.append((x0, y0, realX, realY))
+        patternEssencials = [dl, da, lt, at]
+        patrao = PatternStyles(color_fundo, color_padrao, Filletes, patternEssencials, (x0, y0), (x0+sizeX_tiles, y0+sizeY_tiles), region_id=region_id)
+        if shape == "aleluia_quadrados":
+            patrao.aleluia_quadrados(variant)
+        else:
+            patrao.aleluia_triangulos(variant)
+        # Flatten just this grid (column by column, as draw_pepe does)
+        tiles = []
+        for i in sorted(gridValues):
+            col = gridValues[i]
+            for j in sorted(col):
+                for entry in col[j]:
+                    tiles.append(_tile_record(entry, i, j))
+        return tiles
+    finally:
+        # restore SETTINGS (also when the region fails: later requests share this module)
+        SETTINGS = prev_settings
 
 if __name__ == '__main__':
     # When run as a script, produce files for backward compatibility
-    global gridValues
+    # Session id from environment or argv (subprocess mode)
+    configure_session(os.environ.get('SESSION_ID') or (sys.argv[1] if len(sys.argv) > 1 else None))
     gridValues = {}
     # If the script is invoked directly as a subprocess, write per-session pattern file as configured above
     try:
@@ -5,8 +5,14 @@ import sys
 import uuid
 import time
 import json
+import math
+import gzip
+import socket
+import hashlib
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor
 
 # Optional speed-ups (safe fallbacks if unavailable)
 try:
@@ -17,6 +23,18 @@ try:
     from flask_compress import Compress as _FlaskCompress
 except Exception:
     _FlaskCompress = None
+try:
+    import brotli as _brotli
+except Exception:
+    _brotli = None
+try:
+    import zstandard as _zstd
+except Exception:
+    _zstd = None
+try:
+    import fcntl as _fcntl  # POSIX file locks (user_data is shared by gunicorn workers)
+except Exception:
+    _fcntl = None
 
 # For region-level editing, import helpers from PepesMachine
 try:
@@ -24,6 +42,13 @@ try:
 except Exception:
     pm = None
 
+import history
+import jobstore
+import pepesettings
+import render
+import scheduler
+import tilestore
+
 USER_DATA_DIR = os.path.join(os.path.dirname(__file__), 'user_data')
 os.makedirs(USER_DATA_DIR, exist_ok=True)
 
@@ -38,6 +63,54 @@ if _FlaskCompress is not None:
 USER_DATA_MAX_BYTES = int(os.environ.get('USER_DATA_MAX_BYTES', 50 * 1024 * 1024))  # default 50 MB
 USER_DATA_MAX_FILES = int(os.environ.get('USER_DATA_MAX_FILES', 1000))              # default 1000 files
 USER_DATA_MAX_AGE_DAYS = int(os.environ.get('USER_DATA_MAX_AGE_DAYS', 30))         # delete files older than 30 days
+PRECOMPRESS_MIN_BYTES = int(os.environ.get('PRECOMPRESS_MIN_BYTES', 1024))          # skip sidecars for tiny files
+# Job coordination: 'local' (single process) or 'sqlite' (shared by multi-worker servers, see server.py)
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'local')
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join(USER_DATA_DIR, 'jobs.sqlite3'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+# Generation scheduling: worker threads per process (pm's globals serialize actual runs, so
+# >1 only helps once generation moves off-process) and concurrent jobs per session
+GEN_WORKERS = int(os.environ.get('GEN_WORKERS', 1))
+GEN_PER_SESSION_LIMIT = int(os.environ.get('GEN_PER_SESSION_LIMIT', 1))
+# Admission control: working-memory budget of one generation and of all admitted ones in
+# this process, the largest pattern file a run may write, and rough per-tile sizes used to
+# estimate them (measured: ~1.1 KB per tile while generating, ~150 B per tile of JSON)
+GEN_REQUEST_MEMORY_BYTES = int(os.environ.get('GEN_REQUEST_MEMORY_BYTES', 512 * 1024 * 1024))
+GEN_GLOBAL_MEMORY_BYTES = int(os.environ.get('GEN_GLOBAL_MEMORY_BYTES', 1024 * 1024 * 1024))
+GEN_MAX_OUTPUT_BYTES = int(os.environ.get('GEN_MAX_OUTPUT_BYTES', USER_DATA_MAX_BYTES))
+GEN_MEMORY_BYTES_PER_TILE = 1100
+GEN_OUTPUT_BYTES_PER_TILE = 150
+# Out-of-process generation (generator_daemon.py): 'inprocess' uses the daemon only when
+# PepesMachine cannot be imported here, 'daemon' always isolates generation in it
+GEN_MODE = os.environ.get('GEN_MODE', 'inprocess')
+GEN_DAEMON_SOCKET = os.environ.get('GEN_DAEMON_SOCKET', os.path.join(USER_DATA_DIR, 'generator.sock'))
+GEN_DAEMON_WORKERS = int(os.environ.get('GEN_DAEMON_WORKERS', 1))
+GEN_DAEMON_TIMEOUT = float(os.environ.get('GEN_DAEMON_TIMEOUT', 300))
+# Speculative pre-generation (opt-in): patterns buffered per active session for its current
+# settings, so the next /generate is served at once; only canvases up to MAX_TILES, and a
+# session's buffer is dropped after TTL seconds without a /generate
+GEN_SPECULATIVE_DEPTH = int(os.environ.get('GEN_SPECULATIVE_DEPTH', 0))
+GEN_SPECULATIVE_MAX_TILES = int(os.environ.get('GEN_SPECULATIVE_MAX_TILES', 100000))
+GEN_SPECULATIVE_TTL = float(os.environ.get('GEN_SPECULATIVE_TTL', 600))
+# How often a running generation re-checks the job store for a newer request
+CANCEL_POLL_SECONDS = float(os.environ.get('CANCEL_POLL_SECONDS', 0.05))
+# /edit-regions batches: max ops per request, and the batch size (in tiles) above which
+# affected regions are generated in a process pool instead of sequentially in-process
+EDIT_BATCH_MAX_OPS = int(os.environ.get('EDIT_BATCH_MAX_OPS', 500))
+EDIT_BATCH_PARALLEL_MIN_TILES = int(os.environ.get('EDIT_BATCH_PARALLEL_MIN_TILES', 50000))
+# Undo/redo op log per session (see history.py): entries kept, and ops between whole-state snapshots
+HISTORY_MAX_ENTRIES = int(os.environ.get('HISTORY_MAX_ENTRIES', 50))
+HISTORY_SNAPSHOT_EVERY = int(os.environ.get('HISTORY_SNAPSHOT_EVERY', 20))
+# Server-side rendering: default/max long side of /render.* images, and bytes of encoded
+# images/tiles kept in memory (keyed by pattern version)
+RENDER_DEFAULT_SIDE = int(os.environ.get('RENDER_DEFAULT_SIDE', 2048))
+RENDER_MAX_SIDE = int(os.environ.get('RENDER_MAX_SIDE', 8192))
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Parsed patterns kept in memory (most recently used sessions) for rendering/range queries
+PATTERN_CACHE_MAX_ENTRIES = int(os.environ.get('PATTERN_CACHE_MAX_ENTRIES', 16))
+# /pattern range queries: index bucket size (cells) and max tiles per response
+PATTERN_RANGE_BUCKET = int(os.environ.get('PATTERN_RANGE_BUCKET', 32))
+PATTERN_RANGE_MAX_TILES = int(os.environ.get('PATTERN_RANGE_MAX_TILES', 20000))
 
 def cleanup_user_data(max_bytes=USER_DATA_MAX_BYTES, max_files=USER_DATA_MAX_FILES, max_age_days=USER_DATA_MAX_AGE_DAYS):
     """
@@ -52,9 +125,11 @@ def cleanup_user_data(max_bytes=USER_DATA_MAX_BYTES, max_files=USER_DATA_MAX_FIL
             path = os.path.join(USER_DATA_DIR, name)
             if not os.path.isfile(path):
                 continue
-            # skip any accidental global files
+            # skip any accidental global files and the shared job database
             if name in ('data.json', 'pattern.json'):
                 continue
+            if name.startswith('jobs.sqlite3'):
+                continue
             st = os.stat(path)
             size = st.st_size
             mtime = st.st_mtime
@@ -110,26 +185,196 @@ def _json_load_file(path, default=None):
         return default
 
 
-def _json_dump_file(obj, path):
+def _json_bytes(obj):
+    if _orjson is not None:
+        return _orjson.dumps(obj, option=_orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _json_dump_file(obj, path, precompress=False):
     try:
-        if _orjson is not None:
-            data = _orjson.dumps(obj, option=_orjson.OPT_NON_STR_KEYS)
-        else:
-            data = json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        data = _json_bytes(obj)
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, 'wb') as f:
-            f.write(data)
+        if precompress:
+            _write_json_artifact(path, data)
+        else:
+            _write_bytes_atomic(path, data)
         return True
     except Exception as e:
         print("json dump error:", e)
         return False
 
 
+def _write_bytes_atomic(path, data):
+    """Replace path with data; returns the stat of the file written."""
+    tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        st = os.fstat(f.fileno())
+    os.replace(tmp, path)
+    return st
+
+
+_file_local_lock = threading.Lock()  # only without fcntl (one process)
+
+
+@contextmanager
+def _file_lock(lock_path):
+    """Exclusive lock across threads and gunicorn workers: flock on lock_path (each holder
+    opens its own descriptor, so threads of one process exclude each other too)."""
+    if _fcntl is None:
+        with _file_local_lock:
+            yield
+        return
+    with open(lock_path, 'a') as f:
+        _fcntl.flock(f.fileno(), _fcntl.LOCK_EX)
+        try:
+            # Fresh mtime: cleanup_user_data evicts oldest files first
+            os.utime(lock_path)
+            yield
+        finally:
+            _fcntl.flock(f.fileno(), _fcntl.LOCK_UN)
+
+
+# -------- Precompressed sidecars (.br/.zst/.gz written once, served with sendfile) --------
+# <path>.enc records the sidecars written and the main file they encode,
+# {"source": [inode, size, mtime_ns], "encodings": [...]}; a sidecar is served only while
+# path is still that file. Writers hold <path>.lock from dropping the old record to writing
+# the new one, so a record never vouches for sidecars of another write, and a main file
+# replaced any other way (no record, or another inode) is served uncompressed.
+# Preference order when the client accepts several encodings.
+_SIDECAR_ENCODINGS = (('br', '.br'), ('zstd', '.zst'), ('gzip', '.gz'))
+
+
+def _sidecar_record_path(path):
+    return path + '.enc'
+
+
+def _stat_key(st):
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+def _compress_for(encoding, data):
+    if encoding == 'br':
+        return _brotli.compress(data, quality=9) if _brotli is not None else None
+    if encoding == 'zstd':
+        return _zstd.ZstdCompressor(level=10).compress(data) if _zstd is not None else None
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    return None
+
+
+def _write_json_artifact(path, data, tmp=None):
+    """Replace path with data (or by moving tmp, which holds data) and refresh its sidecars."""
+    with _file_lock(path + '.lock'):
+        _remove_files([_sidecar_record_path(path)])
+        if tmp is not None:
+            st = os.stat(tmp)
+            os.replace(tmp, path)
+        else:
+            st = _write_bytes_atomic(path, data)
+        _write_precompressed(path, data, st)
+
+
+def _write_precompressed(path, data, st):
+    """Write compressed sidecars of data next to path, then the record naming them (the
+    caller holds path's lock and has removed the old record; st is path's stat)."""
+    written = []
+    for encoding, ext in _SIDECAR_ENCODINGS:
+        sidecar = path + ext
+        try:
+            blob = _compress_for(encoding, data) if len(data) >= PRECOMPRESS_MIN_BYTES else None
+            if blob is None:
+                if os.path.exists(sidecar):
+                    os.remove(sidecar)
+                continue
+            _write_bytes_atomic(sidecar, blob)
+            written.append(encoding)
+        except Exception as e:
+            print("precompress error:", sidecar, e)
+    if written:
+        _write_bytes_atomic(_sidecar_record_path(path), _json_bytes({"source": _stat_key(st), "encodings": written}))
+
+
+def _accepted_encodings():
+    """Parse Accept-Encoding into the set of codings with q > 0."""
+    accepted = set()
+    for part in (request.headers.get('Accept-Encoding') or '').split(','):
+        bits = part.strip().split(';')
+        coding = bits[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for b in bits[1:]:
+            b = b.strip()
+            if b.startswith('q='):
+                try:
+                    q = float(b[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def _no_store(resp):
+    resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+    resp.headers['Pragma'] = 'no-cache'
+    resp.headers['Expires'] = '0'
+    return resp
+
+
+def _send_json_artifact(path):
+    """Serve a JSON artifact, preferring a fresh precompressed sidecar the client accepts.
+    send_file hands the open file to the WSGI server's file_wrapper (sendfile where supported)
+    and Content-Encoding makes Flask-Compress leave the body alone."""
+    accepted = _accepted_encodings()
+    record = _json_load_file(_sidecar_record_path(path), None) if accepted else None
+    try:
+        fresh = isinstance(record, dict) and record.get('source') == _stat_key(os.stat(path))
+    except OSError:
+        fresh = False
+    if fresh:
+        for encoding, ext in _SIDECAR_ENCODINGS:
+            if encoding not in accepted or encoding not in (record.get('encodings') or []):
+                continue
+            try:
+                # Opened here: a write landing after this still sends one whole version
+                sidecar = open(path + ext, 'rb')
+            except OSError:
+                continue
+            resp = send_file(sidecar, mimetype='application/json', conditional=False, etag=False)
+            resp.headers['Content-Encoding'] = encoding
+            resp.headers['Vary'] = 'Accept-Encoding'
+            return _no_store(resp)
+    resp = send_file(path, mimetype='application/json')
+    return _no_store(resp)
+
+
 # -------- Generation Job Manager (per-session, last-write-wins) --------
 _pm_global_lock = threading.Lock()  # serialize in-process generation (pm has module-level globals)
-_job_states = {}  # sid -> { 'version': int, 'running': bool }
-_job_states_lock = threading.Lock()
-_executor = ThreadPoolExecutor(max_workers=1)  # single worker due to pm global state
+# Guards _pm_foreground and the speculative buffers (see Speculative pre-generation below)
+_speculative_lock = threading.Lock()
+_pm_foreground = 0  # requests waiting for or holding _pm_global_lock through _pm_lock()
+
+
+@contextmanager
+def _pm_lock():
+    """_pm_global_lock for real work; a speculative run holding it sees _pm_foreground and gives way."""
+    global _pm_foreground
+    with _speculative_lock:
+        _pm_foreground += 1
+    try:
+        with _pm_global_lock:
+            yield
+    finally:
+        with _speculative_lock:
+            _pm_foreground -= 1
+
+
+_jobs = jobstore.make_job_store(JOB_BACKEND, JOB_DB_PATH, lease_seconds=JOB_LEASE_SECONDS)
+# Jobs from different sessions are ordered by estimated cost, not arrival (see scheduler.py)
+_scheduler = scheduler.FairScheduler(workers=GEN_WORKERS, per_key_limit=GEN_PER_SESSION_LIMIT, name='generate')
 
 
 def _pattern_path_for(sid):
@@ -156,6 +401,18 @@ def _data_path_for(sid):
     return os.path.join(USER_DATA_DIR, f"data_{sid}.json")
 
 
+def _history_path_for(sid):
+    if not sid:
+        return os.path.join(os.path.dirname(__file__), 'history.json')
+    return os.path.join(USER_DATA_DIR, f"history_{sid}.json")
+
+
+def _session_lock(sid):
+    """Exclusive access to one session's pattern, regions and meta for a whole load -> change
+    -> save (region edits, generation commits, undo/redo), across threads and gunicorn workers."""
+    return _file_lock(_pattern_path_for(sid) + '.session.lock')
+
+
 def _run_marker_for(sid):
     return os.path.join(USER_DATA_DIR, f"generate_{sid}.running") if sid else os.path.join(os.path.dirname(__file__), 'generate.running')
 
@@ -164,6 +421,10 @@ def _done_marker_for(sid):
     return os.path.join(USER_DATA_DIR, f"generate_{sid}.done") if sid else os.path.join(os.path.dirname(__file__), 'generate.done')
 
 
+def _error_marker_for(sid):
+    return os.path.join(USER_DATA_DIR, f"generate_{sid}.error") if sid else os.path.join(os.path.dirname(__file__), 'generate.error')
+
+
 def _ensure_running_marker(sid):
     run_marker = _run_marker_for(sid)
     try:
@@ -173,11 +434,35 @@ def _ensure_running_marker(sid):
         pass
 
 
+def _resize_marker_for(sid):
+    return os.path.join(USER_DATA_DIR, f"generate_{sid}.resize") if sid else os.path.join(os.path.dirname(__file__), 'generate.resize')
+
+
+def _take_resize_request(sid):
+    """True (once) if the latest /generate asked to fit the current layout to a new canvas size."""
+    try:
+        os.remove(_resize_marker_for(sid))
+        return True
+    except OSError:
+        return False
+
+
 def _remove_done_marker(sid):
-    done_marker = _done_marker_for(sid)
+    for marker in (_done_marker_for(sid), _error_marker_for(sid)):
+        try:
+            if os.path.exists(marker):
+                os.remove(marker)
+        except Exception:
+            pass
+
+
+def _mark_failed_and_clear_running(sid, payload):
+    """Record why a run could not finish; /generate/status reports it as status 'error'."""
+    _json_dump_file(payload, _error_marker_for(sid))
     try:
-        if os.path.exists(done_marker):
-            os.remove(done_marker)
+        run_marker = _run_marker_for(sid)
+        if os.path.exists(run_marker):
+            os.remove(run_marker)
     except Exception:
         pass
 
@@ -197,25 +482,310 @@ def _mark_done_and_clear_running(sid):
         pass
 
 
-def _get_or_create_job_state(sid):
-    with _job_states_lock:
-        st = _job_states.get(sid)
-        if st is None:
-            st = {'version': 0, 'running': False}
-            _job_states[sid] = st
-        return st
+# -------- Admission control (resource governor) --------
+# Every generation is sized before it is queued. A run whose list-of-dicts pattern (or its
+# JSON file) would not fit the budgets is switched to streaming mode: pm hands over one
+# column strip at a time and it is written into a memory-mapped tile store (tilestore.py)
+# instead of pattern.json, so memory follows the canvas height instead of its area.
+# Requests that cannot fit either way get a 413; requests that would push the admitted
+# runs of this process over GEN_GLOBAL_MEMORY_BYTES get a 429 with Retry-After.
+_admitted_lock = threading.Lock()
+_admitted_bytes = {}  # sid -> working-memory estimate of its admitted (queued or running) job
+# sid -> _worker_generate_latest runs submitted in this process. A /generate coalesced into a
+# run another gunicorn worker owns (JOB_BACKEND=sqlite) reserves nothing here.
+_local_workers = {}
+
+
+def _admission_estimate(settings):
+    """Generation estimate plus memory/output sizes and the mode the run would use."""
+    estimate = dict(_generation_estimate(settings))
+    tiles = estimate['tiles']
+    try:
+        knob_value = max(0, int((settings or {}).get('knob_down', 0)))
+    except (TypeError, ValueError):
+        knob_value = 0
+    # (wallpaper mode lays out and stores only the repeating block)
+    _at, _lt, rows, cols = pm._dimensions_from_settings(pm.block_settings(settings)) if pm is not None else (0, 0, 0, 0)
+    max_regions = tilestore.max_regions_for(cols, rows, knob_value)
+    memory_bytes = tiles * GEN_MEMORY_BYTES_PER_TILE
+    json_bytes = tiles * GEN_OUTPUT_BYTES_PER_TILE
+    # Streaming keeps the unfinished strip and the one before it (ADN); strips are at most knob+2 columns
+    stream_bytes = 2 * rows * (knob_value + 2) * GEN_MEMORY_BYTES_PER_TILE
+    store_bytes = tilestore.file_size_for(cols, rows, max_regions)
+    estimate.update({
+        'cols': cols,
+        'rows': rows,
+        'max_regions': max_regions,
+        'memory_bytes': memory_bytes,
+        'stream_memory_bytes': stream_bytes,
+        'seconds': round(estimate['cost'] * _scheduler.seconds_per_unit, 2),
+    })
+    if memory_bytes <= GEN_REQUEST_MEMORY_BYTES and json_bytes <= GEN_MAX_OUTPUT_BYTES:
+        estimate.update(mode='memory', output_bytes=json_bytes, working_bytes=memory_bytes)
+    elif stream_bytes <= GEN_REQUEST_MEMORY_BYTES and store_bytes <= GEN_MAX_OUTPUT_BYTES:
+        estimate.update(mode='streaming', output_bytes=store_bytes, working_bytes=stream_bytes)
+    else:
+        estimate.update(mode=None, output_bytes=min(json_bytes, store_bytes), working_bytes=stream_bytes)
+    return estimate
+
+
+def _admission_limits():
+    return {
+        'request_memory_bytes': GEN_REQUEST_MEMORY_BYTES,
+        'global_memory_bytes': GEN_GLOBAL_MEMORY_BYTES,
+        'max_output_bytes': GEN_MAX_OUTPUT_BYTES,
+    }
+
+
+def _admit(sid, estimate):
+    """Reserve the estimate's working memory for sid. Returns None, or (payload, status) to reject with."""
+    if estimate['mode'] is None:
+        return {"status": "error", "message": "Canvas too large to generate on this server",
+                "estimate": estimate, "limits": _admission_limits()}, 413
+    with _admitted_lock:
+        others = [s for s in _admitted_bytes if s != sid]
+        in_use = sum(_admitted_bytes[s] for s in others)
+        if others and in_use + estimate['working_bytes'] > GEN_GLOBAL_MEMORY_BYTES:
+            # Suggest retrying once the admitted jobs are expected to be done
+            eta = max((_scheduler.position(s) or {}).get('eta_seconds', 1) for s in others)
+            return {"status": "error", "message": "Server busy with large canvases, retry shortly",
+                    "estimate": estimate, "limits": _admission_limits(),
+                    "retry_after": max(1, int(math.ceil(eta)))}, 429
+        _admitted_bytes[sid] = estimate['working_bytes']
+    return None
+
+
+def _release_admission(sid):
+    """Called as a local worker exits; the reservation goes with the last one."""
+    with _admitted_lock:
+        left = _local_workers.get(sid, 0) - 1
+        if left > 0:
+            # A request admitted after the worker's last run started another one
+            _local_workers[sid] = left
+        else:
+            _local_workers.pop(sid, None)
+            _admitted_bytes.pop(sid, None)
+
+
+class PatternTooLarge(Exception):
+    """A stored pattern is too large to parse into memory for this route."""
+
+
+def _ensure_pattern_loadable(path):
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    if size // GEN_OUTPUT_BYTES_PER_TILE * GEN_MEMORY_BYTES_PER_TILE > GEN_REQUEST_MEMORY_BYTES:
+        raise PatternTooLarge("Pattern too large to load in memory; download pattern.json instead")
+
+
+@app.errorhandler(PatternTooLarge)
+def _pattern_too_large(e):
+    return jsonify({"status": "error", "message": str(e)}), 413
+
+
+def _tile_store_path_for(sid):
+    if not sid:
+        return os.path.join(os.path.dirname(__file__), 'pattern.tiles')
+    return os.path.join(USER_DATA_DIR, f"pattern_{sid}.tiles")
+
+
+def _open_tile_store(sid):
+    """The session's memory-mapped pattern (streaming-mode runs), or None if it uses JSON."""
+    try:
+        return tilestore.TileStore(_tile_store_path_for(sid))
+    except (OSError, ValueError):
+        return None
+
+
+def _discard_tile_store(store):
+    if store is not None:
+        try:
+            store.close()
+        except Exception:
+            pass
+        _remove_files([store.path])
+
+
+def _json_artifact_paths(path):
+    # (the record first: sidecars stop being served before they go)
+    return [_sidecar_record_path(path), path] + [path + ext for _encoding, ext in _SIDECAR_ENCODINGS]
+
+
+def _remove_files(paths):
+    for p in paths:
+        try:
+            if os.path.exists(p):
+                os.remove(p)
+        except Exception:
+            pass
+
+
+# -------- Generator daemon client --------
+_daemon_lock = threading.Lock()
+
+
+def _use_daemon():
+    return hasattr(socket, 'AF_UNIX') and (GEN_MODE == 'daemon' or pm is None)
+
+
+def _daemon_call(job, timeout=GEN_DAEMON_TIMEOUT):
+    """Send one job to the generator daemon and return its reply (raises on failure)."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(GEN_DAEMON_SOCKET)
+        s.sendall(_json_bytes(job) + b'\n')
+        with s.makefile('rb') as f:
+            line = f.readline()
+    reply = json.loads(line) if line else {"status": "error", "message": "generator daemon closed the connection"}
+    if reply.get('status') != 'ok':
+        raise RuntimeError(reply.get('message') or "generator daemon error")
+    return reply
+
+
+def _ensure_daemon(start_timeout=10.0):
+    """Ping the daemon, starting it (once per process at a time) if nothing answers."""
+    try:
+        _daemon_call({"op": "ping"}, timeout=2)
+        return True
+    except Exception:
+        pass
+    with _daemon_lock:
+        try:
+            _daemon_call({"op": "ping"}, timeout=2)
+            return True
+        except Exception:
+            pass
+        script = os.path.join(os.path.dirname(__file__), 'generator_daemon.py')
+        try:
+            subprocess.Popen([sys.executable, script, '--socket', GEN_DAEMON_SOCKET, '--workers', str(GEN_DAEMON_WORKERS)],
+                             cwd=os.path.dirname(__file__) or '.', start_new_session=True,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except Exception as e:
+            print("could not start generator daemon:", e)
+            return False
+        deadline = time.time() + start_timeout
+        while time.time() < deadline:
+            try:
+                _daemon_call({"op": "ping"}, timeout=2)
+                return True
+            except Exception:
+                time.sleep(0.05)
+        return False
+
+
+def _daemon_output_paths(reply):
+    return [reply[k] for k in ('pattern', 'regions', 'store') if reply.get(k)]
+
+
+def _commit_json_output(tmp, path):
+    """Move a daemon-written JSON file into place and refresh its compressed sidecars."""
+    with open(tmp, 'rb') as f:
+        data = f.read()
+    _write_json_artifact(path, data, tmp=tmp)
+
+
+def _superseded_check(sid, version, interval=CANCEL_POLL_SECONDS):
+    """Zero-arg callable for pm.generate(cancel=...): True once a newer version was requested.
+
+    pm calls it at every column strip, region and fill row, so the job store (a SQLite
+    query with JOB_BACKEND=sqlite) is consulted at most once per interval.
+    """
+    state = {'next': 0.0, 'superseded': False}
+
+    def check():
+        if state['superseded']:
+            return True
+        now = time.monotonic()
+        if now >= state['next']:
+            state['next'] = now + interval
+            state['superseded'] = _jobs.current(sid) != version
+        return state['superseded']
+    return check
+
+
+# -------- Progressive generation --------
+# In-process memory-mode runs are progressive: pm.generate publishes the whole layout (every
+# region with shape, variant and colors) before any tile is written, then the filled tiles in
+# batches. /generate/status reports the stage and /generate/preview serves what is known so
+# far, so clients can draw flat color blocks and refine them while the run finishes.
+# (Runs in the generator daemon or streaming into a tile store only report completion.)
+_progress_lock = threading.Lock()
+_progress = {}  # sid -> {'version', 'stage', 'regions', 'regions_done', 'tiles'} of its running job
+
+
+def _progress_recorder(sid, version):
+    """Register a progressive run of sid and return the progress callback for pm.generate."""
+    state = {'version': version, 'stage': 'layout', 'regions': [], 'regions_done': 0, 'tiles': []}
+    with _progress_lock:
+        _progress[sid] = state
+
+    def progress(stage, arg, entries):
+        with _progress_lock:
+            if stage == 'layout':
+                state['regions'] = arg
+            else:
+                state['regions_done'] = arg
+                state['tiles'].extend(entries)
+            state['stage'] = 'fill'
+    return progress
+
+
+def _set_progress_stage(sid, version, stage):
+    with _progress_lock:
+        state = _progress.get(sid)
+        if state is not None and state['version'] == version:
+            state['stage'] = stage
+
+
+def _clear_progress(sid, version=None):
+    with _progress_lock:
+        state = _progress.get(sid)
+        if state is not None and (version is None or state['version'] == version):
+            del _progress[sid]
+
+
+def _progress_status(sid):
+    """{'stage', 'progress'} of sid's progressive run (progress = share of regions filled), or None."""
+    with _progress_lock:
+        state = _progress.get(sid)
+        if state is None:
+            return None
+        total = len(state['regions'])
+        return {"stage": state['stage'],
+                "progress": round(state['regions_done'] / total, 3) if total else 0.0}
+
+
+def _start_job_lease(sid):
+    """Renew this process's claim on sid (JOB_BACKEND=sqlite) a few times per lease while a
+    worker runs, so long runs are not taken over by another process's bump(). Returns the
+    callable that stops it."""
+    lease = getattr(_jobs, 'lease_seconds', None)
+    if not lease:
+        return lambda: None
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(max(1.0, lease / 3.0)):
+            try:
+                _jobs.renew(sid)
+            except Exception as e:
+                print("job lease renew error:", e)
+    threading.Thread(target=beat, name=f"job-lease-{sid}", daemon=True).start()
+    return stop.set
 
 
 def _worker_generate_latest(sid):
     """Generate pattern for the latest requested version; coalesce intermediate requests.
     Writes pattern/regions files and done marker only for the latest version.
     """
-    st = _get_or_create_job_state(sid)
+    stop_lease = _start_job_lease(sid)
+    finished = False
     try:
         while True:
-            with _job_states_lock:
-                version_to_run = st['version']
-                st['running'] = True
+            version_to_run = _jobs.begin(sid)
+            resize_requested = _take_resize_request(sid)
             # show running state early
             _remove_done_marker(sid)
             _ensure_running_marker(sid)
@@ -224,50 +794,152 @@ def _worker_generate_latest(sid):
             data_path = _data_path_for(sid)
             settings = _json_load_file(data_path, {})
 
+            estimate = _admission_estimate(settings)
+            _scheduler.reprice(sid, estimate['cost'], info=estimate, running=True)
+            if estimate['mode'] is None:
+                # Settings grew past the budget after the request was admitted
+                _mark_failed_and_clear_running(sid, {"status": "error", "message": "Canvas too large to generate on this server",
+                                                     "estimate": estimate, "limits": _admission_limits()})
+                return
+            streaming = estimate['mode'] == 'streaming'
+            with _admitted_lock:
+                _admitted_bytes[sid] = estimate['working_bytes']
+
             # Optional: cleanup before heavy work
             cleanup_user_data()
 
-            # Perform in-process generation under a global lock (pm has globals)
-            with _pm_global_lock:
+            pattern_path = _pattern_path_for(sid)
+            regions_path = _regions_path_for(sid)
+            store_path = _tile_store_path_for(sid)
+            store = None
+            reply = None
+            # Resize keeps the current layout; it needs one in memory-mode (JSON) form
+            resizing = (resize_requested and not streaming and not os.path.exists(store_path)
+                        and os.path.exists(pattern_path) and os.path.exists(regions_path))
+            run_mode = 'resize' if resizing else estimate['mode']
+            # In-process generation runs under a global lock (pm has globals); daemon runs
+            # touch none of them, so several can be in flight at once
+            daemon = _use_daemon()
+            with nullcontext() if daemon else _pm_lock():
                 try:
                     # Create a deterministic seed per full-generation run
                     start_ts = time.time()
                     seed = int(time.time_ns() ^ hash(sid or 'global')) & 0x7FFFFFFF
-                    pattern = pm.generate(settings=settings, seed=seed) if pm is not None else None
-                    regions = getattr(pm, 'REGIONS', []) if pm is not None else []
+                    cancel = _superseded_check(sid, version_to_run)
+                    if daemon:
+                        # Isolated run in the warm generator daemon; it returns temp file references
+                        # (no mid-run cancellation: a superseded result is simply discarded below)
+                        if not _ensure_daemon():
+                            raise RuntimeError("generator daemon unavailable")
+                        reply = _daemon_call({
+                            "op": "resize" if resizing else "generate", "settings": settings, "seed": seed,
+                            "mode": estimate['mode'],
+                            "pattern_path": pattern_path, "regions_path": regions_path, "store_path": store_path,
+                            "cols": estimate.get('cols'), "rows": estimate.get('rows'),
+                            "max_regions": estimate.get('max_regions'),
+                        })
+                        pattern = regions = None
+                    elif streaming:
+                        # Oversized canvas: write each finished strip into a preallocated tile store
+                        store = tilestore.TileStore.create(
+                            f"{store_path}.tmp{os.getpid()}.{threading.get_ident()}",
+                            estimate['cols'], estimate['rows'], estimate['max_regions'],
+                            meta={"pattern_seed": seed},
+                        )
+
+                        def sink(tiles, strip_regions):
+                            store.put_tiles(tiles)
+                            store.put_regions(strip_regions)
+                        pm.generate(settings=settings, seed=seed, cancel=cancel, sink=sink)
+                        pattern = regions = None
+                    elif resizing:
+                        # Only the newly exposed strips are laid out and filled
+                        pattern, regions = pm.resize(_json_load_file(pattern_path, []), _json_load_file(regions_path, []),
+                                                     settings=settings, seed=seed, cancel=cancel)
+                    else:
+                        progress = _progress_recorder(sid, version_to_run) if pm is not None else None
+                        pattern = pm.generate(settings=settings, seed=seed, cancel=cancel, progress=progress) if pm is not None else None
+                        regions = getattr(pm, 'REGIONS', []) if pm is not None else []
+                        _set_progress_stage(sid, version_to_run, 'saving')
                     elapsed_ms = int((time.time() - start_ts) * 1000)
+                    if not resizing:
+                        # (a resize costs the added area, not the estimate's full canvas)
+                        _scheduler.observe(estimate['cost'], elapsed_ms / 1000.0)
                 except Exception as e:
-                    print("in-process generate failed:", e)
-                    # On failure, clear running marker (keep idle state)
-                    try:
-                        run_marker = _run_marker_for(sid)
-                        if os.path.exists(run_marker):
-                            os.remove(run_marker)
-                    except Exception:
-                        pass
-                    return
+                    _clear_progress(sid, version_to_run)
+                    if pm is None or not isinstance(e, pm.GenerationCancelled):
+                        _discard_tile_store(store)
+                        print("generate failed:", e)
+                        # On failure, clear running marker and report the error to status polling
+                        _mark_failed_and_clear_running(sid, {"status": "error", "message": "Generation failed"})
+                        return
+                    _discard_tile_store(store)
+                    # A newer request arrived mid-run: drop the partial grid and start the latest version
+                    print(json.dumps({"event": "generate_cancelled", "sid": sid, "pid": os.getpid(),
+                                      "version": version_to_run,
+                                      "elapsed_ms": int((time.time() - start_ts) * 1000)}))
+                    continue
 
             # If a newer request arrived while we were computing, loop again (discard this result)
-            with _job_states_lock:
-                if st['version'] != version_to_run:
-                    # Another request superseded this run
-                    continue
+            if _jobs.current(sid) != version_to_run:
+                # Another request superseded this run
+                _clear_progress(sid, version_to_run)
+                _discard_tile_store(store)
+                if reply is not None:
+                    _remove_files(_daemon_output_paths(reply))
+                continue
 
             # Write outputs atomically for this session
-            pattern_path = _pattern_path_for(sid)
-            regions_path = _regions_path_for(sid)
-            meta_path = _meta_path_for(sid)
-            _json_dump_file(pattern or [], pattern_path)
-            _json_dump_file(regions or [], regions_path)
-            _json_dump_file({"pattern_seed": seed, "generated_at": time.time()}, meta_path)
+            with _session_lock(sid):
+                meta_path = _meta_path_for(sid)
+                if reply is not None:
+                    if streaming:
+                        os.replace(reply['store'], store_path)
+                        _remove_files(_json_artifact_paths(pattern_path) + _json_artifact_paths(regions_path))
+                        tile_count = estimate['tiles']
+                    else:
+                        _commit_json_output(reply['pattern'], pattern_path)
+                        _commit_json_output(reply['regions'], regions_path)
+                        _remove_files([store_path])
+                        tile_count = reply.get('tiles_count', 0)
+                    region_count = reply.get('regions_count', 0)
+                elif streaming:
+                    region_count = store.header.get('region_count', 0)
+                    tile_count = estimate['tiles']
+                    store.close()
+                    os.replace(store.path, store_path)
+                    # The store replaces the JSON artifacts; /pattern.json and /regions.json stream from it
+                    _remove_files(_json_artifact_paths(pattern_path) + _json_artifact_paths(regions_path))
+                else:
+                    _json_dump_file(pattern or [], pattern_path, precompress=True)
+                    _json_dump_file(regions or [], regions_path, precompress=True)
+                    _remove_files([store_path])
+                    tile_count, region_count = len(pattern or []), len(regions or [])
+                run_seed = seed
+                if resizing:
+                    # Kept regions without a stored seed derive theirs from pattern_seed: keep it
+                    seed = _json_load_file(meta_path, {}).get('pattern_seed', seed)
+                meta = {"pattern_seed": seed, "generated_at": time.time(), "mode": run_mode}
+                periodic = pm.periodic_layout(settings) if pm is not None else None
+                if periodic:
+                    # The pattern is one block; renderers repeat it over cols x rows
+                    meta["periodic"] = periodic
+                _json_dump_file(meta, meta_path)
+                if streaming:
+                    # Out-of-core patterns are not undoable
+                    _clear_history(sid)
+                else:
+                    _record_history(sid, {"op": "resize" if resizing else "generate", "seed": run_seed, "settings": settings})
 
             # Structured log for diagnostics
             try:
                 log_obj = {
                     "event": "generate_done",
                     "sid": sid or "global",
-                    "tiles": len(pattern or []),
-                    "regions": len(regions or []),
+                    "pid": os.getpid(),
+                    "tiles": tile_count,
+                    "regions": region_count,
+                    "mode": run_mode,
                     "elapsed_ms": elapsed_ms,
                     "seed": seed,
                 }
@@ -275,28 +947,196 @@ def _worker_generate_latest(sid):
             except Exception:
                 pass
 
-            # Mark done and clean up
+            # Mark done and clean up (the finished pattern replaces the preview)
             _mark_done_and_clear_running(sid)
+            _clear_progress(sid, version_to_run)
             cleanup_user_data()
 
             # If no newer request since we started, we can exit; else loop to serve the latest
-            with _job_states_lock:
-                if st['version'] == version_to_run:
-                    st['running'] = False
+            if _jobs.finish(sid, version_to_run):
+                finished = True
+                if not streaming:
+                    _schedule_speculation(sid, settings, estimate)
+                break
+    finally:
+        stop_lease()
+        _clear_progress(sid)
+        if not finished:
+            # Failed run: give up the claim so the next /generate starts a new worker. After
+            # finish() the claim is already cleared and may belong to a newer worker.
+            _jobs.release(sid)
+        _release_admission(sid)
+
+
+# -------- Speculative pre-generation --------
+# With GEN_SPECULATIVE_DEPTH > 0, a session that just got a pattern has the next one(s)
+# generated in the background under its settings fingerprint, into side files next to its
+# pattern. A later /generate whose settings still match is committed from that buffer
+# without running. Speculative runs are background scheduler jobs (they start only when no
+# real job is queued) and cancel themselves once real work is queued or waits for pm, or
+# when the session's settings change. Buffers are per process, like the scheduler.
+_speculative = {}  # sid -> {'fingerprint', 'settings', 'items': [{'pattern', 'regions', 'seed'}], 'scheduled', 'touched'}
+_speculative_counts = {'served': 0, 'generated': 0, 'preempted': 0}
+
+
+def _speculation_enabled(settings, estimate):
+    return (GEN_SPECULATIVE_DEPTH > 0 and pm is not None and not _use_daemon()
+            and estimate.get('mode') == 'memory' and estimate.get('tiles', 0) <= GEN_SPECULATIVE_MAX_TILES)
+
+
+def _drop_speculative_items(items):
+    _remove_files([path for item in items for path in (item['pattern'], item['regions'])])
+
+
+def _invalidate_speculation(sid):
+    with _speculative_lock:
+        buf = _speculative.pop(sid, None)
+    if buf is not None:
+        _drop_speculative_items(buf['items'])
+
+
+def _expire_speculation(now):
+    with _speculative_lock:
+        stale = [sid for sid, buf in _speculative.items() if now - buf['touched'] > GEN_SPECULATIVE_TTL]
+        bufs = [_speculative.pop(sid) for sid in stale]
+    for buf in bufs:
+        _drop_speculative_items(buf['items'])
+
+
+def _schedule_speculation(sid, settings, estimate):
+    """Top up sid's buffer for these settings in the background (no-op unless enabled)."""
+    if not _speculation_enabled(settings, estimate):
+        return
+    now = time.time()
+    _expire_speculation(now)
+    fingerprint = _settings_fingerprint(settings)
+    with _speculative_lock:
+        buf = _speculative.get(sid)
+        if buf is not None and buf['fingerprint'] != fingerprint:
+            _speculative.pop(sid)
+            stale, buf = buf['items'], None
+        else:
+            stale = []
+        if buf is None:
+            buf = _speculative[sid] = {'fingerprint': fingerprint, 'settings': settings, 'items': [],
+                                       'scheduled': False, 'touched': now}
+        buf['touched'] = now
+        submit = not buf['scheduled'] and len(buf['items']) < GEN_SPECULATIVE_DEPTH
+        if submit:
+            buf['scheduled'] = True
+    _drop_speculative_items(stale)
+    if submit:
+        _scheduler.submit(sid, estimate['cost'], _speculate, sid, buf, background=True)
+
+
+def _speculate(sid, buf):
+    """Background job: generate into buf until it holds GEN_SPECULATIVE_DEPTH patterns."""
+    def superseded():
+        return _speculative.get(sid) is not buf
+
+    def cancel():
+        return _pm_foreground > 0 or _scheduler.foreground_waiting() > 0 or superseded()
+
+    pattern_path = _pattern_path_for(sid)
+    regions_path = _regions_path_for(sid)
+    try:
+        while len(buf['items']) < GEN_SPECULATIVE_DEPTH and not cancel():
+            seed = int(time.time_ns() ^ hash(sid or 'global')) & 0x7FFFFFFF
+            start_ts = time.time()
+            with _pm_global_lock:
+                try:
+                    if cancel():
+                        break
+                    pattern = pm.generate(settings=buf['settings'], seed=seed, cancel=cancel) or []
+                    regions = list(getattr(pm, 'REGIONS', []) or [])
+                except pm.GenerationCancelled:
+                    with _speculative_lock:
+                        _speculative_counts['preempted'] += 1
                     break
-                # else: run again (st['running'] stays True)
+            item = {'pattern': f"{pattern_path}.spec{seed}", 'regions': f"{regions_path}.spec{seed}", 'seed': seed}
+            if not (_json_dump_file(pattern, item['pattern']) and _json_dump_file(regions, item['regions'])):
+                _drop_speculative_items([item])
+                break
+            with _speculative_lock:
+                kept = not superseded()
+                if kept:
+                    buf['items'].append(item)
+                    _speculative_counts['generated'] += 1
+            if not kept:
+                _drop_speculative_items([item])
+                break
+            print(json.dumps({"event": "generate_speculative", "sid": sid or "global", "pid": os.getpid(),
+                              "tiles": len(pattern), "buffered": len(buf['items']),
+                              "elapsed_ms": int((time.time() - start_ts) * 1000)}))
     finally:
-        with _job_states_lock:
-            st['running'] = False
+        with _speculative_lock:
+            buf['scheduled'] = False
 
 
-def _schedule_generate(sid):
-    st = _get_or_create_job_state(sid)
-    with _job_states_lock:
-        st['version'] += 1
-        should_start = not st['running']
+def _serve_speculative(sid, settings):
+    """Commit a buffered pattern for sid if one matches its settings; returns the /generate
+    payload, or None to generate normally."""
+    if GEN_SPECULATIVE_DEPTH <= 0 or os.path.exists(_run_marker_for(sid)) or _jobs.running(sid):
+        # (a real run queued or in flight, in any process, takes the request: it coalesces
+        # into that run, which would overwrite a committed buffer item anyway)
+        return None
+    fingerprint = _settings_fingerprint(settings)
+    with _speculative_lock:
+        buf = _speculative.get(sid)
+        if buf is None or buf['fingerprint'] != fingerprint or not buf['items']:
+            return None
+        item = buf['items'].pop(0)
+    if not (os.path.exists(item['pattern']) and os.path.exists(item['regions'])):
+        _drop_speculative_items([item])  # swept by cleanup_user_data
+        return None
+    _remove_done_marker(sid)
+    with _session_lock(sid):
+        _commit_json_output(item['pattern'], _pattern_path_for(sid))
+        _commit_json_output(item['regions'], _regions_path_for(sid))
+        _remove_files([_tile_store_path_for(sid), _error_marker_for(sid)])
+        meta = {"pattern_seed": item['seed'], "generated_at": time.time(), "mode": "speculative"}
+        periodic = pm.periodic_layout(settings)
+        if periodic:
+            meta["periodic"] = periodic
+        _json_dump_file(meta, _meta_path_for(sid))
+        _record_history(sid, {"op": "generate", "seed": item['seed'], "settings": settings})
+    _mark_done_and_clear_running(sid)
+    with _speculative_lock:
+        _speculative_counts['served'] += 1
+    print(json.dumps({"event": "generate_done", "sid": sid or "global", "pid": os.getpid(),
+                      "mode": "speculative", "seed": item['seed']}))
+    _schedule_speculation(sid, settings, _admission_estimate(settings))
+    return {"status": "started", "mode": "memory", "resize": False, "speculative": True}
+
+
+def _speculation_stats():
+    with _speculative_lock:
+        return dict(_speculative_counts, enabled=GEN_SPECULATIVE_DEPTH > 0, sessions=len(_speculative),
+                    buffered=sum(len(b['items']) for b in _speculative.values()))
+
+
+def _generation_estimate(settings):
+    """{'tiles', 'regions', 'cost'} for a settings dict (cost drives scheduling order)."""
+    if pm is None:
+        return {"tiles": 0, "regions": 0, "cost": 1}
+    return pm.estimate_generation_cost(settings)
+
+
+def _schedule_generate(sid, estimate):
+    _version, should_start = _jobs.bump(sid)
+    with _admitted_lock:
+        if should_start:
+            _local_workers[sid] = _local_workers.get(sid, 0) + 1
+            # (a worker exiting between _admit() and here may have dropped the reservation)
+            _admitted_bytes[sid] = estimate['working_bytes']
+        elif not _local_workers.get(sid):
+            # Coalesced into a run owned by another process: its reservation is over there
+            _admitted_bytes.pop(sid, None)
     if should_start:
-        _executor.submit(_worker_generate_latest, sid)
+        _scheduler.submit(sid, estimate['cost'], _worker_generate_latest, sid, info=estimate)
+    else:
+        # Still queued (or running): re-rank it with the latest settings
+        _scheduler.reprice(sid, estimate['cost'], info=estimate)
 
 
 def _session_id_from_request():
@@ -325,17 +1165,46 @@ def _regions_path_for(sid):
 def index():
     return send_from_directory('.', 'index.html')
 
+def _stream_store_json(store, chunks):
+    """Stream a JSON array from a tile store, one chunk (list of dicts) at a time."""
+    def body():
+        try:
+            yield b'['
+            first = True
+            for items in chunks:
+                if not items:
+                    continue
+                data = b','.join(_json_bytes(item) for item in items)
+                yield data if first else b',' + data
+                first = False
+            yield b']'
+        finally:
+            store.close()
+    return _no_store(app.response_class(body(), mimetype='application/json'))
+
+
+def _batched(iterable, size=4096):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 @app.route('/pattern.json')
 def pattern():
     sid = _session_id_from_request()
     p = _pattern_path_for(sid)
     if os.path.exists(p):
-        resp = send_file(p, mimetype='application/json')
         # Avoid client/proxy caching of the current pattern
-        resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        resp.headers['Pragma'] = 'no-cache'
-        resp.headers['Expires'] = '0'
-        return resp
+        return _send_json_artifact(p)
+    store = _open_tile_store(sid)
+    if store is not None:
+        # Out-of-core pattern: serialize column by column straight from the mmap
+        return _stream_store_json(store, store.iter_tile_columns())
     # If no per-session pattern, return empty array to keep client happy
     return jsonify([])
 
@@ -344,11 +1213,10 @@ def regions():
     sid = _session_id_from_request()
     p = _regions_path_for(sid)
     if os.path.exists(p):
-        resp = send_file(p, mimetype='application/json')
-        resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        resp.headers['Pragma'] = 'no-cache'
-        resp.headers['Expires'] = '0'
-        return resp
+        return _send_json_artifact(p)
+    store = _open_tile_store(sid)
+    if store is not None:
+        return _stream_store_json(store, _batched(store.iter_regions()))
     return jsonify([])
 
 @app.route('/data.json', methods=['GET', 'POST'])
@@ -356,46 +1224,72 @@ def data_json():
     if request.method == 'POST':
         sid = _session_id_from_request()
         p = _data_path_for(sid)
+        body = request.data.decode('utf-8')
+        try:
+            settings = json.loads(body)
+        except ValueError:
+            settings = None
+        previous = _json_load_file(p) if os.path.exists(p) else None
+        if settings is not None and settings == previous:
+            # No-op save (auto-save fires on every control change): nothing to write or regenerate
+            return jsonify({"status": "ok", "changed": "none", "saved": False})
         # ensure directory exists (should already)
         os.makedirs(os.path.dirname(p), exist_ok=True)
         with open(p, 'w') as f:
-            f.write(request.data.decode('utf-8'))
+            f.write(body)
+        changed = _settings_change(previous, settings)
+        if changed != 'none':
+            # Buffered patterns were made for the old settings
+            _invalidate_speculation(sid)
         # opportunistic cleanup after user write
         cleanup_user_data()
-        return jsonify({"status": "ok"})
+        return jsonify({"status": "ok", "changed": changed, "saved": True})
     else:
         sid = _session_id_from_request()
         p = _data_path_for(sid)
-        if os.path.exists(p):
-            resp = send_file(p, mimetype='application/json')
-            # Avoid caching user-specific data.json
-            resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-            resp.headers['Pragma'] = 'no-cache'
-            resp.headers['Expires'] = '0'
-            return resp
-        # fallback to global data.json if user-specific doesn't exist
-        resp = send_from_directory('.', 'data.json')
-        resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        resp.headers['Pragma'] = 'no-cache'
-        resp.headers['Expires'] = '0'
-        return resp
-
-@app.route('/generate', methods=['POST'])
-def generate():
-    # Run generation for this session (prefer in-process fast path; fallback to subprocess)
-    sid = _session_id_from_request()
-
+        if not os.path.exists(p):
+            # fallback to global data.json if user-specific doesn't exist
+            p = _data_path_for(None)
+        with open(p, 'rb') as f:
+            body = f.read()
+        resp = app.response_class(body, mimetype='application/json')
+        # ETag of the content, not mtime+size: saves rewrite the file in place, often at the same size
+        resp.set_etag(hashlib.sha1(body).hexdigest())
+        # Avoid caching user-specific data.json
+        return _no_store(resp).make_conditional(request)
+
+def _start_generation(sid, resize=False):
+    """Kick off generation for sid. Returns (payload, status_code).
+
+    resize=True asks to fit the current layout to the saved canvas size (see pm.resize)
+    instead of a new layout; it falls back to a full run when there is nothing to keep.
+    """
     # Optimistic cleanup to avoid disk pressure
     cleanup_user_data()
 
-    if pm is not None:
-        # Coalesced in-process generation using a worker
+    if pm is not None or (_use_daemon() and _ensure_daemon()):
+        settings = _json_load_file(_data_path_for(sid), {})
+        if not resize:
+            served = _serve_speculative(sid, settings)
+            if served is not None:
+                return served, 200
+        # Size the run before queueing it; oversized requests are refused here
+        estimate = _admission_estimate(settings)
+        rejected = _admit(sid, estimate)
+        if rejected is not None:
+            return rejected
+        # Coalesced generation using a worker (in-process, or through the generator daemon).
+        # The latest request decides whether the next run resizes or starts over.
+        if resize:
+            _json_dump_file(time.time(), _resize_marker_for(sid))
+        else:
+            _take_resize_request(sid)
         _remove_done_marker(sid)
         _ensure_running_marker(sid)
-        _schedule_generate(sid)
-        return jsonify({"status": "started"})
+        _schedule_generate(sid, estimate)
+        return {"status": "started", "mode": estimate['mode'], "resize": bool(resize)}, 200
 
-    # Fallback: spawn subprocess (legacy behavior)
+    # Fallback when no daemon can run either: spawn subprocess (legacy behavior)
     env = dict(os.environ)
     if sid:
         env['SESSION_ID'] = sid
@@ -420,25 +1314,115 @@ def generate():
         try:
             subprocess.run([python, script], env=env)
         except Exception:
-            return jsonify({"status": "error", "message": str(e)}), 500
+            return {"status": "error", "message": str(e)}, 500
 
-    return jsonify({"status": "started"})
+    return {"status": "started"}, 200
 
 
-@app.route('/generate/status')
-def generate_status():
-    sid = _session_id_from_request()
-    run_marker = os.path.join(USER_DATA_DIR, f"generate_{sid}.running") if sid else os.path.join(os.path.dirname(__file__), 'generate.running')
-    done_marker = os.path.join(USER_DATA_DIR, f"generate_{sid}.done") if sid else os.path.join(os.path.dirname(__file__), 'generate.done')
+def _generation_status(sid):
+    run_marker = _run_marker_for(sid)
+    done_marker = _done_marker_for(sid)
     # If done marker exists, return done; if running marker exists return running; else return idle
     try:
         if os.path.exists(done_marker):
-            return jsonify({"status": "done"})
+            return {"status": "done"}
+        error_marker = _error_marker_for(sid)
+        if os.path.exists(error_marker):
+            return _json_load_file(error_marker, {"status": "error", "message": "Generation failed"})
         if os.path.exists(run_marker):
-            return jsonify({"status": "running"})
+            payload = {"status": "running"}
+            progress = _progress_status(sid)
+            if progress is not None:
+                # Progressive run: 'layout' (nothing to preview yet), 'fill' (see /generate/preview), 'saving'
+                payload.update(progress)
+            queued = _scheduler.position(sid)
+            if queued is not None:
+                # Waiting behind other sessions' jobs (queue_position >= 1) or running (0)
+                payload["queue_position"] = queued['queue_position']
+                payload["eta_seconds"] = queued['eta_seconds']
+                if queued['info']:
+                    payload["estimate"] = {"tiles": queued['info']['tiles'], "regions": queued['info']['regions']}
+            return payload
     except Exception:
         pass
-    return jsonify({"status": "idle"})
+    return {"status": "idle"}
+
+
+@app.route('/generate', methods=['POST'])
+def generate():
+    # Run generation for this session (prefer in-process fast path; fallback to subprocess).
+    # Body { "mode": "resize" } keeps the current layout and only fills the canvas change.
+    js = request.get_json(force=True, silent=True) or {}
+    resize = isinstance(js, dict) and js.get('mode') == 'resize'
+    payload, status = _start_generation(_session_id_from_request(), resize=resize)
+    resp = jsonify(payload)
+    if payload.get('retry_after'):
+        resp.headers['Retry-After'] = str(payload['retry_after'])
+    return resp, status
+
+
+@app.route('/generate/status')
+def generate_status():
+    return jsonify(_generation_status(_session_id_from_request()))
+
+
+@app.route('/generate/preview')
+def generate_preview():
+    """
+    What is known of the session's progressive run so far. With offset=0 (default) the body
+    has the run's layout in `regions` (enough to draw every region as a flat color block);
+    `tiles` are the filled tiles from `offset` on (at most PATTERN_RANGE_MAX_TILES), and
+    next_offset is where to continue. A different `version` means a newer run started.
+    status is 'idle' when no progressive run is in progress (fetch pattern.json instead).
+    """
+    sid = _session_id_from_request()
+    offset = max(0, _coerce_int(request.args.get('offset'), 0) or 0)
+    with _progress_lock:
+        state = _progress.get(sid)
+        if state is None or state['stage'] == 'layout':
+            return _no_store(jsonify({"status": "idle" if state is None else "running",
+                                      "stage": None if state is None else state['stage']}))
+        entries = state['tiles'][offset:offset + PATTERN_RANGE_MAX_TILES]
+        body = {
+            "status": "running",
+            "version": state['version'],
+            "stage": state['stage'],
+            "regions_total": len(state['regions']),
+            "regions_done": state['regions_done'],
+            "next_offset": offset + len(entries),
+        }
+        regions = state['regions'] if offset == 0 else None
+    if regions is not None:
+        body["regions"] = regions
+    body["tiles"] = [_preview_tile(e) for e in entries]
+    return _no_store(jsonify(body))
+
+
+def _preview_tile(entry):
+    """A pm grid entry as a pattern.json tile dict."""
+    t = {k: v for k, v in entry.items() if k != 'coordinates'}
+    t['grid_x'], t['grid_y'] = entry['coordinates']
+    return t
+
+
+@app.route('/metrics.json')
+def metrics():
+    """Per-process counters: scheduler queue, speculative buffers and the generator's
+    region-fill cache (this process, plus one generator daemon worker when GEN_MODE=daemon)."""
+    out = {
+        "pid": os.getpid(),
+        "scheduler": _scheduler.stats(),
+        "fill_cache": pm.fill_cache_stats() if pm is not None else None,
+        "speculative": _speculation_stats(),
+    }
+    if _use_daemon():
+        try:
+            out["daemon"] = _daemon_call({"op": "stats"}, timeout=2)
+        except Exception as e:
+            out["daemon"] = {"status": "error", "message": str(e)}
+    resp = jsonify(out)
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
 
 def _load_json_safe(path, default):
     try:
@@ -447,39 +1431,50 @@ def _load_json_safe(path, default):
     except Exception:
         return default
 
-def _pick_two_distinct_palette_colors(data_path):
-    """Pick two distinct colors from active palette buttons in data.json. Fallback to black/white."""
-    data = _load_json_safe(data_path, {})
-    colors = []
-    for k, v in (data.items() if isinstance(data, dict) else []):
-        if not str(k).startswith('button_'):
-            continue
-        if isinstance(v, dict):
-            if v.get('state') == 'on' and v.get('color'):
-                colors.append(v['color'])
-        elif isinstance(v, str) and v != 'off':
-            colors.append(v)
-    colors = list({c: True for c in colors}.keys())  # unique preserve order
-    if len(colors) < 2:
-        return ('black', 'white')
-    import random
-    a, b = random.sample(colors, 2)
-    return (a, b)
+# -------- Settings fingerprint --------
+# Only canvas size, knob_down, switch/slider, wallpaper mode and the active colors affect
+# what generation produces; anything else a client saves leaves the pattern as it is.
 
+def _settings_fingerprint(settings):
+    """{'canvas', 'layout', 'palette'} digests of the generation-relevant parts of a settings dict.
+
+    canvas is the canvas size (clamped as the generator does). layout covers knob_down and
+    the shape policy switch/slider resolve to (see pepesettings), plus the wallpaper-mode
+    period. palette is the set of active button colors: the generator shuffles them, so
+    their order does not matter.
+    """
+    data = settings if isinstance(settings, dict) else {}
+    snapshot = pepesettings.from_dict(data)
+    canvas = [snapshot.canvas_width, snapshot.canvas_height]
+    layout = {
+        'knob_down': snapshot.knob,
+        'shapes': snapshot.shapes,
+        # Wallpaper mode: the repeating block's size (a canvas change only resizes the block)
+        'period': [_coerce_int(data.get('period_width'), None), _coerce_int(data.get('period_height'), None)]
+        if data.get('periodic') else None,
+    }
+    palette = sorted(snapshot.palette)
+
+    def digest(obj):
+        return hashlib.sha1(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return {'canvas': digest(canvas), 'layout': digest(layout), 'palette': digest(palette)}
+
+
+def _settings_change(previous, settings):
+    """'none', 'palette' (a recolor of the current layout is enough), 'resize' (only the
+    canvas size changed: /generate with mode 'resize') or 'layout' (regenerate)."""
+    if not isinstance(previous, dict) or not isinstance(settings, dict):
+        return 'layout'
+    before = _settings_fingerprint(previous)
+    after = _settings_fingerprint(settings)
+    palette_changed = before['palette'] != after['palette']
+    if before['layout'] != after['layout']:
+        return 'layout'
+    if before['canvas'] != after['canvas']:
+        # Kept regions would keep their old colors: a palette change as well needs a new layout
+        return 'layout' if palette_changed else 'resize'
+    return 'palette' if palette_changed else 'none'
 
-def _active_palette_colors(data_path):
-    data = _load_json_safe(data_path, {})
-    colors = []
-    for k, v in (data.items() if isinstance(data, dict) else []):
-        if not str(k).startswith('button_'):
-            continue
-        if isinstance(v, dict):
-            if v.get('state') == 'on' and v.get('color'):
-                colors.append(v['color'])
-        elif isinstance(v, str) and v != 'off':
-            colors.append(v)
-    # unique preserve order
-    return list({c: True for c in colors}.keys())
 
 def _recent_pairs_from_region(region):
     lst = region.get('last_pairs') or []
@@ -593,70 +1588,513 @@ def _coerce_int(v, default=None):
         return default
 
 
-def _derive_region_seed(region_id, sid):
-    """Derive a deterministic seed for a region when none is stored, based on session meta and region id."""
-    try:
-        meta = _json_load_file(_meta_path_for(sid), {})
-        base = int(meta.get('pattern_seed')) if meta and 'pattern_seed' in meta else None
-    except Exception:
-        base = None
+def _derive_region_seed(region_id, sid, base=None):
+    """Derive a deterministic seed for a region when none is stored, based on session meta
+    (or the given pattern seed) and region id."""
+    if base is None:
+        try:
+            meta = _json_load_file(_meta_path_for(sid), {})
+            base = int(meta.get('pattern_seed')) if meta and 'pattern_seed' in meta else None
+        except Exception:
+            base = None
     if base is None:
         base = int(time.time_ns() ^ hash(sid or 'global')) & 0x7FFFFFFF
     return int((base ^ (int(region_id) << 10)) & 0x7FFFFFFF)
 
-@app.route('/edit-region', methods=['POST'])
-def edit_region():
+# -------- Pattern cache, tile-grid index and server-side rendering --------
+# A pattern "version" is its file's inode+mtime+size (plus a tile store's own write counter),
+# so any rewrite (generation, edits) yields a new version: JSON patterns are replaced
+# atomically (a new inode even within one mtime tick) and tile store patches bump the counter. The parsed pattern and the structures derived from it (render grid,
+# range-query buckets) are cached per version for the most recently used sessions;
+# rendered images and pyramid tiles are cached per version in a byte-bounded LRU.
+_pattern_cache = OrderedDict()  # pattern path -> { 'version', 'pattern', 'grid'?, 'buckets'? }
+_pattern_cache_lock = threading.Lock()
+_render_cache = OrderedDict()  # (path, version, kind, ...) -> encoded bytes
+_render_cache_size = 0
+_render_cache_lock = threading.Lock()
+
+
+def _pattern_version(path, store=None):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    version = f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"
+    if store is not None:
+        version += f"-{store.header.get('version', 0):x}"
+    return version
+
+
+def _pattern_cache_entry(sid):
+    """Return (path, entry) for the session's current pattern; entry is None if there is none."""
+    path = _pattern_path_for(sid)
+    version = _pattern_version(path)
+    if version is None:
+        return path, None
+    with _pattern_cache_lock:
+        entry = _pattern_cache.get(path)
+        if entry is not None and entry['version'] == version:
+            _pattern_cache.move_to_end(path)
+            return path, entry
+    _ensure_pattern_loadable(path)
+    pattern = _json_load_file(path, [])
+    entry = {'version': version, 'pattern': pattern if isinstance(pattern, list) else [], 'lock': threading.Lock()}
+    with _pattern_cache_lock:
+        _pattern_cache[path] = entry
+        _pattern_cache.move_to_end(path)
+        while len(_pattern_cache) > PATTERN_CACHE_MAX_ENTRIES:
+            _pattern_cache.popitem(last=False)
+    return path, entry
+
+
+def _pattern_derived(entry, name, build):
+    """Lazily build and memoize a structure derived from a cached pattern."""
+    with entry['lock']:
+        value = entry.get(name)
+        if value is None:
+            value = build(entry['pattern'])
+            entry[name] = value
+        return value
+
+
+def _load_pattern_grid(sid):
+    """Return (path, version, grid) for the session's pattern, or (path, None, None).
+    A wallpaper-mode pattern (one block) comes back as a view of the whole canvas."""
+    store = _open_tile_store(sid)
+    if store is not None:
+        # Cells are read from the mmap on demand while rendering
+        path, version, grid = store.path, _pattern_version(store.path, store), render.grid_from_store(store)
+    else:
+        path, entry = _pattern_cache_entry(sid)
+        if entry is None:
+            return path, None, None
+        version, grid = entry['version'], _pattern_derived(entry, 'grid', render.build_grid)
+    periodic = _periodic_layout_for(sid)
+    if periodic:
+        grid = render.periodic_grid(grid, periodic.get('cols') or grid['cols'], periodic.get('rows') or grid['rows'])
+    return path, version, grid
+
+
+def _periodic_layout_for(sid):
+    """Wallpaper-mode layout of the session's current pattern (from its meta), or None."""
+    periodic = _json_load_file(_meta_path_for(sid), {}).get('periodic')
+    return periodic if isinstance(periodic, dict) else None
+
+
+def _build_tile_buckets(pattern):
+    """Tile-grid index: tiles bucketed into PATTERN_RANGE_BUCKET x PATTERN_RANGE_BUCKET cell blocks."""
+    b = PATTERN_RANGE_BUCKET
+    buckets = {}
+    cols = rows = 0
+    for t in pattern:
+        try:
+            gx = int(t.get('grid_x'))
+            gy = int(t.get('grid_y'))
+        except (TypeError, ValueError):
+            continue
+        buckets.setdefault(((gx - 1) // b, (gy - 1) // b), []).append(t)
+        cols = max(cols, gx)
+        rows = max(rows, gy)
+    return {'buckets': buckets, 'cols': cols, 'rows': rows}
+
+
+def _query_tile_range(index, x0, y0, x1, y1, offset, limit):
+    """Tiles with x0<=grid_x<=x1 and y0<=grid_y<=y1, in a stable bucket-scan order.
+    Returns (tiles, next_offset or None)."""
+    b = PATTERN_RANGE_BUCKET
+    buckets = index['buckets']
+    out = []
+    seen = 0
+    for bx in range((x0 - 1) // b, (x1 - 1) // b + 1):
+        for by in range((y0 - 1) // b, (y1 - 1) // b + 1):
+            for t in buckets.get((bx, by), ()):
+                gx = int(t.get('grid_x'))
+                gy = int(t.get('grid_y'))
+                if gx < x0 or gx > x1 or gy < y0 or gy > y1:
+                    continue
+                if seen >= offset:
+                    if len(out) >= limit:
+                        return out, seen
+                    out.append(t)
+                seen += 1
+    return out, None
+
+
+def _render_cache_get(key):
+    with _render_cache_lock:
+        data = _render_cache.get(key)
+        if data is not None:
+            _render_cache.move_to_end(key)
+        return data
+
+
+def _render_cache_put(key, data):
+    global _render_cache_size
+    if len(data) > RENDER_CACHE_MAX_BYTES // 4:
+        return
+    with _render_cache_lock:
+        old = _render_cache.pop(key, None)
+        if old is not None:
+            _render_cache_size -= len(old)
+        _render_cache[key] = data
+        _render_cache_size += len(data)
+        while _render_cache_size > RENDER_CACHE_MAX_BYTES and _render_cache:
+            _, evicted = _render_cache.popitem(last=False)
+            _render_cache_size -= len(evicted)
+
+
+def _send_image(data, mimetype, etag):
+    resp = app.response_class(data, mimetype=mimetype)
+    resp.set_etag(etag)
+    # Revalidate each time; unchanged patterns answer 304 from the ETag
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp.make_conditional(request)
+
+
+def _render_full_image(fmt):
+    sid = _session_id_from_request()
+    path, version, grid = _load_pattern_grid(sid)
+    if grid is None:
+        return jsonify({"status": "error", "message": "No pattern available; generate first"}), 404
+    if fmt == 'jpeg' and not render.jpeg_available():
+        return jsonify({"status": "error", "message": "JPEG rendering needs Pillow; use /render.png"}), 501
+    settings = _json_load_file(_data_path_for(sid), {}) or {}
+    canvas_w = max(1, _coerce_int(settings.get('canvas_width'), 500) or 500)
+    canvas_h = max(1, _coerce_int(settings.get('canvas_height'), 500) or 500)
+    width = _coerce_int(request.args.get('width'))
+    if not width:
+        width = min(canvas_w, RENDER_DEFAULT_SIDE) if canvas_w >= canvas_h else int(round(min(canvas_h, RENDER_DEFAULT_SIDE) * canvas_w / canvas_h))
+    width = max(1, min(RENDER_MAX_SIDE, width))
+    height = max(1, min(RENDER_MAX_SIDE, int(round(width * canvas_h / canvas_w))))
+    quality = max(1, min(100, _coerce_int(request.args.get('quality'), 92) or 92))
+    key = (path, version, 'full', fmt, width, height, quality if fmt == 'jpeg' else None)
+    data = _render_cache_get(key)
+    if data is None:
+        rgb = render.render_full(grid, width, height)
+        data = render.encode_jpeg(rgb, width, height, quality) if fmt == 'jpeg' else render.encode_png(rgb, width, height)
+        _render_cache_put(key, data)
+    return _send_image(data, 'image/jpeg' if fmt == 'jpeg' else 'image/png', f"{version}-{fmt}-{width}x{height}-{quality}")
+
+
+@app.route('/pattern')
+def pattern_range():
     """
-    Edit a single region by id. Body: { region_id, action: 'reroll'|'recolor', colors?: { color_fundo?, color_padrao? } }
-    Recomputes tiles for that region and updates the session's pattern and regions.
+    Viewport query: tiles intersecting the inclusive grid rectangle x0..x1, y0..y1 (1-based,
+    omitted bounds default to the whole pattern). At most `limit` tiles are returned
+    (capped by PATTERN_RANGE_MAX_TILES); when truncated, repeat with offset=next_offset and
+    version=<the first page's version>, which answers 412 if the pattern changed in between.
+    regions=1 adds the region descriptors overlapping the rectangle; tiles=0 omits tiles.
+    A wallpaper-mode pattern is queried in the coordinates of its repeating block; the
+    answer then carries `periodic` with the canvas size it repeats over.
     """
+    sid = _session_id_from_request()
+    store = _open_tile_store(sid)
+    if store is not None:
+        with store:
+            return _pattern_range_from_store(store, _periodic_layout_for(sid))
+    _path, entry = _pattern_cache_entry(sid)
+    if entry is None:
+        return _no_store(jsonify({"status": "ok", "version": None, "cols": 0, "rows": 0, "tiles": [], "truncated": False}))
+    index = _pattern_derived(entry, 'buckets', _build_tile_buckets)
+    cols, rows = index['cols'], index['rows']
+    args = request.args
+    x0 = max(1, _coerce_int(args.get('x0'), 1) or 1)
+    y0 = max(1, _coerce_int(args.get('y0'), 1) or 1)
+    x1 = min(cols, _coerce_int(args.get('x1'), cols) or cols)
+    y1 = min(rows, _coerce_int(args.get('y1'), rows) or rows)
+    limit = max(1, min(PATTERN_RANGE_MAX_TILES, _coerce_int(args.get('limit'), PATTERN_RANGE_MAX_TILES) or PATTERN_RANGE_MAX_TILES))
+    offset = max(0, _coerce_int(args.get('offset'), 0) or 0)
+    stale = _stale_pattern_page(entry['version'])
+    if stale is not None:
+        return stale
+    body = {"status": "ok", "version": entry['version'], "cols": cols, "rows": rows, "bounds": [x0, y0, x1, y1]}
+    periodic = _periodic_layout_for(sid)
+    if periodic:
+        body["periodic"] = periodic
+    if args.get('tiles', '1') != '0':
+        tiles, next_offset = _query_tile_range(index, x0, y0, x1, y1, offset, limit) if x0 <= x1 and y0 <= y1 else ([], None)
+        body["tiles"] = tiles
+        body["truncated"] = next_offset is not None
+        if next_offset is not None:
+            body["next_offset"] = next_offset
+    if args.get('regions') == '1':
+        regions = _load_json_safe(_regions_path_for(sid), [])
+        body["regions"] = [
+            r for r in regions
+            if _coerce_int(r.get('x1'), 0) <= x1 and _coerce_int(r.get('x2'), 0) >= x0
+            and _coerce_int(r.get('y1'), 0) <= y1 and _coerce_int(r.get('y2'), 0) >= y0
+        ]
+    return _no_store(jsonify(body))
+
+
+def _stale_pattern_page(version):
+    """412 when the request names a `version` (that of its first page) the pattern no longer
+    has: pages of two versions must not be stitched together. None to answer normally."""
+    wanted = request.args.get('version')
+    if wanted and wanted != version:
+        resp = jsonify({"status": "error", "message": "Pattern changed; restart from offset 0", "version": version})
+        return _no_store(resp), 412
+    return None
+
+
+def _pattern_range_from_store(store, periodic=None):
+    """/pattern against a memory-mapped pattern: each column of the rectangle is one
+    contiguous record run, so only the requested cells are read. Tiles come column-major."""
+    args = request.args
+    cols, rows = store.cols, store.rows
+    x0 = max(1, _coerce_int(args.get('x0'), 1) or 1)
+    y0 = max(1, _coerce_int(args.get('y0'), 1) or 1)
+    x1 = min(cols, _coerce_int(args.get('x1'), cols) or cols)
+    y1 = min(rows, _coerce_int(args.get('y1'), rows) or rows)
+    limit = max(1, min(PATTERN_RANGE_MAX_TILES, _coerce_int(args.get('limit'), PATTERN_RANGE_MAX_TILES) or PATTERN_RANGE_MAX_TILES))
+    offset = max(0, _coerce_int(args.get('offset'), 0) or 0)
+    version = _pattern_version(store.path, store)
+    stale = _stale_pattern_page(version)
+    if stale is not None:
+        return stale
+    body = {"status": "ok", "version": version, "cols": cols, "rows": rows, "bounds": [x0, y0, x1, y1]}
+    if periodic:
+        body["periodic"] = periodic
+    want_tiles = args.get('tiles', '1') != '0'
+    want_regions = args.get('regions') == '1'
+    tiles = []
+    region_ids = set()
+    next_offset = None
+    seen = 0
+    for t in store.iter_range(x0, y0, x1, y1):
+        if want_regions and t['region_id']:
+            region_ids.add(t['region_id'])
+        if not want_tiles:
+            continue
+        if seen >= offset:
+            if len(tiles) >= limit:
+                next_offset = seen
+                if not want_regions:
+                    break
+                continue
+            tiles.append(t)
+        seen += 1
+    if want_tiles:
+        body["tiles"] = tiles
+        body["truncated"] = next_offset is not None
+        if next_offset is not None:
+            body["next_offset"] = next_offset
+    if want_regions:
+        body["regions"] = [r for r in (store.region(rid) for rid in sorted(region_ids)) if r]
+    return _no_store(jsonify(body))
+
+
+@app.route('/render.png')
+def render_png():
+    """Whole pattern as PNG. Query: width (px, optional; height follows the canvas aspect)."""
+    return _render_full_image('png')
+
+
+@app.route('/render.jpg')
+def render_jpg():
+    """Whole pattern as JPEG (needs Pillow). Query: width, quality."""
+    return _render_full_image('jpeg')
+
+
+@app.route('/render.svg')
+def render_svg():
+    """Whole pattern as vector SVG at the canvas size in mm, streamed while it is written.
+    Query: download=1 to save it as a file."""
+    sid = _session_id_from_request()
+    settings = _json_load_file(_data_path_for(sid), {}) or {}
+    canvas_w = max(1, _coerce_int(settings.get('canvas_width'), 500) or 500)
+    canvas_h = max(1, _coerce_int(settings.get('canvas_height'), 500) or 500)
+    periodic = _periodic_layout_for(sid)
+    store = _open_tile_store(sid)
+    if store is not None:
+        # Scanned column by column from the mmap; only regions the scan is inside are held
+        region_x2 = {r['id']: r['x2'] for r in store.iter_regions()}
+        chunks = render.iter_svg(store.iter_tiles(), store.cols, store.rows, canvas_w, canvas_h, region_x2, periodic)
+    else:
+        _path, entry = _pattern_cache_entry(sid)
+        if entry is None or not entry['pattern']:
+            return jsonify({"status": "error", "message": "No pattern available; generate first"}), 404
+        tiles, cols, rows = render.svg_tiles(entry['pattern'])
+        region_x2 = {_coerce_int(r.get('id')): _coerce_int(r.get('x2')) for r in _load_json_safe(_regions_path_for(sid), [])}
+        chunks = render.iter_svg(tiles, cols, rows, canvas_w, canvas_h, region_x2, periodic)
+
+    def body():
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            if store is not None:
+                store.close()
+    resp = app.response_class(body(), mimetype='image/svg+xml')
+    if request.args.get('download') == '1':
+        resp.headers['Content-Disposition'] = 'attachment; filename="pepe_pattern.svg"'
+    return _no_store(resp)
+
+
+@app.route('/tiles/meta.json')
+def tiles_meta():
+    """Describe the zoomable tile pyramid for the current pattern version."""
+    _path, version, grid = _load_pattern_grid(_session_id_from_request())
+    if grid is None:
+        return jsonify({"status": "error", "message": "No pattern available; generate first"}), 404
+    max_zoom = render.pyramid_max_zoom(grid)
+    return _no_store(jsonify({
+        "status": "ok",
+        "version": version,
+        "cols": grid['cols'],
+        "rows": grid['rows'],
+        "tile_size": render.PYRAMID_TILE_SIZE,
+        "max_zoom": max_zoom,
+        "levels": [list(render.pyramid_tile_count(grid, z)) for z in range(max_zoom + 1)],
+        "url": "/tiles/{z}/{x}/{y}.png",
+    }))
+
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.png')
+def tiles_png(z, x, y):
+    path, version, grid = _load_pattern_grid(_session_id_from_request())
+    if grid is None:
+        return jsonify({"status": "error", "message": "No pattern available; generate first"}), 404
+    if z > render.pyramid_max_zoom(grid):
+        abort(404)
+    nx, ny = render.pyramid_tile_count(grid, z)
+    if x >= nx or y >= ny:
+        abort(404)
+    key = (path, version, 'tile', z, x, y)
+    data = _render_cache_get(key)
+    if data is None:
+        size = render.PYRAMID_TILE_SIZE
+        data = render.encode_png(render.render_pyramid_tile(grid, z, x, y), size, size)
+        _render_cache_put(key, data)
+    return _send_image(data, 'image/png', f"{version}-{z}-{x}-{y}")
+
+
+# -------- Region edits --------
+# Each edit is split into load (file I/O), compute (CPU, pm globals) and save (file I/O)
+# so the Flask routes and the asyncio surface in asgi.py share one implementation and the
+# async side can run each phase on the right executor.
+
+def _load_edit_state(sid):
+    store = _open_tile_store(sid)
+    if store is not None:
+        # Out-of-core pattern: regions are looked up and tiles rewritten in place, nothing is parsed up front
+        return {
+            'settings': _json_load_file(_data_path_for(sid), {}) or {},
+            'snapshot': pepesettings.load(_data_path_for(sid)),
+            'store': store,
+            'regions': None,
+            'pattern': None,
+        }
+    _ensure_pattern_loadable(_pattern_path_for(sid))
+    return {
+        'settings': _json_load_file(_data_path_for(sid), {}) or {},
+        'snapshot': pepesettings.load(_data_path_for(sid)),
+        'regions': _load_json_safe(_regions_path_for(sid), []),
+        'pattern': _load_json_safe(_pattern_path_for(sid), []),
+    }
+
+
+def _edit_result(body, status=200, writes=None, save_error=None, history=None):
+    """history: (sid, op log entry) recorded once the writes are saved."""
+    return {'body': body, 'status': status, 'writes': writes or [], 'save_error': save_error, 'history': history}
+
+
+def _edit_error(message, status):
+    return _edit_result({"status": "error", "message": message}, status)
+
+
+def _save_edit_writes(result):
+    """Persist an edit result's writes; returns (payload, status_code)."""
+    for obj, path in result['writes']:
+        if isinstance(obj, tilestore.Patch):
+            try:
+                obj.apply(path)
+                continue
+            except Exception as e:
+                print("tile store patch error:", e)
+                return {"status": "error", "message": result['save_error'] or "Failed to save"}, 500
+        if not _json_dump_file(obj, path, precompress=True):
+            return {"status": "error", "message": result['save_error'] or "Failed to save"}, 500
+    if result.get('history'):
+        sid, entry = result['history']
+        return dict(result['body'], history=_record_history(sid, entry)), result['status']
+    return result['body'], result['status']
+
+
+def _store_edit_regions(state, ops):
+    """Regions referenced by ops, read from the session's tile store (small list for planning)."""
+    store = state['store']
+    wanted = set()
+    for op in ops:
+        rid = _coerce_int(op.get('region_id')) if isinstance(op, dict) else None
+        if rid:
+            wanted.add(rid)
+    return [r for r in (store.region(rid) for rid in sorted(wanted)) if r]
+
+
+def _store_patch_result(sid, plans, tiles_per_plan):
+    """Delta response plus an in-place tile store patch for planned region edits."""
+    new_tiles = []
+    for plan, tiles in zip(plans, tiles_per_plan):
+        _apply_region_plan(plan)
+        new_tiles.extend(tiles)
+    regions = [p['region'] for p in plans]
+    return _edit_result(
+        {
+            "status": "ok",
+            "region_ids": [p['region_id'] for p in plans],
+            "tiles": new_tiles,
+            "regions": regions,
+        },
+        writes=[(tilestore.Patch(clear=[p['bounds'] for p in plans], tiles=new_tiles, regions=regions),
+                 _tile_store_path_for(sid))],
+        save_error="Failed to save edits",
+    )
+
+
+def _run_edit(compute, sid, js):
+    """Synchronous load -> compute -> save used by the Flask routes (one session lock across
+    all three, so concurrent edits and generation commits never overwrite each other)."""
     if pm is None:
-        return jsonify({"status": "error", "message": "Generator module not available"}), 500
-    js = request.get_json(force=True, silent=True) or {}
-    region_id = js.get('region_id')
-    action = js.get('action')
+        return {"status": "error", "message": "Generator module not available"}, 500
+    with _session_lock(sid):
+        state = _load_edit_state(sid)
+        with _pm_lock():
+            result = compute(sid, js, state)
+        return _save_edit_writes(result)
+
+
+def _plan_region_edit(sid, op, snapshot, regions):
+    """Validate one { region_id, action, colors? } op and pick its new variant/colors/seed
+    (from the session's pepesettings snapshot). Returns (plan, None) or (None, error_result).
+    Updates the region's recolor history."""
+    region_id = op.get('region_id')
+    action = op.get('action')
     if not region_id or action not in ('reroll', 'recolor'):
-        return jsonify({"status": "error", "message": "Invalid request"}), 400
+        return None, _edit_error("Invalid request", 400)
     try:
         region_id = int(region_id)
     except Exception:
-        return jsonify({"status": "error", "message": "region_id must be an integer"}), 400
-
-    sid = _session_id_from_request()
-    pattern_path = _pattern_path_for(sid)
-    regions_path = _regions_path_for(sid)
-    data_path = _data_path_for(sid)
+        return None, _edit_error("region_id must be an integer", 400)
 
-    regions = _load_json_safe(regions_path, [])
     if not regions:
-        return jsonify({"status": "error", "message": "No regions available; regenerate first"}), 400
+        return None, _edit_error("No regions available; regenerate first", 400)
     region = next((r for r in regions if int(r.get('id')) == region_id), None)
     if not region:
-        return jsonify({"status": "error", "message": "Region not found"}), 404
+        return None, _edit_error("Region not found", 404)
 
-    # Determine new parameters
     shape = region.get('shape')
-    x1 = int(region.get('x1'))
-    y1 = int(region.get('y1'))
-    x2 = int(region.get('x2'))
-    y2 = int(region.get('y2'))
-
     # colors
     if action == 'recolor':
-        c_in = js.get('colors') or {}
+        c_in = op.get('colors') or {}
         cf = c_in.get('color_fundo')
         cp = c_in.get('color_padrao')
-        prev_cf = region.get('color_fundo')
-        prev_cp = region.get('color_padrao')
         if not (cf and cp):
-            palette = _active_palette_colors(data_path)
-            cf, cp = _choose_new_colors_for_region(region, palette, sid)
-        color_fundo, color_padrao = cf, cp
+            cf, cp = _choose_new_colors_for_region(region, list(snapshot.palette), sid)
         variant = int(region.get('variant') or 1)
         region_seed = _coerce_int(region.get('seed')) or _derive_region_seed(region_id, sid)
     else:  # reroll: new variant and new colors
-        cf, cp = _pick_two_distinct_palette_colors(data_path)
-        color_fundo, color_padrao = cf, cp
+        cf, cp = pepesettings.pick_two_colors(snapshot)
         import random
         if shape == 'aleluia_quadrados':
             variant = random.randint(1, 14)
@@ -664,84 +2102,159 @@ def edit_region():
             variant = random.randint(1, 7)
         # new seed for reroll
         region_seed = int(time.time_ns() ^ (region_id << 8)) & 0x7FFFFFFF
-
-    # Generate new tiles for this region
-    # Load current session settings to ensure region generation uses matching canvas/grid dims
-    settings = _load_json_safe(data_path, {})
+    return {
+        'region': region,
+        'region_id': region_id,
+        'shape': shape,
+        'bounds': (int(region.get('x1')), int(region.get('y1')), int(region.get('x2')), int(region.get('y2'))),
+        'variant': variant,
+        'color_fundo': cf,
+        'color_padrao': cp,
+        'seed': region_seed,
+    }, None
+
+
+def _apply_region_plan(plan):
+    region = plan['region']
+    region['variant'] = int(plan['variant'])
+    region['color_fundo'] = plan['color_fundo']
+    region['color_padrao'] = plan['color_padrao']
+    if plan['seed'] is not None:
+        region['seed'] = int(plan['seed'])
+
+
+_region_pool = None
+_region_pool_lock = threading.Lock()
+
+
+def _get_region_pool():
+    global _region_pool
+    with _region_pool_lock:
+        if _region_pool is None:
+            _region_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _region_pool
+
+
+def _generate_planned_regions(plans, settings):
+    """Generate tiles for each plan (same order). Large multi-region batches fan out to a
+    process pool; each worker process has its own PepesMachine globals."""
+    def _args(p):
+        x1, y1, x2, y2 = p['bounds']
+        return (p['region_id'], x1, y1, x2, y2, p['shape'], p['variant'], p['color_fundo'], p['color_padrao'])
+    total_tiles = sum((p['bounds'][2] - p['bounds'][0] + 1) * (p['bounds'][3] - p['bounds'][1] + 1) for p in plans)
+    if len(plans) > 1 and total_tiles >= EDIT_BATCH_PARALLEL_MIN_TILES and (os.cpu_count() or 1) > 1:
+        pool = _get_region_pool()
+        futures = [pool.submit(pm.generate_region, *_args(p), settings=settings, seed=p['seed']) for p in plans]
+        return [f.result() for f in futures]
+    return [pm.generate_region(*_args(p), settings=settings, seed=p['seed']) for p in plans]
+
+
+def _compute_edit_region(sid, js, state):
+    settings = state['settings']
+    store = state.get('store')
+    regions = _store_edit_regions(state, [js]) if store is not None else state['regions']
+    plan, err = _plan_region_edit(sid, js, state['snapshot'], regions)
+    if err is not None:
+        return err
+
+    # Generate new tiles for this region, using the session settings so canvas/grid dims match
     try:
-        tiles = pm.generate_region(region_id, x1, y1, x2, y2, shape, variant, color_fundo, color_padrao, settings=settings, seed=region_seed)
+        tiles = _generate_planned_regions([plan], settings)[0]
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to generate region: {e}"}), 500
+        return _edit_error(f"Failed to generate region: {e}", 500)
 
-    # Load existing pattern and replace region tiles
-    pattern = _load_json_safe(pattern_path, [])
-    pattern = [t for t in pattern if int(t.get('region_id') or -1) != region_id]
+    if store is not None:
+        # Too large to send back whole: answer with the /edit-regions delta instead of "pattern"
+        return _store_patch_result(sid, [plan], [tiles])
+
+    # Replace region tiles in the existing pattern
+    region_id = plan['region_id']
+    pattern = [t for t in state['pattern'] if int(t.get('region_id') or -1) != region_id]
     pattern.extend(tiles)
 
-    # Save pattern and regions
+    _apply_region_plan(plan)
+    return _edit_result(
+        {"status": "ok", "pattern": pattern, "regions": regions},
+        writes=[(pattern, _pattern_path_for(sid)), (regions, _regions_path_for(sid))],
+        save_error="Failed to save edits",
+        history=(sid, {"op": "regions", "settings": settings, "regions": [dict(plan['region'])]}),
+    )
+
+
+def _compute_edit_regions(sid, js, state):
+    """Batch of region edits in one load-modify-write. The response is a delta: the new tiles
+    and updated region entries for the affected region ids only."""
+    ops = js.get('ops')
+    if not isinstance(ops, list) or not ops:
+        return _edit_error("ops must be a non-empty list", 400)
+    if len(ops) > EDIT_BATCH_MAX_OPS:
+        return _edit_error(f"Too many ops (max {EDIT_BATCH_MAX_OPS})", 400)
+    settings = state['settings']
+    store = state.get('store')
+    regions = _store_edit_regions(state, ops) if store is not None else state['regions']
+
+    # Plan every op first so an invalid op rejects the whole batch; the last op on a region wins
+    plans = {}
+    for op in ops:
+        plan, err = _plan_region_edit(sid, op if isinstance(op, dict) else {}, state['snapshot'], regions)
+        if err is not None:
+            return err
+        plans[plan['region_id']] = plan
+    plans = list(plans.values())
+
     try:
-        with open(pattern_path, 'w') as pf:
-            json.dump(pattern, pf, indent=2)
-        # update region entry
-        region['variant'] = int(variant)
-        region['color_fundo'] = color_fundo
-        region['color_padrao'] = color_padrao
-        if region_seed is not None:
-            region['seed'] = int(region_seed)
-        with open(regions_path, 'w') as rf:
-            json.dump(regions, rf, indent=2)
+        tiles_per_plan = _generate_planned_regions(plans, settings)
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to save edits: {e}"}), 500
-
-    return jsonify({"status": "ok", "pattern": pattern, "regions": regions})
-
-@app.route('/magic-wand', methods=['POST'])
-def magic_wand():
-    """
-    Create a new region by selecting two opposite tiles (diagonal corners),
-    fill that rectangular area with a freshly generated pattern using current data-driven settings.
-    Body: { x1, y1, x2, y2 }
-    """
-    if pm is None:
-        return jsonify({"status": "error", "message": "Generator module not available"}), 500
-    js = request.get_json(force=True, silent=True) or {}
+        return _edit_error(f"Failed to generate regions: {e}", 500)
+    if store is not None:
+        return _store_patch_result(sid, plans, tiles_per_plan)
+
+    affected = set(p['region_id'] for p in plans)
+    pattern = [t for t in state['pattern'] if int(t.get('region_id') or -1) not in affected]
+    new_tiles = []
+    for plan, tiles in zip(plans, tiles_per_plan):
+        _apply_region_plan(plan)
+        new_tiles.extend(tiles)
+    pattern.extend(new_tiles)
+    return _edit_result(
+        {
+            "status": "ok",
+            "region_ids": [p['region_id'] for p in plans],
+            "tiles": new_tiles,
+            "regions": [p['region'] for p in plans],
+        },
+        writes=[(pattern, _pattern_path_for(sid)), (regions, _regions_path_for(sid))],
+        save_error="Failed to save edits",
+        history=(sid, {"op": "regions", "settings": settings, "regions": [dict(p['region']) for p in plans]}),
+    )
+
+
+def _compute_magic_wand(sid, js, state):
+    if state.get('store') is not None:
+        # These rewrite arbitrary areas of the pattern list; out-of-core patterns only take region edits
+        return _edit_error("Not available for out-of-core patterns; use /edit-regions", 413)
     try:
         x1 = int(js.get('x1'))
         y1 = int(js.get('y1'))
         x2 = int(js.get('x2'))
         y2 = int(js.get('y2'))
     except Exception:
-        return jsonify({"status": "error", "message": "x1,y1,x2,y2 must be integers"}), 400
+        return _edit_error("x1,y1,x2,y2 must be integers", 400)
     # normalize to 1-based inclusive bounds
     x_lo, x_hi = (x1, x2) if x1 <= x2 else (x2, x1)
     y_lo, y_hi = (y1, y2) if y1 <= y2 else (y2, y1)
-    # load paths and settings
-    sid = _session_id_from_request()
-    pattern_path = _pattern_path_for(sid)
-    regions_path = _regions_path_for(sid)
-    data_path = _data_path_for(sid)
-    settings = _load_json_safe(data_path, {})
+    settings = state['settings']
 
-    # choose shape based on data (mirror PepeAI.GetPatternShape logic simplistically)
-    switch_value = settings.get('switch')
-    slider_value = int(settings.get('slider', 50))
-    import random as _rnd
-    if switch_value == 'left':
-        shape = 'aleluia_quadrados'
-    elif switch_value == 'right':
-        shape = 'aleluia_triangulos'
-    elif switch_value == 'center':
-        shape = _rnd.choice(['aleluia_quadrados', 'aleluia_triangulos']) if slider_value <= 50 else _rnd.choice(['aleluia_triangulos', 'aleluia_quadrados'])
-    else:
-        shape = _rnd.choice(['aleluia_triangulos', 'aleluia_quadrados'])
-
-    # pick colors from active palette
-    color_fundo, color_padrao = _pick_two_distinct_palette_colors(data_path)
+    # shape and colors as the generator picks them (switch/slider policy, active palette)
+    snapshot = state['snapshot']
+    shape = pepesettings.pick_shape(snapshot)
+    color_fundo, color_padrao = pepesettings.pick_two_colors(snapshot)
     # variant
+    import random as _rnd
     variant = _rnd.randint(1, 14) if shape == 'aleluia_quadrados' else _rnd.randint(1, 7)
 
     # regions bookkeeping
-    regions = _load_json_safe(regions_path, [])
+    regions = state['regions']
     next_id = (max([int(r.get('id', 0)) for r in regions]) + 1) if regions else 1
     # region seed
     region_seed = int(time.time_ns() ^ (next_id << 8)) & 0x7FFFFFFF
@@ -750,12 +2263,11 @@ def magic_wand():
     try:
         tiles = pm.generate_region(next_id, x_lo, y_lo, x_hi, y_hi, shape, variant, color_fundo, color_padrao, settings=settings, seed=region_seed)
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to generate region: {e}"}), 500
+        return _edit_error(f"Failed to generate region: {e}", 500)
 
     # update pattern: remove any tiles inside bounds, then add new ones
-    pattern = _load_json_safe(pattern_path, [])
     kept = []
-    for t in pattern:
+    for t in state['pattern']:
         gx = int(t.get('grid_x', 0))
         gy = int(t.get('grid_y', 0))
         if x_lo <= gx <= x_hi and y_lo <= gy <= y_hi:
@@ -777,74 +2289,287 @@ def magic_wand():
         'seed': int(region_seed)
     }
     regions.append(new_region)
+    return _edit_result(
+        {"status": "ok", "pattern": kept, "regions": regions, "region": new_region},
+        writes=[(kept, _pattern_path_for(sid)), (regions, _regions_path_for(sid))],
+        save_error="Failed to save magic wand result",
+        history=(sid, {"op": "wand", "settings": settings, "region": dict(new_region)}),
+    )
+
+
+def _compute_recolor_all(sid, js, state):
+    if state.get('store') is not None:
+        # These rewrite arbitrary areas of the pattern list; out-of-core patterns only take region edits
+        return _edit_error("Not available for out-of-core patterns; use /edit-regions", 413)
+    settings = state['settings']
+    regions = state['regions']
+    if not regions:
+        return _edit_error("No regions available to recolor", 400)
+    palette = list(state['snapshot'].palette)
 
-    # save
     try:
-        with open(pattern_path, 'w') as pf:
-            json.dump(kept, pf, indent=2)
-        with open(regions_path, 'w') as rf:
-            json.dump(regions, rf, indent=2)
+        new_tiles_all = _recolor_region_tiles(regions, palette, settings, sid)
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to save magic wand result: {e}"}), 500
+        return _edit_error(str(e), 500)
+
+    # Merge with existing pattern by replacing all region tiles
+    keep = [t for t in state['pattern'] if (t.get('region_id') is None)]
+    keep.extend(new_tiles_all)
+    return _edit_result(
+        {"status": "ok", "pattern": keep, "regions": regions},
+        writes=[(keep, _pattern_path_for(sid)), (regions, _regions_path_for(sid))],
+        save_error="Failed to save recolor-all",
+        # Deterministic given the regions before it and the palette: replayed, not stored
+        history=(sid, {"op": "recolor-all", "settings": settings}),
+    )
+
+
+def _recolor_region_tiles(regions, palette, settings, sid):
+    """Give every region new colors (in place; see _choose_new_colors_for_region) and return
+    their regenerated tiles."""
+    new_tiles_all = []
+    for region in regions:
+        try:
+            rid = int(region.get('id'))
+            shape = region.get('shape')
+            x1 = int(region.get('x1')); y1 = int(region.get('y1'))
+            x2 = int(region.get('x2')); y2 = int(region.get('y2'))
+            cf, cp = _choose_new_colors_for_region(region, palette, sid)
+            seed = _coerce_int(region.get('seed')) or _derive_region_seed(rid, sid)
+            variant = int(region.get('variant') or 1)
+            tiles = pm.generate_region(rid, x1, y1, x2, y2, shape, variant, cf, cp, settings=settings, seed=seed)
+            new_tiles_all.extend(tiles)
+            # Update region colors (and ensure seed stored)
+            region['color_fundo'] = cf
+            region['color_padrao'] = cp
+            region['seed'] = int(seed)
+        except Exception as e:
+            raise RuntimeError(f"Failed recoloring region {region.get('id')}: {e}")
+    return new_tiles_all
+
+
+@app.route('/edit-region', methods=['POST'])
+def edit_region():
+    """
+    Edit a single region by id. Body: { region_id, action: 'reroll'|'recolor', colors?: { color_fundo?, color_padrao? } }
+    Recomputes tiles for that region and updates the session's pattern and regions.
+    """
+    js = request.get_json(force=True, silent=True) or {}
+    payload, status = _run_edit(_compute_edit_region, _session_id_from_request(), js)
+    return jsonify(payload), status
+
+@app.route('/edit-regions', methods=['POST'])
+def edit_regions():
+    """
+    Apply several region edits at once. Body: { ops: [{ region_id, action, colors? }, ...] }
+    Returns only what changed: { region_ids, tiles, regions }. Clients drop their tiles with
+    those region ids and append the returned tiles.
+    """
+    js = request.get_json(force=True, silent=True) or {}
+    payload, status = _run_edit(_compute_edit_regions, _session_id_from_request(), js)
+    return jsonify(payload), status
 
-    return jsonify({"status": "ok", "pattern": kept, "regions": regions, "region": new_region})
+@app.route('/magic-wand', methods=['POST'])
+def magic_wand():
+    """
+    Create a new region by selecting two opposite tiles (diagonal corners),
+    fill that rectangular area with a freshly generated pattern using current data-driven settings.
+    Body: { x1, y1, x2, y2 }
+    """
+    js = request.get_json(force=True, silent=True) or {}
+    payload, status = _run_edit(_compute_magic_wand, _session_id_from_request(), js)
+    return jsonify(payload), status
 
 
 @app.route('/recolor-all', methods=['POST'])
 def recolor_all():
     """Recolor all existing regions (keep layout/variant/seed), return full updated pattern and regions."""
-    if pm is None:
-        return jsonify({"status": "error", "message": "Generator module not available"}), 500
-    sid = _session_id_from_request()
-    pattern_path = _pattern_path_for(sid)
-    regions_path = _regions_path_for(sid)
-    data_path = _data_path_for(sid)
-    settings = _json_load_file(data_path, {})
+    payload, status = _run_edit(_compute_recolor_all, _session_id_from_request(), {})
+    return jsonify(payload), status
 
-    regions = _load_json_safe(regions_path, [])
-    if not regions:
-        return jsonify({"status": "error", "message": "No regions available to recolor"}), 400
-    palette = _active_palette_colors(data_path)
+# -------- Undo/redo: per-session op log (history.py) --------
+# Generations are logged by seed and edits by their resulting region descriptors, so undo
+# and redo rebuild a position by replaying ops from the nearest anchor (a generation or a
+# periodic whole-state snapshot) instead of storing every pattern.
+def _history_lock(sid):
+    """Exclusive access to one session's log, across threads and gunicorn workers; other
+    sessions never wait on it."""
+    return _file_lock(_history_path_for(sid) + '.lock')
 
-    # Build new tiles per region
-    new_tiles_all = []
+
+def _history_for(sid):
+    return history.OpLog(_history_path_for(sid), HISTORY_MAX_ENTRIES, HISTORY_SNAPSHOT_EVERY)
+
+
+def _history_current_state(sid):
+    return {
+        'pattern': _load_json_safe(_pattern_path_for(sid), []),
+        'regions': _load_json_safe(_regions_path_for(sid), []),
+        'pattern_seed': _json_load_file(_meta_path_for(sid), {}).get('pattern_seed'),
+    }
+
+
+def _record_history(sid, entry):
+    """Append an op whose result is already saved; returns the log status (None on failure)."""
     try:
-        for idx, region in enumerate(regions):
-            try:
-                rid = int(region.get('id'))
-                shape = region.get('shape')
-                x1 = int(region.get('x1')); y1 = int(region.get('y1'))
-                x2 = int(region.get('x2')); y2 = int(region.get('y2'))
-                cf, cp = _choose_new_colors_for_region(region, palette, sid)
-                seed = _coerce_int(region.get('seed')) or _derive_region_seed(rid, sid)
-                variant = int(region.get('variant') or 1)
-                tiles = pm.generate_region(rid, x1, y1, x2, y2, shape, variant, cf, cp, settings=settings, seed=seed)
-                new_tiles_all.extend(tiles)
-                # Update region colors (and ensure seed stored)
-                region['color_fundo'] = cf
-                region['color_padrao'] = cp
-                region['seed'] = int(seed)
-            except Exception as e:
-                return jsonify({"status": "error", "message": f"Failed recoloring region {region.get('id')}: {e}"}), 500
+        with _history_lock(sid):
+            log = _history_for(sid)
+            snapshot = log.append(entry)
+            if snapshot:
+                _json_dump_file(_history_current_state(sid), snapshot)
+            log.save()
+            return log.status()
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to recolor all: {e}"}), 500
+        print("history record error:", e)
+        return None
 
-    # Merge with existing pattern by replacing all region tiles
-    pattern = _load_json_safe(pattern_path, [])
-    keep = [t for t in pattern if (t.get('region_id') is None)]
-    keep.extend(new_tiles_all)
 
-    # Save
+def _clear_history(sid):
     try:
-        with open(pattern_path, 'w') as pf:
-            json.dump(keep, pf, indent=2)
-        with open(regions_path, 'w') as rf:
-            json.dump(regions, rf, indent=2)
+        with _history_lock(sid):
+            log = _history_for(sid)
+            log.clear()
+            log.save()
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Failed to save recolor-all: {e}"}), 500
+        print("history clear error:", e)
+
+
+def _history_region_tiles(region, settings):
+    return pm.generate_region(int(region['id']), int(region['x1']), int(region['y1']), int(region['x2']), int(region['y2']),
+                              region.get('shape'), int(region.get('variant') or 1),
+                              region.get('color_fundo'), region.get('color_padrao'),
+                              settings=settings, seed=region.get('seed'))
+
+
+def _history_apply(state, entry, sid):
+    """Replay one logged op on state {'pattern', 'regions', 'pattern_seed'} (caller holds _pm_global_lock)."""
+    op = entry.get('op')
+    settings = entry.get('settings') or {}
+    if op == 'generate':
+        state['pattern'] = pm.generate(settings=settings, seed=entry['seed']) or []
+        state['regions'] = list(getattr(pm, 'REGIONS', []) or [])
+        state['pattern_seed'] = entry['seed']
+    elif op == 'resize':
+        state['pattern'], state['regions'] = pm.resize(state['pattern'], state['regions'], settings=settings, seed=entry['seed'])
+    elif op == 'regions':
+        edited = {int(r['id']): dict(r) for r in entry.get('regions') or []}
+        pattern = [t for t in state['pattern'] if int(t.get('region_id') or -1) not in edited]
+        for region in edited.values():
+            pattern.extend(_history_region_tiles(region, settings))
+        state['pattern'] = pattern
+        state['regions'] = [edited.get(int(r.get('id')), r) for r in state['regions']]
+    elif op == 'wand':
+        region = dict(entry['region'])
+        pattern = [t for t in state['pattern']
+                   if not (region['x1'] <= int(t.get('grid_x', 0)) <= region['x2']
+                           and region['y1'] <= int(t.get('grid_y', 0)) <= region['y2'])]
+        pattern.extend(_history_region_tiles(region, settings))
+        state['pattern'] = pattern
+        state['regions'] = state['regions'] + [region]
+    elif op == 'recolor-all':
+        regions = state['regions']
+        for region in regions:
+            # Seedless regions derive theirs from the pattern seed of the state being rebuilt
+            if not _coerce_int(region.get('seed')):
+                region['seed'] = _derive_region_seed(int(region.get('id')), sid, base=state['pattern_seed'])
+        keep = [t for t in state['pattern'] if t.get('region_id') is None]
+        keep.extend(_recolor_region_tiles(regions, list(pepesettings.from_dict(settings).palette), settings, sid))
+        state['pattern'] = keep
+    else:
+        raise ValueError(f"unknown history op {op!r}")
+
+
+def _history_state_at(sid, log, position):
+    """Rebuild the state after entry `position` from its nearest anchor, or None if none is left."""
+    anchor = log.anchor_for(position)
+    if anchor is None:
+        return None
+    entry = log.entries[anchor]
+    if entry.get('snapshot'):
+        state = _json_load_file(log.snapshot_path(entry), None)
+        if not state:
+            return None
+    else:
+        state = {}
+        _history_apply(state, entry, sid)
+    for e in log.entries[anchor + 1:position + 1]:
+        _history_apply(state, e, sid)
+    return state
+
+
+def _history_move(sid, step):
+    """Undo (step -1) or redo (step 1): rebuild that position and save it as the session's
+    pattern, regions, meta and settings. Returns (payload, status_code)."""
+    if pm is None:
+        return {"status": "error", "message": "Generator module not available"}, 500
+    if os.path.exists(_run_marker_for(sid)):
+        return {"status": "error", "message": "A generation is in progress"}, 409
+    start_ts = time.time()
+    # Only this session is held while replaying; _pm_lock covers the generator globals
+    with _session_lock(sid), _history_lock(sid):
+        log = _history_for(sid)
+        target = log.position + step
+        if target < 0 or target >= len(log.entries):
+            return {"status": "error", "message": "Nothing to undo" if step < 0 else "Nothing to redo"}, 409
+        entry = log.entries[target]
+        try:
+            with _pm_lock():
+                if step == 1 and not history.is_anchor(entry):
+                    # Redo of a single op: replay it on the saved state
+                    state = _history_current_state(sid)
+                    _history_apply(state, entry, sid)
+                else:
+                    state = _history_state_at(sid, log, target)
+        except Exception as e:
+            print("history replay error:", e)
+            return {"status": "error", "message": "Failed to rebuild this history step"}, 500
+        if state is None:
+            return {"status": "error", "message": "This history step is no longer available"}, 410
+
+        settings = entry.get('settings') or {}
+        meta = {"pattern_seed": state.get('pattern_seed'), "generated_at": time.time(), "mode": "history"}
+        periodic = pm.periodic_layout(settings)
+        if periodic:
+            meta["periodic"] = periodic
+        saved = (_json_dump_file(state['pattern'], _pattern_path_for(sid), precompress=True)
+                 and _json_dump_file(state['regions'], _regions_path_for(sid), precompress=True)
+                 and _json_dump_file(meta, _meta_path_for(sid))
+                 and _json_dump_file(settings, _data_path_for(sid)))
+        if not saved:
+            return {"status": "error", "message": "Failed to save history step"}, 500
+        log.position = target
+        log.save()
+        print(json.dumps({"event": "history_move", "sid": sid or "global", "pid": os.getpid(), "position": target,
+                          "op": entry.get('op'), "elapsed_ms": int((time.time() - start_ts) * 1000)}))
+        return {"status": "ok", "op": entry.get('op'), "history": log.status()}, 200
+
+
+@app.route('/history')
+def history_status():
+    """Position in the session's undo/redo log and the op at each entry."""
+    sid = _session_id_from_request()
+    with _history_lock(sid):
+        log = _history_for(sid)
+        payload = dict(log.status(), ops=[e.get('op') for e in log.entries])
+    resp = jsonify(payload)
+    return _no_store(resp)
+
+
+@app.route('/history/undo', methods=['POST'])
+def history_undo():
+    """Step back one op. The session's pattern, regions and settings become that state's;
+    clients refetch /pattern.json and /data.json."""
+    payload, status = _history_move(_session_id_from_request(), -1)
+    return jsonify(payload), status
+
+
+@app.route('/history/redo', methods=['POST'])
+def history_redo():
+    payload, status = _history_move(_session_id_from_request(), 1)
+    return jsonify(payload), status
 
-    return jsonify({"status": "ok", "pattern": keep, "regions": regions})
 
 if __name__ == '__main__':
+    # Development server; production runs `python server.py` (gunicorn, multi-worker)
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,185 @@
+"""
+asyncio (ASGI) surface for the generation and edit routes.
+
+    uvicorn asgi:app --workers 4        (or SERVER_MODE=asgi python server.py)
+
+/generate, /generate/status, /edit-region(s), /magic-wand and /recolor-all are served
+natively with the same JSON contract as the Flask routes in app.py (they share the
+same load/compute/save functions). File loads and saves run on the default thread pool,
+region generation runs on a small CPU executor, so the event loop only parks coroutines
+and one process can hold thousands of idle or polling clients while generation runs.
+
+Every other path (index, static files, pattern/regions downloads) is delegated to the
+Flask WSGI app through whichever WSGI->ASGI adapter is installed.
+"""
+import os
+import json
+import asyncio
+from http.cookies import SimpleCookie
+from concurrent.futures import ThreadPoolExecutor
+
+import app as flask_app
+
+# pm keeps module-level state, so more threads would only queue on _pm_global_lock
+ASGI_CPU_WORKERS = int(os.environ.get('ASGI_CPU_WORKERS', 1))
+_cpu_executor = ThreadPoolExecutor(max_workers=ASGI_CPU_WORKERS, thread_name_prefix='asgi-cpu')
+
+try:
+    from asgiref.wsgi import WsgiToAsgi as _WsgiToAsgi
+except Exception:
+    try:
+        from a2wsgi import WSGIMiddleware as _WsgiToAsgi
+    except Exception:
+        try:
+            from uvicorn.middleware.wsgi import WSGIMiddleware as _WsgiToAsgi
+        except Exception:
+            _WsgiToAsgi = None
+
+_wsgi_fallback = _WsgiToAsgi(flask_app.app) if _WsgiToAsgi is not None else None
+
+
+def _dumps(obj):
+    if flask_app._orjson is not None:
+        return flask_app._orjson.dumps(obj, option=flask_app._orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _session_id(scope):
+    for name, value in scope.get('headers') or []:
+        if name == b'cookie':
+            jar = SimpleCookie()
+            try:
+                jar.load(value.decode('latin-1'))
+            except Exception:
+                continue
+            if 'session_id' in jar:
+                return jar['session_id'].value
+    return None
+
+
+async def _read_json_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    try:
+        js = json.loads(b''.join(chunks) or b'null')
+    except Exception:
+        js = None
+    return js if isinstance(js, dict) else {}
+
+
+async def _send_json(send, payload, status=200):
+    loop = asyncio.get_running_loop()
+    # Edit responses carry the full pattern; encode off the loop
+    body = await loop.run_in_executor(None, _dumps, payload)
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode('ascii')),
+        (b'cache-control', b'no-store'),
+    ]
+    if isinstance(payload, dict) and payload.get('retry_after'):
+        headers.append((b'retry-after', str(payload['retry_after']).encode('ascii')))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers,
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _compute_locked(compute, sid, js, state):
+    with flask_app._pm_lock():
+        return compute(sid, js, state)
+
+
+async def _run_edit_async(compute, sid, js):
+    if flask_app.pm is None:
+        return {"status": "error", "message": "Generator module not available"}, 500
+    loop = asyncio.get_running_loop()
+    # The session lock spans all three phases (as in app._run_edit); it is a file lock, so it
+    # is taken and released on worker threads rather than blocking the event loop
+    lock = flask_app._session_lock(sid)
+    await asyncio.to_thread(lock.__enter__)
+    try:
+        state = await asyncio.to_thread(flask_app._load_edit_state, sid)
+        result = await loop.run_in_executor(_cpu_executor, _compute_locked, compute, sid, js, state)
+        return await asyncio.to_thread(flask_app._save_edit_writes, result)
+    finally:
+        await asyncio.to_thread(lock.__exit__, None, None, None)
+
+
+async def _edit_region(sid, js):
+    return await _run_edit_async(flask_app._compute_edit_region, sid, js)
+
+
+async def _edit_regions(sid, js):
+    return await _run_edit_async(flask_app._compute_edit_regions, sid, js)
+
+
+async def _magic_wand(sid, js):
+    return await _run_edit_async(flask_app._compute_magic_wand, sid, js)
+
+
+async def _recolor_all(sid, js):
+    return await _run_edit_async(flask_app._compute_recolor_all, sid, {})
+
+
+async def _generate(sid, js):
+    # Scheduling only touches marker files and the job store; generation itself runs on app._scheduler
+    resize = isinstance(js, dict) and js.get('mode') == 'resize'
+    return await asyncio.to_thread(flask_app._start_generation, sid, resize)
+
+
+async def _generate_status(sid, js):
+    # A couple of stat() calls: cheap enough to run inline for high-frequency polling
+    return flask_app._generation_status(sid), 200
+
+
+ROUTES = {
+    ('POST', '/generate'): _generate,
+    ('GET', '/generate/status'): _generate_status,
+    ('POST', '/edit-region'): _edit_region,
+    ('POST', '/edit-regions'): _edit_regions,
+    ('POST', '/magic-wand'): _magic_wand,
+    ('POST', '/recolor-all'): _recolor_all,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _cpu_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is not None:
+        sid = _session_id(scope)
+        js = await _read_json_body(receive) if scope['method'] == 'POST' else {}
+        try:
+            payload, status = await handler(sid, js)
+        except flask_app.PatternTooLarge as e:
+            payload, status = {"status": "error", "message": str(e)}, 413
+        except Exception as e:
+            payload, status = {"status": "error", "message": str(e)}, 500
+        await _send_json(send, payload, status)
+        return
+    if _wsgi_fallback is not None:
+        await _wsgi_fallback(scope, receive, send)
+        return
+    await _send_json(send, {"status": "error", "message": "Not found"}, 404)
@@ -0,0 +1,238 @@
+"""
+Bulk offline generation: many patterns across settings and seeds, on every core.
+
+    python batch_generate.py --grid grid.json --seeds 20 --out catalog/
+    python batch_generate.py --manifest jobs.jsonl --out catalog/ --workers 8
+
+--grid is a JSON object of settings keys; a list value is one axis of the grid, anything
+else is fixed. Every combination (on top of --base, default data.json) gets --seeds patterns:
+
+    {"canvas_width": [1000, 2000], "knob_down": [1, 3], "switch": ["left", "right"]}
+
+--manifest is JSON lines, one pattern each: {"settings": {...}, "seed": 123 (optional)}.
+
+Seeds not given are derived from the settings and the seed index (and --base-seed), so a
+job always has the same id and output. Each pattern is written as a tile store
+(<out>/<id>.tiles, see tilestore.py) and gets one line in <out>/index.jsonl:
+
+    {"id", "file", "seed", "settings", "cols", "rows", "tiles", "regions", "elapsed_ms"}
+
+Jobs already in the index are skipped, so an interrupted run resumes where it stopped.
+Progress (patterns/s, tiles/s, ETA) is printed as JSON lines.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import PepesMachine as pm
+import tilestore
+
+INDEX_NAME = 'index.jsonl'
+
+
+def _canonical(settings):
+    return json.dumps(settings, sort_keys=True, separators=(',', ':'))
+
+
+def derive_seed(settings, index, base_seed=0):
+    digest = hashlib.sha256(f"{base_seed}:{_canonical(settings)}:{index}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') & 0x7FFFFFFF
+
+
+def job_id(settings, seed):
+    return hashlib.sha256(f"{_canonical(settings)}:{seed}".encode('utf-8')).hexdigest()[:16]
+
+
+def grid_jobs(grid, base, seeds, base_seed=0):
+    keys = sorted(grid)
+    axes = [grid[k] if isinstance(grid[k], list) else [grid[k]] for k in keys]
+    for values in itertools.product(*axes):
+        settings = dict(base, **dict(zip(keys, values)))
+        for i in range(seeds):
+            yield settings, derive_seed(settings, i, base_seed)
+
+
+def manifest_jobs(path, base, base_seed=0):
+    with open(path, 'r', encoding='utf-8') as f:
+        for n, line in enumerate(f):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            settings = dict(base, **(entry.get('settings') or {}))
+            seed = entry.get('seed')
+            yield settings, int(seed) if seed is not None else derive_seed(settings, n, base_seed)
+
+
+def _init_worker():
+    # Ctrl-C reaches the whole process group: the parent decides (it lets running jobs finish)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # PepesMachine prints a line per generation; only the parent reports
+    sys.stdout = open(os.devnull, 'w')
+
+
+def run_job(settings, seed, out_dir):
+    """Generate one pattern into <out_dir>/<id>.tiles; returns its index record."""
+    start_ts = time.time()
+    jid = job_id(settings, seed)
+    path = os.path.join(out_dir, f"{jid}.tiles")
+    _, _, rows, cols = pm._dimensions_from_settings(pm.block_settings(settings))
+    try:
+        knob_value = max(0, int(settings.get('knob_down', 0)))
+    except (TypeError, ValueError):
+        knob_value = 0
+    meta = {"pattern_seed": seed, "settings": settings}
+    periodic = pm.periodic_layout(settings)
+    if periodic:
+        meta["periodic"] = periodic
+    tmp = f"{path}.tmp{os.getpid()}"
+    store = tilestore.TileStore.create(tmp, cols, rows, tilestore.max_regions_for(cols, rows, knob_value), meta=meta)
+    try:
+        pm.generate(settings=settings, seed=seed,
+                    sink=lambda tiles, regions: (store.put_tiles(tiles), store.put_regions(regions)))
+        region_count = store.header.get('region_count', 0)
+        store.close()
+    except Exception:
+        store.close()
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    return {
+        "id": jid,
+        "file": os.path.basename(path),
+        "seed": seed,
+        "settings": settings,
+        "cols": cols,
+        "rows": rows,
+        "tiles": cols * rows,
+        "regions": region_count,
+        "elapsed_ms": int((time.time() - start_ts) * 1000),
+    }
+
+
+def _done_ids(out_dir):
+    done = set()
+    try:
+        with open(os.path.join(out_dir, INDEX_NAME), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of an interrupted run
+                if os.path.exists(os.path.join(out_dir, rec.get('file', ''))):
+                    done.add(rec.get('id'))
+    except OSError:
+        pass
+    return done
+
+
+def run_batch(jobs, out_dir, workers=None, progress_every=2.0):
+    os.makedirs(out_dir, exist_ok=True)
+    done = _done_ids(out_dir)
+    pending, seen = [], set()
+    for settings, seed in jobs:
+        jid = job_id(settings, seed)
+        if jid not in done and jid not in seen:
+            seen.add(jid)
+            pending.append((settings, seed))
+    total = len(pending)
+    print(json.dumps({"event": "batch_start", "pending": total, "already_done": len(done), "out": out_dir}))
+
+    workers = max(1, workers or os.cpu_count() or 1)
+    start_ts = last_report = time.time()
+    finished = failed = tiles = 0
+
+    def report(event):
+        elapsed = max(1e-6, time.time() - start_ts)
+        rate = finished / elapsed
+        print(json.dumps({
+            "event": event,
+            "done": finished,
+            "failed": failed,
+            "total": total,
+            "patterns_per_sec": round(rate, 2),
+            "tiles_per_sec": int(tiles / elapsed),
+            "elapsed_s": round(elapsed, 1),
+            "eta_s": round((total - finished - failed) / rate, 1) if rate else None,
+        }), flush=True)
+
+    queue = iter(pending)
+    with open(os.path.join(out_dir, INDEX_NAME), 'a', encoding='utf-8') as index, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        running = {}
+        # Keep a bounded window of jobs in flight instead of queueing the whole catalog
+        for settings, seed in itertools.islice(queue, workers * 2):
+            running[pool.submit(run_job, settings, seed, out_dir)] = seed
+        stopping = False
+        while running:
+            try:
+                finished_now, _ = wait(running, timeout=progress_every, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                if stopping:
+                    raise
+                # Record what is already running; everything else is picked up on resume
+                stopping = True
+                for fut in list(running):
+                    if fut.cancel():
+                        del running[fut]
+                print(json.dumps({"event": "batch_interrupted", "finishing": len(running)}), flush=True)
+                continue
+            for fut in finished_now:
+                seed = running.pop(fut)
+                try:
+                    rec = fut.result()
+                except Exception as e:
+                    failed += 1
+                    print(json.dumps({"event": "batch_job_failed", "seed": seed, "error": str(e)}), flush=True)
+                else:
+                    finished += 1
+                    tiles += rec['tiles']
+                    # One line per finished pattern, flushed: the index is the resume point
+                    index.write(json.dumps(rec, separators=(',', ':')) + '\n')
+                    index.flush()
+                for settings, seed in itertools.islice(queue, 0 if stopping else 1):
+                    running[pool.submit(run_job, settings, seed, out_dir)] = seed
+            if time.time() - last_report >= progress_every:
+                last_report = time.time()
+                report("batch_progress")
+    report("batch_interrupted" if stopping else "batch_done")
+    return 130 if stopping else 1 if failed else 0
+
+
+def _load_base(path):
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f) or {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--grid', help='JSON file: settings keys -> value or list of values')
+    source.add_argument('--manifest', help='JSON lines: {"settings": {...}, "seed": optional}')
+    parser.add_argument('--base', default=os.path.join(pm.BASE_DIR, 'data.json'),
+                        help='settings every job starts from (default data.json)')
+    parser.add_argument('--seeds', type=int, default=1, help='patterns per grid combination')
+    parser.add_argument('--base-seed', type=int, default=0, help='varies the derived seeds')
+    parser.add_argument('--out', required=True, help='output directory (tile stores and index.jsonl)')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: all cores)')
+    parser.add_argument('--progress-every', type=float, default=2.0, help='seconds between progress lines')
+    args = parser.parse_args()
+
+    base = _load_base(args.base)
+    if args.grid:
+        with open(args.grid, 'r', encoding='utf-8') as f:
+            jobs = grid_jobs(json.load(f), base, max(1, args.seeds), args.base_seed)
+    else:
+        jobs = manifest_jobs(args.manifest, base, args.base_seed)
+    return run_batch(jobs, args.out, workers=args.workers, progress_every=args.progress_every)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
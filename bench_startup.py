@@ -0,0 +1,136 @@
+"""
+Startup benchmark: how long until a fresh process can serve.
+
+    python bench_startup.py                 # import and first-request timings
+    python bench_startup.py --server        # also time `python server.py` to its first HTTP response
+    python bench_startup.py --max-first-request-ms 1500   # exit 1 when slower (CI budget)
+
+Each run starts a new interpreter and reports, in milliseconds:
+  import_pm      `import PepesMachine`
+  import_app     `import app` (includes PepesMachine and the other app modules)
+  first_request  GET / through the Flask test client right after importing the app
+  total          interpreter start to first response, measured from outside
+Runs are repeated (--runs) and summarised as min / median / max in one JSON line.
+
+Importing PepesMachine must stay side-effect free: the child also records any file the
+import opened or directory it created, and the benchmark fails if there are any.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_CHILD = r'''
+import os, sys, json, time, builtins
+t0 = time.perf_counter()
+touched = []
+_open, _makedirs = builtins.open, os.makedirs
+def _tracking_open(file, mode='r', *a, **kw):
+    touched.append(str(file))
+    return _open(file, mode, *a, **kw)
+def _tracking_makedirs(name, *a, **kw):
+    touched.append(str(name))
+    return _makedirs(name, *a, **kw)
+builtins.open, os.makedirs = _tracking_open, _tracking_makedirs
+import PepesMachine
+t1 = time.perf_counter()
+builtins.open, os.makedirs = _open, _makedirs
+import app
+t2 = time.perf_counter()
+resp = app.app.test_client().get('/')
+resp.get_data()
+t3 = time.perf_counter()
+print(json.dumps({
+    "import_pm": (t1 - t0) * 1000,
+    "import_app": (t2 - t1) * 1000,
+    "first_request": (t3 - t2) * 1000,
+    "status": resp.status_code,
+    "pm_touched": touched,
+}))
+'''
+
+
+def _summary(values):
+    values = sorted(values)
+    return {"min": round(values[0], 1), "median": round(values[len(values) // 2], 1), "max": round(values[-1], 1)}
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def run_import():
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', _CHILD], cwd=BASE_DIR, capture_output=True, text=True,
+                         env=dict(os.environ, PYTHONPATH=BASE_DIR))
+    total = (time.perf_counter() - start) * 1000
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "child failed")
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["total"] = total
+    return result
+
+
+def run_server(timeout=60.0):
+    """Milliseconds from spawning server.py until GET / answers."""
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY='1')
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, 'server.py'], cwd=BASE_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server.py exited with {proc.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as resp:
+                    resp.read()
+                return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError("server did not answer in time")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--server', action='store_true', help='also time server.py to its first HTTP response')
+    parser.add_argument('--max-first-request-ms', type=float, default=None,
+                        help='fail when the median total exceeds this many milliseconds')
+    args = parser.parse_args()
+
+    runs = [run_import() for _ in range(max(1, args.runs))]
+    report = {key: _summary([r[key] for r in runs]) for key in ('import_pm', 'import_app', 'first_request', 'total')}
+    report["import_pm_touched"] = sorted({f for r in runs for f in r["pm_touched"]})
+    if args.server:
+        report["server_first_response"] = _summary([run_server() for _ in range(max(1, args.runs))])
+    print(json.dumps(report))
+
+    failed = False
+    if report["import_pm_touched"]:
+        print("importing PepesMachine touched the filesystem", file=sys.stderr)
+        failed = True
+    if args.max_first_request_ms is not None and report["total"]["median"] > args.max_first_request_ms:
+        print(f"time to first request {report['total']['median']}ms > {args.max_first_request_ms}ms", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
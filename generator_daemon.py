@@ -0,0 +1,182 @@
+"""
+Long-lived generator process for out-of-process generation.
+
+    python generator_daemon.py --socket user_data/generator.sock --workers 2
+
+PepesMachine is imported once, then the listening Unix socket is shared by --workers
+pre-forked processes. Each connection carries newline-delimited JSON jobs:
+
+    {"op": "generate", "settings": {...}, "seed": 123, "mode": "memory",
+     "pattern_path": ".../pattern_<sid>.json", "regions_path": ".../regions_<sid>.json"}
+    {"op": "generate", ..., "mode": "streaming", "store_path": ".../pattern_<sid>.tiles",
+     "cols": 800, "rows": 600, "max_regions": 120000}
+    {"op": "resize", ...}   memory mode only: fit the layout at pattern_path / regions_path
+                            to the settings' canvas (PepesMachine.resize)
+    {"op": "ping"}
+    {"op": "stats"}         region-fill cache counters of the worker that answers
+
+and gets one JSON line back per job. Results are written next to the requested paths
+under temporary names and returned as file references ("pattern", "regions" or "store");
+the caller moves them into place, or deletes them if the run was superseded.
+
+app.py starts this daemon on demand (GEN_MODE=daemon, or when it cannot import
+PepesMachine itself), replacing one `python PepesMachine.py` process per /generate.
+"""
+import gc
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import socketserver
+
+try:
+    import orjson as _orjson
+except Exception:
+    _orjson = None
+
+import PepesMachine as pm
+import tilestore
+
+
+def _dumps(obj):
+    if _orjson is not None:
+        return _orjson.dumps(obj, option=_orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _tmp_for(path):
+    return f"{path}.tmpd{os.getpid()}.{time.time_ns()}"
+
+
+def _write_tmp(obj, path):
+    tmp = _tmp_for(path)
+    with open(tmp, 'wb') as f:
+        f.write(_dumps(obj))
+    return tmp
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return _orjson.loads(data) if _orjson is not None else json.loads(data)
+
+
+def run_job(job):
+    settings = job.get('settings') or {}
+    seed = job.get('seed')
+    start_ts = time.time()
+    if job.get('mode') == 'streaming':
+        store = tilestore.TileStore.create(_tmp_for(job['store_path']), int(job['cols']), int(job['rows']),
+                                           int(job['max_regions']), meta={"pattern_seed": seed})
+        try:
+            pm.generate(settings=settings, seed=seed,
+                        sink=lambda tiles, regions: (store.put_tiles(tiles), store.put_regions(regions)))
+            region_count = store.header.get('region_count', 0)
+            store.close()
+        except Exception:
+            store.close()
+            os.remove(store.path)
+            raise
+        return {"status": "ok", "store": store.path, "regions_count": region_count,
+                "elapsed_ms": int((time.time() - start_ts) * 1000)}
+    if job.get('op') == 'resize':
+        # Fit the session's current layout (the files at pattern_path / regions_path) to the new canvas
+        pattern, regions = pm.resize(_read(job['pattern_path']), _read(job['regions_path']), settings=settings, seed=seed)
+    else:
+        pattern = pm.generate(settings=settings, seed=seed) or []
+        regions = list(getattr(pm, 'REGIONS', []) or [])
+    elapsed_ms = int((time.time() - start_ts) * 1000)
+    return {
+        "status": "ok",
+        "pattern": _write_tmp(pattern, job['pattern_path']),
+        "regions": _write_tmp(regions, job['regions_path']),
+        "tiles_count": len(pattern),
+        "regions_count": len(regions),
+        "elapsed_ms": elapsed_ms,
+    }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+                op = job.get('op', 'generate')
+                if op == 'ping':
+                    reply = {"status": "ok", "pid": os.getpid()}
+                elif op == 'stats':
+                    reply = {"status": "ok", "pid": os.getpid(), "fill_cache": pm.fill_cache_stats()}
+                elif op in ('generate', 'resize'):
+                    reply = run_job(job)
+                else:
+                    reply = {"status": "error", "message": f"unknown op {op!r}"}
+            except Exception as e:
+                reply = {"status": "error", "message": str(e)}
+            self.wfile.write(_dumps(reply) + b'\n')
+            self.wfile.flush()
+
+
+def _already_running(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+def serve(path, workers=1):
+    if os.path.exists(path):
+        if _already_running(path):
+            print(f"generator daemon already listening on {path}")
+            return
+        os.remove(path)  # stale socket from a dead daemon
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    server = socketserver.UnixStreamServer(path, _Handler)
+    # Everything imported so far (pm's motif tables included) is never collected: keep the
+    # collector from touching those pages so forked workers keep sharing them copy-on-write
+    gc.freeze()
+    children = []
+    # Pre-fork after bind: every process accepts on the same socket with pm already imported
+    for _ in range(max(1, workers) - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = None
+            break
+        children.append(pid)
+
+    if children is not None:
+        def _stop(signum, frame):
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            sys.exit(0)
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+        print(json.dumps({"event": "generator_daemon_ready", "socket": path, "pid": os.getpid(), "workers": workers}))
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--socket', default=os.environ.get('GEN_DAEMON_SOCKET', os.path.join(pm.USER_DATA_DIR, 'generator.sock')))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('GEN_DAEMON_WORKERS', 1)))
+    args = parser.parse_args()
+    serve(args.socket, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import os
+import json
+import uuid
+
+# Per-session undo/redo history kept as a compact op log instead of whole patterns.
+#
+#   history_<sid>.json   {"entries": [...], "position": i, "next_snapshot": n}
+#
+# Each entry is one op, replayable on the state left by the entries before it:
+#   {"op": "generate", "seed", "settings"}              full generation from a seed
+#   {"op": "resize", "seed", "settings"}                PepesMachine.resize of the previous layout
+#   {"op": "regions", "settings", "regions": [...]}     edited regions' final descriptors (with seeds)
+#   {"op": "wand", "settings", "region": {...}}         new region over a rectangle
+#   {"op": "recolor-all", "settings"}                   deterministic recolor of every region
+#
+# "generate" entries are anchors: the state after them is rebuilt from the seed alone. Every
+# snapshot_every entries past the last anchor (and for the first entry of a log that does not
+# start with a generation), the state after the entry is also saved whole to a snapshot file
+# named in the entry's "snapshot" key, which makes that entry an anchor too. Rebuilding any
+# position replays at most snapshot_every - 1 ops on top of the nearest anchor.
+#
+# append() gives every entry an "id" unique across logs; status() reports the current one,
+# so clients can cache what a step looks like under it.
+#
+# The log keeps at most max_entries entries (plus the ops since the newest anchor): older
+# ones are dropped up to an anchor, so entry 0 is always an anchor and the oldest reachable state.
+
+
+def is_anchor(entry):
+    return entry.get('op') == 'generate' or bool(entry.get('snapshot'))
+
+
+class OpLog:
+    def __init__(self, path, max_entries=50, snapshot_every=20):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.snapshot_every = max(1, int(snapshot_every))
+        data = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f) or {}
+        except (OSError, ValueError):
+            pass
+        self.entries = list(data.get('entries') or [])
+        self.position = int(data.get('position', len(self.entries) - 1))
+        self.position = max(-1, min(self.position, len(self.entries) - 1))
+        self.next_snapshot = int(data.get('next_snapshot', 1))
+
+    def save(self):
+        if not self.entries:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            return
+        tmp = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'entries': self.entries, 'position': self.position, 'next_snapshot': self.next_snapshot},
+                      f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    def status(self):
+        return {
+            "id": self.entries[self.position].get('id') if self.position >= 0 else None,
+            "position": self.position,
+            "length": len(self.entries),
+            "can_undo": self.position > 0,
+            "can_redo": self.position < len(self.entries) - 1,
+        }
+
+    # ----- snapshots -----
+
+    def snapshot_path(self, entry):
+        name = entry.get('snapshot')
+        return os.path.join(os.path.dirname(self.path), name) if name else None
+
+    def _drop(self, entries):
+        for entry in entries:
+            path = self.snapshot_path(entry)
+            if path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _steps_since_anchor(self):
+        for i in range(len(self.entries) - 1, -1, -1):
+            if is_anchor(self.entries[i]):
+                return len(self.entries) - 1 - i
+        return None
+
+    # ----- recording -----
+
+    def clear(self):
+        self._drop(self.entries)
+        self.entries = []
+        self.position = -1
+
+    def append(self, entry):
+        """Record entry after the current position (dropping the redo tail). Returns the
+        snapshot file path the caller must write the resulting state to, or None."""
+        self._drop(self.entries[self.position + 1:])
+        del self.entries[self.position + 1:]
+        entry = dict(entry)
+        entry.pop('snapshot', None)
+        entry['id'] = uuid.uuid4().hex[:16]
+        steps = self._steps_since_anchor()
+        if entry.get('op') != 'generate' and (steps is None or steps + 1 >= self.snapshot_every):
+            base = os.path.splitext(os.path.basename(self.path))[0]
+            entry['snapshot'] = f"{base}.snap{self.next_snapshot}.json"
+            self.next_snapshot += 1
+        self.entries.append(entry)
+        self.position = len(self.entries) - 1
+        self._compact()
+        return self.snapshot_path(entry)
+
+    def _compact(self):
+        if len(self.entries) <= self.max_entries:
+            return
+        first = len(self.entries) - self.max_entries
+        cut = next((i for i in range(first, len(self.entries)) if is_anchor(self.entries[i])), None)
+        if not cut:
+            return
+        self._drop(self.entries[:cut])
+        del self.entries[:cut]
+        self.position -= cut
+
+    # ----- replay -----
+
+    def anchor_for(self, position):
+        """Index of the nearest usable anchor at or before position (a snapshot whose file is
+        gone falls back to an earlier anchor), or None."""
+        for i in range(position, -1, -1):
+            entry = self.entries[i]
+            if entry.get('snapshot'):
+                if os.path.exists(self.snapshot_path(entry)):
+                    return i
+            elif entry.get('op') == 'generate':
+                return i
+        return None
@@ -0,0 +1,191 @@
+import os
+import time
+import sqlite3
+import threading
+
+# Per-session generation job bookkeeping (last-write-wins coalescing).
+#
+# Every /generate bumps the session's version. Only the caller that flips the session
+# from idle to running gets should_start=True and submits a worker; the worker keeps
+# regenerating until the version it finished is still the latest one.
+#
+# LocalJobStore keeps that state in a dict (single process, `python app.py`).
+# SqliteJobStore keeps it in a small SQLite table so several gunicorn/uvicorn worker
+# processes share one view: a session bumped in process A while process B is
+# generating it is coalesced into B's run instead of starting a second one.
+
+
+class LocalJobStore:
+    def __init__(self):
+        self._states = {}  # sid -> { 'version': int, 'running': bool }
+        self._lock = threading.Lock()
+
+    def _state(self, sid):
+        st = self._states.get(sid)
+        if st is None:
+            st = {'version': 0, 'running': False}
+            self._states[sid] = st
+        return st
+
+    def bump(self, sid):
+        """Request a new generation; returns (version, should_start)."""
+        with self._lock:
+            st = self._state(sid)
+            st['version'] += 1
+            should_start = not st['running']
+            st['running'] = True
+            return st['version'], should_start
+
+    def begin(self, sid):
+        """Called by the worker before each run; returns the version to generate."""
+        with self._lock:
+            st = self._state(sid)
+            st['running'] = True
+            return st['version']
+
+    def current(self, sid):
+        with self._lock:
+            return self._state(sid)['version']
+
+    def finish(self, sid, version):
+        """Return True (and mark idle) if version is still the latest request."""
+        with self._lock:
+            st = self._state(sid)
+            if st['version'] == version:
+                st['running'] = False
+                return True
+            return False
+
+    def renew(self, sid):
+        return True
+
+    def release(self, sid):
+        with self._lock:
+            self._state(sid)['running'] = False
+
+    def running(self, sid):
+        with self._lock:
+            st = self._states.get(sid)
+            return bool(st and st['running'])
+
+
+class SqliteJobStore:
+    """Same contract as LocalJobStore, shared across processes through one SQLite file.
+
+    A running claim carries an owner (pid) and a lease; if a worker process dies mid-run
+    its claim expires after lease_seconds and the next bump starts a fresh run. A live
+    worker keeps its claim by calling renew() well within the lease.
+    """
+
+    def __init__(self, path, lease_seconds=300):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._conn() as cx:
+            cx.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " sid TEXT PRIMARY KEY,"
+                " version INTEGER NOT NULL DEFAULT 0,"
+                " owner TEXT,"
+                " lease_until REAL NOT NULL DEFAULT 0)"
+            )
+
+    def _conn(self):
+        # One connection per thread and per process (connections must not cross fork()).
+        cx = getattr(self._local, 'cx', None)
+        if cx is None or getattr(self._local, 'pid', None) != os.getpid():
+            cx = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            cx.execute("PRAGMA journal_mode=WAL")
+            cx.execute("PRAGMA synchronous=NORMAL")
+            self._local.cx = cx
+            self._local.pid = os.getpid()
+        return cx
+
+    @staticmethod
+    def _key(sid):
+        return sid or ''
+
+    @staticmethod
+    def _owner():
+        return str(os.getpid())
+
+    def bump(self, sid):
+        cx = self._conn()
+        now = time.time()
+        cx.execute("BEGIN IMMEDIATE")
+        try:
+            cx.execute("INSERT OR IGNORE INTO jobs (sid) VALUES (?)", (self._key(sid),))
+            cx.execute("UPDATE jobs SET version = version + 1 WHERE sid = ?", (self._key(sid),))
+            version, owner, lease_until = cx.execute(
+                "SELECT version, owner, lease_until FROM jobs WHERE sid = ?", (self._key(sid),)
+            ).fetchone()
+            should_start = owner is None or lease_until < now
+            if should_start:
+                cx.execute(
+                    "UPDATE jobs SET owner = ?, lease_until = ? WHERE sid = ?",
+                    (self._owner(), now + self.lease_seconds, self._key(sid)),
+                )
+            cx.execute("COMMIT")
+        except Exception:
+            cx.execute("ROLLBACK")
+            raise
+        return version, should_start
+
+    def begin(self, sid):
+        cx = self._conn()
+        cx.execute(
+            "UPDATE jobs SET owner = ?, lease_until = ? WHERE sid = ?",
+            (self._owner(), time.time() + self.lease_seconds, self._key(sid)),
+        )
+        return self.current(sid)
+
+    def current(self, sid):
+        row = self._conn().execute("SELECT version FROM jobs WHERE sid = ?", (self._key(sid),)).fetchone()
+        return row[0] if row else 0
+
+    def finish(self, sid, version):
+        """True when the worker should stop: version is still the latest (the claim is
+        cleared), or the claim was taken over by another process, whose run serves it."""
+        cx = self._conn()
+        cx.execute("BEGIN IMMEDIATE")
+        try:
+            row = cx.execute("SELECT version, owner FROM jobs WHERE sid = ?", (self._key(sid),)).fetchone()
+            if row is None or row[1] != self._owner():
+                done = True
+            elif row[0] == version:
+                cx.execute("UPDATE jobs SET owner = NULL, lease_until = 0 WHERE sid = ?", (self._key(sid),))
+                done = True
+            else:
+                done = False
+            cx.execute("COMMIT")
+        except Exception:
+            cx.execute("ROLLBACK")
+            raise
+        return done
+
+    def renew(self, sid):
+        """Extend this process's claim on sid; False if another process owns it now."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE sid = ? AND owner = ?",
+            (time.time() + self.lease_seconds, self._key(sid), self._owner()),
+        )
+        return cur.rowcount == 1
+
+    def release(self, sid):
+        self._conn().execute(
+            "UPDATE jobs SET owner = NULL, lease_until = 0 WHERE sid = ? AND owner = ?",
+            (self._key(sid), self._owner()),
+        )
+
+    def running(self, sid):
+        row = self._conn().execute(
+            "SELECT owner, lease_until FROM jobs WHERE sid = ?", (self._key(sid),)
+        ).fetchone()
+        return bool(row and row[0] is not None and row[1] >= time.time())
+
+
+def make_job_store(backend, db_path, lease_seconds=300):
+    if (backend or 'local').lower() == 'sqlite':
+        return SqliteJobStore(db_path, lease_seconds=lease_seconds)
+    return LocalJobStore()
@@ -0,0 +1,362 @@
+"""
+Load test: many concurrent simulated browser sessions against a local server.
+
+    python loadtest.py                                  # server.py on a free port, 20 sessions, 60 s
+    python loadtest.py --sessions 50 --duration 120 --think 0.5
+    python loadtest.py --url http://127.0.0.1:5000      # an already running server
+    python loadtest.py --max-error-rate 0.01 --max-p95-ms 2000   # exit 1 when worse (CI budget)
+
+Each session has its own session_id cookie and follows static/app.js. It starts with the
+first-run bootstrap (GET /, /data.json, POST /data.json, /generate polled through
+/generate/status every 0.4 s, /pattern.json, /history), then repeats user actions with
+exponential think time (--think seconds on average):
+
+  settings   POST /data.json with one control changed, then what the client does for the
+             "changed" it gets back: /recolor-all (palette), /generate {"mode": "resize"}
+             (canvas) or /generate (layout)
+  generate   the Generate button
+  edit       a tile click: /edit-regions with one reroll or recolor op (app.js sends
+             single edits through the batch route)
+  wand       /magic-wand over a random rectangle
+  recolor    the Recolor all button
+  history    /history/undo or /history/redo, then /data.json and /pattern.json
+
+Every request is timed per route. "generate (end-to-end)" is one /generate until its status
+is done. The report is one JSON line: per route count, errors (non-2xx or no response),
+status codes, requests/s and p50/p95/p99/max in ms, plus the server's /metrics.json.
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# static/app.js DEFAULT_BUTTON_COLORS
+PALETTE = ["#f2df53", "#ffc801", "#f46c21", "#e5334d", "#ef86a4", "#59357c",
+           "#5dc3db", "#3048b6", "#b2dbad", "#3e5110", "#19141b", "#ffffff"]
+ACTIONS = (('settings', 25), ('generate', 15), ('edit', 30), ('wand', 10), ('recolor', 10), ('history', 10))
+POLL_INTERVAL = 0.4   # app.js status polling
+GENERATE_TIMEOUT = 60.0
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}  # route -> {'ms': [...], 'errors', 'status': {code: n}}
+
+    def record(self, route, ms, status):
+        with self._lock:
+            r = self._routes.setdefault(route, {'ms': [], 'errors': 0, 'status': {}})
+            r['ms'].append(ms)
+            r['status'][str(status)] = r['status'].get(str(status), 0) + 1
+            if not status or status >= 400:
+                r['errors'] += 1
+
+    def report(self, elapsed):
+        def pct(values, q):
+            return round(values[max(0, math.ceil(q * len(values)) - 1)], 1)
+        out = {}
+        with self._lock:
+            for route, r in sorted(self._routes.items()):
+                ms = sorted(r['ms'])
+                out[route] = {
+                    "count": len(ms),
+                    "errors": r['errors'],
+                    "error_rate": round(r['errors'] / len(ms), 4),
+                    "rps": round(len(ms) / elapsed, 2),
+                    "p50_ms": pct(ms, 0.50),
+                    "p95_ms": pct(ms, 0.95),
+                    "p99_ms": pct(ms, 0.99),
+                    "max_ms": round(ms[-1], 1),
+                    "status": r['status'],
+                }
+        return out
+
+
+class Session:
+    """One simulated browser tab: its cookie, a keep-alive connection and what app.js keeps."""
+
+    def __init__(self, url, stats, think, deadline):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.stats = stats
+        self.think = think
+        self.deadline = deadline
+        self.cookie = f"session_id=lt-{uuid.uuid4().hex[:12]}"
+        self.conn = None
+        self.settings = {}
+        self.region_ids = []
+        self.cols = self.rows = 1
+        self.history = {}
+
+    # ----- HTTP -----
+
+    def request(self, method, path, body=None, route=None):
+        """(status, parsed JSON or None); status 0 when there was no response."""
+        route = route or f"{method} {path.split('?')[0]}"
+        headers = {'Cookie': self.cookie}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        status, payload = 0, None
+        for attempt in range(2):
+            try:
+                if self.conn is None:
+                    self.conn = http.client.HTTPConnection(self.host, self.port, timeout=GENERATE_TIMEOUT)
+                self.conn.request(method, path, body=data, headers=headers)
+                resp = self.conn.getresponse()
+                raw = resp.read()
+                status = resp.status
+                if 'json' in (resp.getheader('Content-Type') or ''):
+                    payload = json.loads(raw)
+                break
+            except (OSError, http.client.HTTPException, ValueError):
+                # a kept-alive connection the server closed: reconnect once
+                if self.conn is not None:
+                    self.conn.close()
+                self.conn = None
+                if attempt:
+                    break
+        self.stats.record(route, (time.perf_counter() - start) * 1000, status)
+        return status, payload
+
+    # ----- client flows -----
+
+    def _take_pattern(self, pattern):
+        if not isinstance(pattern, list):
+            return
+        self.region_ids = sorted({t['region_id'] for t in pattern if t.get('region_id')})
+        if pattern:
+            self.cols = max(t['grid_x'] for t in pattern)
+            self.rows = max(t['grid_y'] for t in pattern)
+
+    def draw(self):
+        _, pattern = self.request('GET', '/pattern.json')
+        self._take_pattern(pattern)
+
+    def generate(self, mode='full'):
+        start = time.perf_counter()
+        status, _ = self.request('POST', '/generate', {"mode": mode})
+        if status != 200:
+            self.stats.record('generate (end-to-end)', (time.perf_counter() - start) * 1000, status)
+            return
+        state = 'running'
+        limit = time.time() + GENERATE_TIMEOUT
+        while time.time() < limit:
+            _, js = self.request('GET', '/generate/status')
+            state = (js or {}).get('status', 'idle')
+            if state in ('done', 'error'):
+                break
+            time.sleep(POLL_INTERVAL)
+        self.stats.record('generate (end-to-end)', (time.perf_counter() - start) * 1000,
+                          200 if state == 'done' else 500)
+        if state == 'done':
+            self.draw()
+            _, self.history = self.request('GET', '/history')
+
+    def bootstrap(self, viewport=(1280, 720)):
+        self.request('GET', '/')
+        self.request('GET', '/data.json')
+        # firstRunBootstrap: an 8 m long side matching the viewport, knob at half range, 5 colors
+        vw, vh = viewport
+        long_mm = 8000
+        if vw >= vh:
+            w, h = long_mm, max(1000, round(long_mm * vh / vw))
+        else:
+            w, h = max(1000, round(long_mm * vw / vh)), long_mm
+        active = set(random.sample(range(len(PALETTE)), 5))
+        self.settings = {"canvas_width": w, "canvas_height": h, "knob_down": 10, "slider": 50, "switch": "center"}
+        for i, color in enumerate(PALETTE):
+            self.settings[f"button_{i}"] = {"state": "on" if i in active else "off", "color": color}
+        self.request('POST', '/data.json', self.settings)
+        self.generate()
+
+    def change_setting(self):
+        s = dict(self.settings)
+        kind = random.choice(('palette', 'canvas', 'layout'))
+        if kind == 'palette':
+            on = [k for k in s if k.startswith('button_') and s[k]['state'] == 'on']
+            off = [k for k in s if k.startswith('button_') and s[k]['state'] == 'off']
+            key = random.choice(off) if len(on) <= 3 or (len(on) < 6 and random.random() < 0.5) else random.choice(on)
+            s[key] = dict(s[key], state='off' if s[key]['state'] == 'on' else 'on')
+        elif kind == 'canvas':
+            s['canvas_width'] = max(1000, int(s['canvas_width'] * random.choice((0.9, 1.1))) // 10 * 10)
+        else:
+            s['knob_down'] = random.randint(1, 20)
+            s['switch'] = random.choice(('left', 'center', 'right'))
+        self.settings = s
+        _, js = self.request('POST', '/data.json', s)
+        changed = (js or {}).get('changed', 'layout')
+        if changed == 'palette':
+            self.recolor()
+        elif changed in ('resize', 'layout'):
+            time.sleep(0.4)  # auto-save debounce
+            self.generate('resize' if changed == 'resize' else 'full')
+
+    def edit(self):
+        if not self.region_ids:
+            return
+        op = {"region_id": random.choice(self.region_ids), "action": random.choice(('reroll', 'recolor'))}
+        _, js = self.request('POST', '/edit-regions', {"ops": [op]})
+        self.history = (js or {}).get('history') or self.history
+
+    def wand(self):
+        x1, x2 = sorted(random.randint(1, self.cols) for _ in range(2))
+        y1, y2 = sorted(random.randint(1, self.rows) for _ in range(2))
+        status, js = self.request('POST', '/magic-wand', {"x1": x1, "y1": y1, "x2": x2, "y2": y2})
+        if status == 200:
+            self._take_pattern(js.get('pattern'))
+            if (js.get('region') or {}).get('id') and js['region']['id'] not in self.region_ids:
+                self.region_ids.append(js['region']['id'])
+            self.history = js.get('history') or self.history
+
+    def recolor(self):
+        status, js = self.request('POST', '/recolor-all', {})
+        if status == 200:
+            self._take_pattern(js.get('pattern'))
+            self.history = js.get('history') or self.history
+
+    def move_in_history(self):
+        direction = 'redo' if self.history.get('can_redo') and random.random() < 0.5 else 'undo'
+        if direction == 'undo' and not self.history.get('can_undo'):
+            return
+        status, js = self.request('POST', f'/history/{direction}')
+        if status == 200:
+            self.history = js.get('history') or self.history
+            _, settings = self.request('GET', '/data.json')
+            self.settings = settings or self.settings
+            self.draw()
+
+    def run(self):
+        try:
+            self.bootstrap()
+            actions = {'settings': self.change_setting, 'generate': self.generate, 'edit': self.edit,
+                       'wand': self.wand, 'recolor': self.recolor, 'history': self.move_in_history}
+            names = [a for a, _ in ACTIONS]
+            weights = [w for _, w in ACTIONS]
+            while time.time() < self.deadline:
+                time.sleep(min(random.expovariate(1.0 / self.think) if self.think > 0 else 0,
+                               max(0.0, self.deadline - time.time())))
+                if time.time() >= self.deadline:
+                    break
+                actions[random.choices(names, weights)[0]]()
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def start_server(timeout=60.0):
+    """Run server.py on a free port (its own env: WEB_CONCURRENCY, GEN_* ...); returns (proc, url)."""
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, 'server.py'], cwd=BASE_DIR, env=dict(os.environ, PORT=str(port)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    start = time.time()
+    while time.time() - start < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server.py exited with {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return proc, url
+        except OSError:
+            time.sleep(0.05)
+    proc.terminate()
+    raise RuntimeError("server did not answer in time")
+
+
+def run(url, sessions, duration, think, ramp):
+    stats = Stats()
+    start = time.time()
+    deadline = start + ramp + duration
+    threads = []
+    for i in range(sessions):
+        session = Session(url, stats, think, deadline)
+        t = threading.Thread(target=session.run, name=f"session-{i}", daemon=True)
+        threads.append(t)
+        t.start()
+        time.sleep(ramp / max(1, sessions))
+    for t in threads:
+        t.join(timeout=max(0.0, deadline - time.time()) + GENERATE_TIMEOUT)
+    elapsed = time.time() - start
+    report = {"sessions": sessions, "elapsed_s": round(elapsed, 1), "routes": stats.report(elapsed)}
+    total = sum(r['count'] for r in report['routes'].values())
+    errors = sum(r['errors'] for r in report['routes'].values())
+    report["requests"] = total
+    report["rps"] = round(total / elapsed, 2)
+    report["error_rate"] = round(errors / total, 4) if total else 0.0
+    try:
+        conn = http.client.HTTPConnection(urlsplit(url).hostname, urlsplit(url).port or 80, timeout=5)
+        conn.request('GET', '/metrics.json')
+        report["server"] = json.loads(conn.getresponse().read())
+        conn.close()
+    except (OSError, ValueError):
+        report["server"] = None
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default=None, help='target server (default: start server.py on a free port)')
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds of load after the ramp-up')
+    parser.add_argument('--think', type=float, default=1.0, help='mean seconds between a session\'s actions')
+    parser.add_argument('--ramp', type=float, default=5.0, help='seconds over which sessions start')
+    parser.add_argument('--seed', type=int, default=None, help='make the sessions\' choices repeatable')
+    parser.add_argument('--max-error-rate', type=float, default=None, help='fail when the overall error rate is higher')
+    parser.add_argument('--max-p95-ms', type=float, default=None, help='fail when any route\'s p95 is higher')
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    proc = None
+    url = args.url
+    if url is None:
+        proc, url = start_server()
+    try:
+        report = run(url.rstrip('/'), max(1, args.sessions), args.duration, args.think, args.ramp)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    print(json.dumps(report))
+
+    failed = False
+    if args.max_error_rate is not None and report['error_rate'] > args.max_error_rate:
+        print(f"error rate {report['error_rate']} > {args.max_error_rate}", file=sys.stderr)
+        failed = True
+    if args.max_p95_ms is not None:
+        for route, r in report['routes'].items():
+            if r['p95_ms'] > args.max_p95_ms:
+                print(f"{route}: p95 {r['p95_ms']}ms > {args.max_p95_ms}ms", file=sys.stderr)
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Settings snapshot: the parts of a settings dict (data.json) that affect generation, parsed
+and validated once.
+
+    s = pepesettings.from_dict(settings)   # once per request / generation run
+    s = pepesettings.load(data_path)       # from a settings file, cached by its content
+
+A Settings is immutable and is what PepesMachine (canvas grid, knob, palette, shape policy)
+and the app's routes (fingerprints, recolor palette, reroll and magic wand picks) read, so
+both sides interpret a settings dict the same way.
+"""
+import os
+import sys
+import json
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+SQUARES = "aleluia_quadrados"
+TRIANGLES = "aleluia_triangulos"
+
+CANVAS_DEFAULT = 500
+CANVAS_MIN = 100
+CANVAS_MAX = 10000000
+# Canvas units per grid cell: a cell is half of CANVAS_DIVIDEND wide and high
+CANVAS_DIVIDEND = 50
+
+# Settings files load() keeps parsed (one per session data.json)
+LOAD_CACHE_MAX = int(os.environ.get('SETTINGS_CACHE_MAX', 256))
+
+
+class Settings(NamedTuple):
+    canvas_height: int
+    canvas_width: int
+    rows: int            # grid cells down (divAlt)
+    cols: int            # grid cells across (divLarg)
+    knob: int            # added to the region step (knob_down), >= 0
+    shapes: tuple        # shapes a region can get; one entry means no random pick
+    palette: tuple       # active button colors, unique, in button order (interned)
+    periodic: bool       # wallpaper mode (see PepesMachine.block_settings)
+
+    @property
+    def dims(self):
+        """(altTela, largTela, divAlt, divLarg), as PepesMachine names them."""
+        return self.canvas_height, self.canvas_width, self.rows, self.cols
+
+
+def dimensions(data):
+    """(altTela, largTela, divAlt, divLarg) of a settings dict; raises TypeError/ValueError
+    on a canvas size that is not a number."""
+    altTela = int(data.get("canvas_height", CANVAS_DEFAULT))
+    largTela = int(data.get("canvas_width", CANVAS_DEFAULT))
+    altTela = max(CANVAS_MIN, min(CANVAS_MAX, altTela))
+    largTela = max(CANVAS_MIN, min(CANVAS_MAX, largTela))
+    divLarg = int((largTela/CANVAS_DIVIDEND)/2)
+    divAlt = int((altTela/CANVAS_DIVIDEND)/2)
+    return altTela, largTela, divAlt, divLarg
+
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _palette(data):
+    # Buttons are { state: "on"|"off", color: "#hex" } or, in the legacy format, "#hex" / "off"
+    colors = {}
+    for key, value in data.items():
+        if not str(key).startswith("button_"):
+            continue
+        if isinstance(value, dict):
+            color = value.get("color") if value.get("state") == "on" else None
+        else:
+            color = value if isinstance(value, str) and value != "off" else None
+        if color:
+            colors.setdefault(sys.intern(str(color)), None)
+    return tuple(colors)
+
+
+def _shapes(data):
+    switch = data.get("switch")
+    if switch == "left":
+        return (SQUARES,)
+    if switch == "right":
+        return (TRIANGLES,)
+    if switch == "center" and _int(data.get("slider", 50), 50) <= 50:
+        return (SQUARES, TRIANGLES)
+    return (TRIANGLES, SQUARES)
+
+
+def from_dict(data):
+    """Settings of a settings dict; missing or invalid values get their defaults."""
+    data = data if isinstance(data, dict) else {}
+    try:
+        dims = dimensions(data)
+    except (TypeError, ValueError):
+        dims = dimensions({})
+    return Settings(*dims,
+                    knob=max(0, _int(data.get("knob_down", 0), 0)),
+                    shapes=_shapes(data),
+                    palette=_palette(data),
+                    periodic=bool(data.get("periodic")))
+
+
+_load_lock = threading.Lock()
+_load_cache = OrderedDict()  # path -> (sha1 of the file, Settings)
+
+
+def load(path):
+    """Settings of a settings file (defaults when it is missing or unreadable). The parsed
+    snapshot is reused while the file's content is unchanged (keyed by a hash of it, not
+    its mtime: two saves within one timestamp tick can have the same size)."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except OSError:
+        return from_dict({})
+    key = hashlib.sha1(raw).digest()
+    with _load_lock:
+        hit = _load_cache.get(path)
+        if hit is not None and hit[0] == key:
+            _load_cache.move_to_end(path)
+            return hit[1]
+    try:
+        snapshot = from_dict(json.loads(raw))
+    except ValueError:
+        snapshot = from_dict({})
+    with _load_lock:
+        _load_cache[path] = (key, snapshot)
+        _load_cache.move_to_end(path)
+        while len(_load_cache) > LOAD_CACHE_MAX:
+            _load_cache.popitem(last=False)
+    return snapshot
+
+
+def pick_shape(settings, rng=random):
+    """A region shape under settings' switch/slider policy."""
+    shapes = settings.shapes
+    return shapes[0] if len(shapes) == 1 else rng.choice(shapes)
+
+
+def pick_two_colors(settings, rng=random):
+    """Two distinct palette colors, or black/white when the palette has fewer than two."""
+    if len(settings.palette) < 2:
+        return ("black", "white")
+    a, b = rng.sample(settings.palette, 2)
+    return (a, b)
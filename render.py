@@ -0,0 +1,458 @@
+"""
+Server-side rendering of patterns: raster (PNG via zlib, JPEG when Pillow is installed)
+and vector (SVG).
+
+Geometry mirrors static/pattern-render.js (the client painter): every grid cell is a square with
+a thin white margin; "Padrao Quadrado" fills the left half of the cell and "Padrao
+Triangulos" fills two opposite corner triangles, both rotated by 0/90/180/270 degrees
+around the cell centre.
+
+Rendering works on a "world" where cell (1,1) starts at (0,0) and every cell is cell_px
+pixels wide. When cells are at least 2px, each distinct (shape, rotation, colors, size)
+cell is rasterised once into a glyph and copied row by row with slice assignment;
+smaller cells are point-sampled.
+"""
+import io
+import math
+import zlib
+import struct
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image as _PILImage
+except Exception:
+    _PILImage = None
+
+TILE_MARGIN_RATIO = 0.008  # keep in sync with static/app.js
+PYRAMID_TILE_SIZE = 256
+PYRAMID_MAX_CELL_PX = 64   # deepest zoom level shows cells at least this big
+GLYPH_CACHE_MAX = 4096
+
+KIND_NONE, KIND_SQUARE, KIND_TRIANGLES = 0, 1, 2
+WHITE = (255, 255, 255)
+
+_NAMED_COLORS = {
+    'black': (0, 0, 0), 'white': (255, 255, 255), 'red': (255, 0, 0), 'green': (0, 128, 0),
+    'blue': (0, 0, 255), 'yellow': (255, 255, 0), 'orange': (255, 165, 0), 'purple': (128, 0, 128),
+    'gray': (128, 128, 128), 'grey': (128, 128, 128), 'pink': (255, 192, 203),
+}
+_color_cache = {}
+
+
+def parse_color(c):
+    """'#rrggbb' / '#rgb' / a few CSS names -> (r, g, b); unknown values render black."""
+    rgb = _color_cache.get(c)
+    if rgb is not None:
+        return rgb
+    s = str(c or '').strip().lower()
+    rgb = _NAMED_COLORS.get(s)
+    if rgb is None:
+        try:
+            if s.startswith('#') and len(s) == 7:
+                rgb = (int(s[1:3], 16), int(s[3:5], 16), int(s[5:7], 16))
+            elif s.startswith('#') and len(s) == 4:
+                rgb = (int(s[1] * 2, 16), int(s[2] * 2, 16), int(s[3] * 2, 16))
+        except ValueError:
+            rgb = None
+    if rgb is None:
+        rgb = (0, 0, 0)
+    if len(_color_cache) < 4096:
+        _color_cache[c] = rgb
+    return rgb
+
+
+def cell_from_tile(tile):
+    kind = tile.get('tile')
+    kind = KIND_SQUARE if kind == 'Padrao Quadrado' else (KIND_TRIANGLES if kind == 'Padrao Triangulos' else KIND_NONE)
+    return (kind, int(tile.get('rotation') or 0) % 360, parse_color(tile.get('color_fundo')), parse_color(tile.get('color_padrao')))
+
+
+def build_grid(pattern):
+    """Index a pattern (list of tile dicts) as {(grid_x, grid_y): cell}, plus cols/rows like the client."""
+    cells = {}
+    cols = rows = 0
+    for t in pattern or []:
+        try:
+            gx = int(t.get('grid_x'))
+            gy = int(t.get('grid_y'))
+        except (TypeError, ValueError):
+            continue
+        cells[(gx, gy)] = cell_from_tile(t)  # later entries paint over earlier ones, as on the canvas
+        if gx > cols:
+            cols = gx
+        if gy > rows:
+            rows = gy
+    return {'cells': cells, 'cols': max(1, cols), 'rows': max(1, rows)}
+
+
+class _StoreCells:
+    """Read-only {(grid_x, grid_y): cell} view over a tilestore.TileStore (no full load)."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, key, default=None):
+        rec = self.store.record(key[0], key[1])
+        if rec is None or rec[0] == KIND_NONE:
+            return default
+        # tilestore kinds use the same numbering as KIND_*
+        kind, rot, cf, cp, _rid = rec
+        palette = self.store.palette
+        return (kind, rot * 90,
+                parse_color(palette[cf] if cf < len(palette) else None),
+                parse_color(palette[cp] if cp < len(palette) else None))
+
+
+def grid_from_store(store):
+    """Like build_grid(), but cells are read from a memory-mapped tile store on demand."""
+    return {'cells': _StoreCells(store), 'cols': max(1, store.cols), 'rows': max(1, store.rows)}
+
+
+class _PeriodicCells:
+    """{(grid_x, grid_y): cell} view that repeats a block of cells on both axes."""
+
+    def __init__(self, cells, block_cols, block_rows):
+        self.cells = cells
+        self.block_cols = block_cols
+        self.block_rows = block_rows
+
+    def get(self, key, default=None):
+        return self.cells.get(((key[0] - 1) % self.block_cols + 1, (key[1] - 1) % self.block_rows + 1), default)
+
+
+def periodic_grid(grid, cols, rows):
+    """A grid holding one repeating block (wallpaper mode), viewed as the cols x rows canvas it tiles."""
+    return {'cells': _PeriodicCells(grid['cells'], grid['cols'], grid['rows']),
+            'cols': max(1, cols), 'rows': max(1, rows)}
+
+
+def _unrotate(rot, u, v):
+    if rot == 90:
+        return v, 1.0 - u
+    if rot == 180:
+        return 1.0 - u, 1.0 - v
+    if rot == 270:
+        return 1.0 - v, u
+    return u, v
+
+
+def _in_motif(kind, rot, u, v):
+    u, v = _unrotate(rot, u, v)
+    if kind == KIND_SQUARE:
+        return u < 0.5
+    if kind == KIND_TRIANGLES:
+        return abs(u - v) >= 0.5
+    return False
+
+
+def _cell_pixel(cell, u, v):
+    """Color at tile-local (u, v) in [0, 1), including the white margin."""
+    half = TILE_MARGIN_RATIO / 2
+    if u < half or v < half or u >= 1 - half or v >= 1 - half:
+        return WHITE
+    kind, rot, cf, cp = cell
+    uu = (u - half) / (1 - TILE_MARGIN_RATIO)
+    vv = (v - half) / (1 - TILE_MARGIN_RATIO)
+    return cp if _in_motif(kind, rot, uu, vv) else cf
+
+
+_glyphs = OrderedDict()
+_glyphs_lock = threading.Lock()  # renders run on concurrent request threads
+
+
+def _glyph(cell, w, h):
+    """Rows of RGB bytes for one cell rasterised at w x h pixels (LRU cached)."""
+    key = (cell, w, h)
+    with _glyphs_lock:
+        rows = _glyphs.get(key)
+        if rows is not None:
+            _glyphs.move_to_end(key)
+            return rows
+    rows = []
+    for py in range(h):
+        v = (py + 0.5) / h
+        row = bytearray(w * 3)
+        for px in range(w):
+            r, g, b = _cell_pixel(cell, (px + 0.5) / w, v)
+            o = px * 3
+            row[o] = r
+            row[o + 1] = g
+            row[o + 2] = b
+        rows.append(bytes(row))
+    with _glyphs_lock:
+        _glyphs[key] = rows
+        _glyphs.move_to_end(key)
+        while len(_glyphs) > GLYPH_CACHE_MAX:
+            _glyphs.popitem(last=False)
+    return rows
+
+
+def render_rgb(grid, width, height, cell_px, origin_x=0.0, origin_y=0.0):
+    """Render a width x height RGB view whose top-left pixel sits at world (origin_x, origin_y)."""
+    buf = bytearray(b'\xff' * (width * height * 3))
+    cells = grid['cells']
+    cols, rows = grid['cols'], grid['rows']
+    if cell_px <= 0:
+        return buf
+    stride = width * 3
+    if cell_px >= 2:
+        gx0 = max(1, int(math.floor(origin_x / cell_px)) + 1)
+        gx1 = min(cols, int(math.floor((origin_x + width) / cell_px)) + 1)
+        gy0 = max(1, int(math.floor(origin_y / cell_px)) + 1)
+        gy1 = min(rows, int(math.floor((origin_y + height) / cell_px)) + 1)
+        xs = {gx: (int(round((gx - 1) * cell_px - origin_x)), int(round(gx * cell_px - origin_x))) for gx in range(gx0, gx1 + 1)}
+        for gy in range(gy0, gy1 + 1):
+            y0 = int(round((gy - 1) * cell_px - origin_y))
+            y1 = int(round(gy * cell_px - origin_y))
+            cy0, cy1 = max(0, y0), min(height, y1)
+            if cy1 <= cy0:
+                continue
+            for gx in range(gx0, gx1 + 1):
+                cell = cells.get((gx, gy))
+                if cell is None:
+                    continue
+                x0, x1 = xs[gx]
+                cx0, cx1 = max(0, x0), min(width, x1)
+                if cx1 <= cx0:
+                    continue
+                glyph = _glyph(cell, x1 - x0, y1 - y0)
+                a, b = (cx0 - x0) * 3, (cx1 - x0) * 3
+                for py in range(cy0, cy1):
+                    o = py * stride + cx0 * 3
+                    buf[o:o + (b - a)] = glyph[py - y0][a:b]
+        return buf
+    # Sub-2px cells: sample each pixel centre
+    for py in range(height):
+        fy = (origin_y + py + 0.5) / cell_px
+        gy = int(math.floor(fy)) + 1
+        if gy < 1 or gy > rows:
+            continue
+        v = fy - math.floor(fy)
+        o = py * stride
+        for px in range(width):
+            fx = (origin_x + px + 0.5) / cell_px
+            gx = int(math.floor(fx)) + 1
+            if gx < 1 or gx > cols:
+                continue
+            cell = cells.get((gx, gy))
+            if cell is None:
+                continue
+            r, g, b = _cell_pixel(cell, fx - math.floor(fx), v)
+            p = o + px * 3
+            buf[p] = r
+            buf[p + 1] = g
+            buf[p + 2] = b
+    return buf
+
+
+def render_full(grid, width, height):
+    """Whole pattern fitted and centred in width x height, like drawPattern on the client."""
+    cell_px = min(width / grid['cols'], height / grid['rows'])
+    offset_x = (width - cell_px * grid['cols']) / 2
+    offset_y = (height - cell_px * grid['rows']) / 2
+    return render_rgb(grid, width, height, cell_px, -offset_x, -offset_y)
+
+
+# -------- Tile pyramid (z/x/y) --------
+# Zoom 0 fits the whole grid into one PYRAMID_TILE_SIZE tile; each level doubles the scale.
+
+def pyramid_cell_px(grid, z):
+    return PYRAMID_TILE_SIZE * (2 ** z) / max(grid['cols'], grid['rows'])
+
+
+def pyramid_max_zoom(grid):
+    span = max(grid['cols'], grid['rows'])
+    return max(0, int(math.ceil(math.log2(max(1.0, PYRAMID_MAX_CELL_PX * span / PYRAMID_TILE_SIZE)))))
+
+
+def pyramid_tile_count(grid, z):
+    cell_px = pyramid_cell_px(grid, z)
+    nx = int(math.ceil(grid['cols'] * cell_px / PYRAMID_TILE_SIZE))
+    ny = int(math.ceil(grid['rows'] * cell_px / PYRAMID_TILE_SIZE))
+    return max(1, nx), max(1, ny)
+
+
+def render_pyramid_tile(grid, z, x, y):
+    size = PYRAMID_TILE_SIZE
+    return render_rgb(grid, size, size, pyramid_cell_px(grid, z), x * size, y * size)
+
+
+# -------- SVG --------
+# Vector export with one user unit per cell. Every (shape, rotation) is defined once in
+# <defs>; its background is painted with the `color` property and its motif with `fill`, so
+# a tile is a bare <use> inside a group that carries its region's two colors. A region
+# whose tiles repeat with a short period is a single rect filled with a <pattern> holding
+# one period (shared by regions with the same motif, colors and phase), so the output
+# grows with the number of regions rather than tiles.
+
+SVG_MAX_PERIOD = 8      # longest motif period in PepesMachine
+SVG_CHUNK_CHARS = 64 * 1024
+_SVG_SHAPES = {KIND_SQUARE: ('q', 'M0 0H0.5V1H0Z'), KIND_TRIANGLES: ('t', 'M0 0.5V1H0.5ZM0.5 0H1V0.5Z')}
+
+
+def _svg_num(v):
+    return f"{round(v, 4) + 0.0:.4f}".rstrip('0').rstrip('.')
+
+
+def _svg_hex(c):
+    return '#%02x%02x%02x' % parse_color(c)
+
+
+def svg_tiles(pattern):
+    """(tiles in column-major order, cols, rows) for a pattern list, one tile per cell
+    (later entries win, as on the canvas)."""
+    cells = {}
+    for t in pattern or []:
+        try:
+            cells[(int(t.get('grid_x')), int(t.get('grid_y')))] = t
+        except (TypeError, ValueError):
+            continue
+    cols = max((gx for gx, _ in cells), default=1)
+    rows = max((gy for _, gy in cells), default=1)
+    return [cells[k] for k in sorted(cells)], cols, rows
+
+
+def _svg_period(cells, x0, y0, w, h, horizontal):
+    n = w if horizontal else h
+    for p in range(1, min(n, SVG_MAX_PERIOD) + 1):
+        if p == n:
+            break
+        dx, dy = (p, 0) if horizontal else (0, p)
+        if all(cells[(x, y)] == cells[(x + dx, y + dy)]
+               for x in range(x0, x0 + w - dx) for y in range(y0, y0 + h - dy)):
+            return p
+    return n
+
+
+def _svg_region(cells, colors, patterns):
+    """Markup for one region's cells {(gx, gy): symbol id} (patterns: shared <pattern> ids)."""
+    paint = f'fill="{colors[1]}" color="{colors[0]}"'
+    x0 = min(gx for gx, _ in cells)
+    y0 = min(gy for _, gy in cells)
+    w = max(gx for gx, _ in cells) - x0 + 1
+    h = max(gy for _, gy in cells) - y0 + 1
+    if len(cells) == w * h and w * h > 1:
+        px = _svg_period(cells, x0, y0, w, h, True)
+        py = _svg_period(cells, x0, y0, w, h, False)
+        if px < w or py < h:
+            motif = tuple(cells[(x0 + i, y0 + j)] for j in range(py) for i in range(px))
+            phase = ((x0 - 1) % px, (y0 - 1) % py)
+            key = (px, py, motif, colors, phase)
+            out = ''
+            pid = patterns.get(key)
+            if pid is None:
+                pid = patterns[key] = f"p{len(patterns) + 1}"
+                uses = ''.join(f'<use xlink:href="#{motif[j * px + i]}" x="{i}" y="{j}"/>'
+                               for j in range(py) for i in range(px))
+                out = (f'<defs><pattern id="{pid}" patternUnits="userSpaceOnUse" x="{phase[0]}" y="{phase[1]}" '
+                       f'width="{px}" height="{py}"><g {paint}>{uses}</g></pattern></defs>')
+            return out + f'<rect x="{x0 - 1}" y="{y0 - 1}" width="{w}" height="{h}" fill="url(#{pid})"/>'
+    uses = ''.join(f'<use xlink:href="#{sym}" x="{gx - 1}" y="{gy - 1}"/>' for (gx, gy), sym in sorted(cells.items()))
+    return f'<g {paint}>{uses}</g>'
+
+
+def iter_svg(tiles, cols, rows, width, height, region_x2=None, periodic=None, units='mm'):
+    """Yield an SVG document in chunks for tiles given column-major (one per cell).
+
+    width x height is the canvas in `units`; the grid is fitted and centred in it like
+    drawPattern. region_x2 maps region id -> last column of the region, which lets a
+    region be written as soon as the scan passes it (regions without one are written at
+    the end). periodic ({"cols", "rows"}) repeats the cols x rows block over that canvas."""
+    canvas_cols = (periodic or {}).get('cols') or cols
+    canvas_rows = (periodic or {}).get('rows') or rows
+    cell = min(width / canvas_cols, height / canvas_rows)
+    vw, vh = width / cell, height / cell
+    vx, vy = -(vw - canvas_cols) / 2, -(vh - canvas_rows) / 2
+    half = TILE_MARGIN_RATIO / 2
+    inset = f'translate({_svg_num(half)} {_svg_num(half)}) scale({_svg_num(1 - TILE_MARGIN_RATIO)})'
+    symbols = ''.join(
+        f'<g id="{name}{rot}" transform="{inset}"><rect width="1" height="1" fill="currentColor"/>'
+        f'<path d="{path}"' + (f' transform="rotate({rot} 0.5 0.5)"' if rot else '') + '/></g>'
+        for name, path in _SVG_SHAPES.values() for rot in (0, 90, 180, 270))
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+        f'width="{_svg_num(width)}{units}" height="{_svg_num(height)}{units}" '
+        f'viewBox="{_svg_num(vx)} {_svg_num(vy)} {_svg_num(vw)} {_svg_num(vh)}">\n',
+        f'<defs>{symbols}</defs>\n',
+        f'<rect x="{_svg_num(vx)}" y="{_svg_num(vy)}" width="{_svg_num(vw)}" height="{_svg_num(vh)}" fill="#ffffff"/>\n',
+    ]
+    if periodic:
+        parts.append(f'<defs><pattern id="block" patternUnits="userSpaceOnUse" width="{cols}" height="{rows}">\n')
+    size = sum(len(p) for p in parts)
+    region_x2 = region_x2 or {}
+    patterns = {}
+    open_regions = {}  # region id -> {'colors', 'cells': {(gx, gy): symbol id}}
+    closing = {}       # column -> region ids to write once the scan is past it
+    column = 1
+
+    def flush(rids):
+        out = []
+        for rid in rids:
+            region = open_regions.pop(rid, None)
+            if region is not None:
+                out.append(_svg_region(region['cells'], region['colors'], patterns) + '\n')
+        return out
+
+    for t in tiles:
+        shape = _SVG_SHAPES.get(cell_from_tile(t)[0])
+        if shape is None:
+            continue
+        gx, gy = int(t['grid_x']), int(t['grid_y'])
+        while column < gx:
+            for chunk in flush(closing.pop(column, ())):
+                parts.append(chunk)
+                size += len(chunk)
+            column += 1
+        sym = f"{shape[0]}{int(t.get('rotation') or 0) % 360}"
+        colors = (_svg_hex(t.get('color_fundo')), _svg_hex(t.get('color_padrao')))
+        rid = t.get('region_id')
+        region = open_regions.get(rid) if rid else None
+        if rid and region is None:
+            region = open_regions[rid] = {'colors': colors, 'cells': {}}
+            closing.setdefault(max(gx, region_x2.get(rid) or cols), []).append(rid)
+        if region is not None and region['colors'] == colors:
+            region['cells'][(gx, gy)] = sym
+        else:
+            chunk = f'<use xlink:href="#{sym}" x="{gx - 1}" y="{gy - 1}" fill="{colors[1]}" color="{colors[0]}"/>\n'
+            parts.append(chunk)
+            size += len(chunk)
+        if size >= SVG_CHUNK_CHARS:
+            yield ''.join(parts)
+            parts, size = [], 0
+    parts.extend(flush(list(open_regions)))
+    if periodic:
+        parts.append(f'</pattern></defs>\n<rect width="{canvas_cols}" height="{canvas_rows}" fill="url(#block)"/>\n')
+    parts.append('</svg>\n')
+    yield ''.join(parts)
+
+
+# -------- Encoders --------
+
+def encode_png(rgb, width, height, level=6):
+    stride = width * 3
+    raw = bytearray()
+    for y in range(height):
+        raw.append(0)  # filter: none
+        raw += rgb[y * stride:(y + 1) * stride]
+
+    def _chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + _chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + _chunk(b'IDAT', zlib.compress(bytes(raw), level))
+            + _chunk(b'IEND', b''))
+
+
+def jpeg_available():
+    return _PILImage is not None
+
+
+def encode_jpeg(rgb, width, height, quality=92):
+    if _PILImage is None:
+        raise RuntimeError("JPEG output needs Pillow")
+    out = io.BytesIO()
+    _PILImage.frombytes('RGB', (width, height), bytes(rgb)).save(out, 'JPEG', quality=quality)
+    return out.getvalue()
@@ -0,0 +1,173 @@
+import time
+import threading
+
+# Cost-aware scheduling of generation jobs across sessions.
+#
+# Jobs carry a key (the session id) and an up-front cost estimate
+# (PepesMachine.estimate_generation_cost). Instead of FIFO, an idle worker picks the
+# pending job with the highest response ratio (waited + cost) / cost ("HRRN"): small
+# jobs jump ahead of a huge canvas, but every job's ratio grows while it waits, so
+# large jobs are never starved. At most per_key_limit jobs of one key run at once.
+#
+# Background jobs (speculative work) only start when no foreground job is runnable, and
+# are left out of queue positions; they poll foreground_waiting() to give way once started.
+#
+# Costs are in abstract units (tiles); seconds_per_unit is learned from finished jobs
+# so queue positions can be reported with an ETA. State is per process: with several
+# server workers each process schedules the jobs it received.
+
+
+class FairScheduler:
+    def __init__(self, workers=1, per_key_limit=1, name='gen'):
+        self.workers = max(1, int(workers))
+        self.per_key_limit = max(1, int(per_key_limit))
+        self.name = name
+        self.seconds_per_unit = 2e-6  # initial guess, refined by observe()
+        self._observed_cost = 0.0
+        self._observed_seconds = 0.0
+        self._cv = threading.Condition()
+        self._pending = []  # [{'key','cost','fn','args','info','background','enqueued_at','seq'}]
+        self._running = {}  # seq -> job (plus 'started_at')
+        self._seq = 0
+        self._threads = []
+        self._shutdown = False
+
+    # ----- submission -----
+
+    def submit(self, key, cost, fn, *args, info=None, background=False):
+        """Queue fn(*args); info is an optional dict echoed back by position()."""
+        with self._cv:
+            self._seq += 1
+            self._pending.append({
+                'key': key,
+                'cost': max(1.0, float(cost or 0)),
+                'fn': fn,
+                'args': args,
+                'info': info,
+                'background': bool(background),
+                'enqueued_at': time.monotonic(),
+                'seq': self._seq,
+            })
+            self._ensure_threads()
+            self._cv.notify()
+            return self._seq
+
+    def reprice(self, key, cost, info=None, running=False):
+        """Update the estimate of key's queued jobs (settings changed before they started),
+        or with running=True of its running job (only affects ETAs)."""
+        with self._cv:
+            jobs = self._running.values() if running else self._pending
+            for job in jobs:
+                if job['key'] == key:
+                    job['cost'] = max(1.0, float(cost or 0))
+                    if info is not None:
+                        job['info'] = info
+
+    def observe(self, cost, elapsed_seconds):
+        """Feed back a measured run so ETAs track this machine's speed."""
+        if not cost or elapsed_seconds <= 0:
+            return
+        with self._cv:
+            # Decayed sums rather than an average of ratios, so big runs dominate the rate
+            self._observed_cost = 0.8 * self._observed_cost + float(cost)
+            self._observed_seconds = 0.8 * self._observed_seconds + elapsed_seconds
+            self.seconds_per_unit = self._observed_seconds / self._observed_cost
+
+    # ----- introspection -----
+
+    def position(self, key):
+        """Where key stands: None if unknown, else {'state', 'queue_position', 'eta_seconds', 'info'}.
+
+        queue_position is 0 while running, else the job's 1-based place in the current
+        ordering (1 = starts next).
+        """
+        with self._cv:
+            now = time.monotonic()
+            running_left = sum(
+                max(0.0, j['cost'] * self.seconds_per_unit - (now - j['started_at']))
+                for j in self._running.values()
+            )
+            for job in self._running.values():
+                if job['key'] == key and not job['background']:
+                    left = max(0.0, job['cost'] * self.seconds_per_unit - (now - job['started_at']))
+                    return {'state': 'running', 'queue_position': 0, 'eta_seconds': round(left, 2), 'info': job['info']}
+            order = self._ordered(now)
+            ahead_cost = 0.0
+            order = [j for j in order if not j['background']]
+            for i, job in enumerate(order):
+                if job['key'] == key:
+                    wait = (running_left + ahead_cost * self.seconds_per_unit) / self.workers
+                    eta = wait + job['cost'] * self.seconds_per_unit
+                    return {'state': 'queued', 'queue_position': i + 1, 'eta_seconds': round(eta, 2), 'info': job['info']}
+                ahead_cost += job['cost']
+            return None
+
+    def foreground_waiting(self):
+        """Number of queued foreground jobs (a running background job should give way)."""
+        with self._cv:
+            return sum(1 for j in self._pending if not j['background'])
+
+    def stats(self):
+        with self._cv:
+            return {
+                'workers': self.workers,
+                'pending': len(self._pending),
+                'running': len(self._running),
+                'background': sum(1 for j in list(self._pending) + list(self._running.values()) if j['background']),
+                'seconds_per_unit': self.seconds_per_unit,
+            }
+
+    # ----- workers -----
+
+    def _ratio(self, job, now):
+        waited = (now - job['enqueued_at']) / self.seconds_per_unit
+        return (waited + job['cost']) / job['cost']
+
+    def _ordered(self, now):
+        return sorted(self._pending, key=lambda j: (j['background'], -self._ratio(j, now), j['seq']))
+
+    def _runnable(self, job):
+        busy = sum(1 for j in self._running.values() if j['key'] == job['key'])
+        return busy < self.per_key_limit
+
+    def _take(self):
+        # caller holds self._cv
+        now = time.monotonic()
+        for job in self._ordered(now):
+            if self._runnable(job):
+                self._pending.remove(job)
+                job['started_at'] = now
+                self._running[job['seq']] = job
+                return job
+        return None
+
+    def _ensure_threads(self):
+        # caller holds self._cv; threads start lazily so importing the app spawns nothing
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._loop, name=f"{self.name}-{len(self._threads)}", daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                job = self._take()
+                while job is None:
+                    if self._shutdown:
+                        return
+                    self._cv.wait()
+                    job = self._take()
+            try:
+                job['fn'](*job['args'])
+            except Exception as e:
+                print(f"{self.name} job failed:", e)
+            finally:
+                with self._cv:
+                    self._running.pop(job['seq'], None)
+                    # a per-key slot freed up: another worker may now take that key's next job
+                    self._cv.notify_all()
+
+    def shutdown(self):
+        with self._cv:
+            self._shutdown = True
+            self._cv.notify_all()
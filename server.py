@@ -0,0 +1,81 @@
+"""
+Production entry point (render.yaml runs `python server.py`).
+
+Runs the Flask app under gunicorn with several worker processes. Generation jobs are
+coordinated through the SQLite job store (JOB_BACKEND=sqlite) so /generate requests for
+the same session coalesce even when they land on different workers, while different
+sessions generate in parallel, one per worker process.
+
+Env vars:
+  PORT              listen port (default 5000)
+  WEB_CONCURRENCY   worker processes (default: CPU count)
+  WEB_THREADS       threads per worker for I/O-bound requests such as status polling (default 4)
+  WEB_TIMEOUT       worker timeout in seconds (default 120)
+  JOB_BACKEND       forced to 'sqlite' when more than one worker runs
+  SERVER_MODE       'wsgi' (default, gunicorn + Flask) or 'asgi' (uvicorn + asgi.py)
+
+Falls back to the threaded Flask server when gunicorn is not installed.
+"""
+import gc
+import os
+import sys
+
+
+def _int_env(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def main():
+    port = _int_env('PORT', 5000)
+    workers = max(1, _int_env('WEB_CONCURRENCY', os.cpu_count() or 1))
+    threads = max(1, _int_env('WEB_THREADS', 4))
+    timeout = _int_env('WEB_TIMEOUT', 120)
+    if workers > 1:
+        # In-process job state would not be shared between workers
+        os.environ['JOB_BACKEND'] = 'sqlite'
+
+    if os.environ.get('SERVER_MODE', 'wsgi').lower() == 'asgi':
+        import uvicorn
+        uvicorn.run('asgi:app', host='0.0.0.0', port=port, workers=workers)
+        return
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except Exception:
+        BaseApplication = None
+
+    if BaseApplication is None:
+        print("gunicorn not available; falling back to the threaded Flask server", file=sys.stderr)
+        from app import app
+        app.run(host='0.0.0.0', port=port, threaded=True)
+        return
+
+    class _GunicornApp(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"0.0.0.0:{port}")
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('timeout', timeout)
+            # Import the app inside each worker: executors and DB connections are per process
+            self.cfg.set('preload_app', False)
+
+        def load(self):
+            from app import app
+            return app
+
+    # PepesMachine has no import side effects: load it once in the master so every worker
+    # forks with its code and motif tables already in memory (shared copy-on-write)
+    try:
+        import PepesMachine
+    except Exception:
+        pass
+    gc.freeze()
+    _GunicornApp().run()
+
+
+if __name__ == '__main__':
+    main()
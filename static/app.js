@@ -41,12 +41,13 @@ function computeZoomMaxForDims(widthMm, heightMm) {
 
 // Helper to POST JSON
 async function postJSON(url, data) {
-  await fetch(url, {
+  const resp = await fetch(url, {
     method: 'POST',
     headers: {'Content-Type': 'application/json'},
     body: JSON.stringify(data),
     credentials: 'same-origin'
   });
+  try { return await resp.json(); } catch (e) { return null; }
 }
 
 // Dynamically create button color/off inputs
@@ -143,6 +144,12 @@ async function fillForm() {
   // Show sizes in cm for the UI (stored internally in mm). Default to 50 cm if missing.
   document.getElementById('canvas_width').value = (data.canvas_width ? Math.round(data.canvas_width / 10) : 50);
   document.getElementById('canvas_height').value = (data.canvas_height ? Math.round(data.canvas_height / 10) : 50);
+  const periodicEl = document.getElementById('periodic');
+  if (periodicEl) {
+    periodicEl.checked = !!data.periodic;
+    document.getElementById('period_width').value = (data.period_width ? Math.round(data.period_width / 10) : 100);
+    document.getElementById('period_height').value = (data.period_height ? Math.round(data.period_height / 10) : 100);
+  }
 
   // Normalize button fields into objects { state, color } so colors are never lost.
   let normalized = false;
@@ -200,8 +207,20 @@ if (knobInitEl) {
     };
   }
 
+  // Wallpaper mode: the pattern is one repeat block (period, cm in the UI, mm stored) tiled over the canvas
+  function applyPeriodicFormFields(data) {
+    const periodicEl = document.getElementById('periodic');
+    if (!periodicEl) return data;
+    data.periodic = !!periodicEl.checked;
+    if (data.periodic) {
+      data.period_width = (parseInt(document.getElementById('period_width').value) || 100) * 10;
+      data.period_height = (parseInt(document.getElementById('period_height').value) || 100) * 10;
+    }
+    return data;
+  }
+
   async function saveSettings(data) {
-    await postJSON('/data.json', data);
+    return await postJSON('/data.json', data);
   }
 
   // Build settings object from the form
@@ -219,6 +238,7 @@ if (knobInitEl) {
   // Convert from cm (UI) to mm (stored/used)
   data.canvas_width = parseInt(document.getElementById('canvas_width').value) * 10;
   data.canvas_height = parseInt(document.getElementById('canvas_height').value) * 10;
+  applyPeriodicFormFields(data);
       // Persist all visible buttons from DOM
     for (let i = 0; i < VISIBLE_PALETTE_COUNT; i++) {
       const btnKey = `button_${i}`;
@@ -233,21 +253,17 @@ if (knobInitEl) {
   // Save settings then recolor all instead of generating (only for palette changes)
   async function autoSaveAndRecolorImmediate() {
     const data = buildSettingsFromForm();
-    await saveSettings(data);
-    try {
-      await recolorAllAndSaveHistory();
-    } catch (e) {
-      const msg = (e && e.message) ? e.message : String(e || '');
-      if (msg.includes('No regions available to recolor')) {
-        // If there are no regions yet, do a one-time generate to create layout
-        showToast('No regions yet. Generating a base pattern…', 'info');
-        await generateAndSaveHistory();
-      } else {
-        // Other errors: surface and do not auto-generate
-        showToast(msg || 'Recolor failed.', 'error');
-        return;
-      }
+    const saved = await saveSettings(data);
+    // The server says what the save changed: nothing, only colors, or the layout too
+    const changed = (saved && saved.changed) || 'palette';
+    if (changed === 'none') return;
+    if (changed === 'layout' || changed === 'resize') {
+      requestGenerateMode(changed);
+      if (isGenerationInProgress) needsGenerateAfterCurrent = true;
+      else await generateAndSaveHistory();
+      return;
     }
+    await recolorOrGenerate();
   }
 
   // Note: autoSaveAndGenerate is defined later with debounce to avoid rapid re-generations during input changes.
@@ -291,52 +307,25 @@ function attachAutoSave() {
   });
 }
 
-// Drawing logic (optimized with Path2D cache and viewport-aware backing size)
-function resolveColor(c) {
-  if (!c) return "#000";
-  return c;
-}
-// Prebuilt normalized paths in [0,1]x[0,1] space
-const PATH_CACHE = (function(){
-  const tri = new Path2D();
-  // First triangle: (0, 0.5) -> (0, 1) -> (0.5, 1) -> back to (0, 0.5)
-  tri.moveTo(0, 0.5);
-  tri.lineTo(0, 1);
-  tri.lineTo(0.5, 1);
-  tri.closePath();
-  
-  // Second triangle: (0.5, 0) -> (1, 0) -> (1, 0.5) -> back to (0.5, 0)
-  tri.moveTo(0.5, 0);
-  tri.lineTo(1, 0);
-  tri.lineTo(1, 0.5);
-  tri.closePath();
-  
-  const half = new Path2D();
-  half.rect(0,0,0.5,1);
-  return { triangle: tri, halfRect: half };
-})();
-
-function drawTile(ctx, tile, x, y, size) {
-  // Background (fast fill)
-  ctx.fillStyle = resolveColor(tile.color_fundo);
-  ctx.fillRect(x, y, size, size);
-
-  // Foreground using cached Path2D with transform
-  ctx.save();
-  // translate to center, apply rotation, then scale normalized path to size
-  ctx.translate(x + size/2, y + size/2);
-  const ang = (tile.rotation || 0) * Math.PI / 180;
-  if (ang) ctx.rotate(ang);
-  ctx.translate(-size/2, -size/2);
-  ctx.scale(size, size); // scale from unit space
-  ctx.fillStyle = resolveColor(tile.color_padrao);
-  if (tile.tile === "Padrao Quadrado") {
-    ctx.fill(PATH_CACHE.halfRect);
-  } else if (tile.tile === "Padrao Triangulos") {
-    ctx.fill(PATH_CACHE.triangle);
+// Drawing logic: static/pattern-render.js paints the pattern canvas from glyphs drawn once
+// per (shape, rotation, colors) and tile size. Where the browser can hand the canvas to a
+// Web Worker (OffscreenCanvas) painting runs there, so big patterns do not freeze the page;
+// otherwise the same painter runs on this thread.
+const patternPainter = (function(){
+  const canvas = document.getElementById('patternCanvas');
+  if (canvas.transferControlToOffscreen && typeof Worker !== 'undefined') {
+    try {
+      const worker = new Worker('/static/pattern-render.js');
+      const offscreen = canvas.transferControlToOffscreen();
+      worker.postMessage({ type: 'init', canvas: offscreen }, [offscreen]);
+      worker.onerror = (e) => console.warn('pattern render worker failed', e);
+      return { paint: (op) => worker.postMessage(op, PatternPainter.transferables(op)) };
+    } catch (e) {
+      console.warn('render worker unavailable, painting on the page', e);
+    }
   }
-  ctx.restore();
-}
+  return PatternPainter.create(canvas);
+})();
 
 const TILE_MARGIN_RATIO = 0.008; // 8% of tile size as margin
 
@@ -425,69 +414,62 @@ function computeBackingSize(intrinsicW, intrinsicH) {
   return { width: limited.width, height: limited.height, drawScaleX: limited.width / intrinsicW, drawScaleY: limited.height / intrinsicH };
 }
 
-let currentPattern = [];
-async function drawPattern() {
-  const pattern = await loadJSON('pattern.json');
-  currentPattern = Array.isArray(pattern) ? pattern : [];
-  const data = await loadJSON('data.json');
-  const canvas = document.getElementById('patternCanvas');
-  const width = data.canvas_width || 500;
-  const height = data.canvas_height || 500;
-
-  // Compute backing size according to visible viewport (avoid rendering invisible pixels)
-  const backing = computeBackingSize(width, height);
-  canvas.width = backing.width;
-  canvas.height = backing.height;
-  applyCanvasDisplaySize(canvas, width, height);
-
+// Grid a pattern is drawn on. A wallpaper-mode pattern (data.periodic) holds one block of
+// blockCols x blockRows cells that repeats over the canvas' cols x rows (100 mm cells, as
+// in PepesMachine._dimensions_from_settings).
+function patternGridDims(pattern, data) {
   let maxX = 0, maxY = 0;
-  pattern.forEach(tile => {
+  (pattern || []).forEach(tile => {
     if (tile.grid_x > maxX) maxX = tile.grid_x;
     if (tile.grid_y > maxY) maxY = tile.grid_y;
   });
-  // When backing buffer was downscaled, we must scale drawing coordinates to match.
-const drawScaleX = backing.drawScaleX;
-const drawScaleY = backing.drawScaleY;
-  const cols = Math.max(1, maxX);
-  const rows = Math.max(1, maxY);
-  const tileSize = Math.min(width / cols, height / rows);
-  const margin = tileSize * TILE_MARGIN_RATIO;
-  const drawSize = tileSize - margin;
-  const offsetX = (width - tileSize * cols) / 2;
-  const offsetY = (height - tileSize * rows) / 2;
-
-const ctx = canvas.getContext('2d');
-// Clear the full backing buffer (use adjusted size)
-ctx.clearRect(0, 0, canvas.width, canvas.height);
-
-  // Fill background with white for margins
-  ctx.fillStyle = "#fff";
-ctx.fillRect(0, 0, canvas.width, canvas.height);
-
-  pattern.forEach(tile => {
-    // map display coordinates into backing-buffer coordinates if downscaled
-    const x_disp = offsetX + (tile.grid_x - 1) * tileSize + margin / 2;
-    const y_disp = offsetY + (tile.grid_y - 1) * tileSize + margin / 2;
-    const x = x_disp * drawScaleX;
-    const y = y_disp * drawScaleY;
-    const size = drawSize * Math.min(drawScaleX, drawScaleY);
-    drawTile(ctx, tile, x, y, size);
-  });
-  // After drawing, ensure the canvas CSS is sized to fit the patternArea
-  recomputeCanvasSize();
-  // Once layout is synced, enable floating bar interactivity
-  const areaReady1 = document.getElementById('patternArea');
-  if (areaReady1) areaReady1.classList.add('pattern-ui-ready');
+  const blockCols = Math.max(1, maxX);
+  const blockRows = Math.max(1, maxY);
+  if (!data || !data.periodic) return { cols: blockCols, rows: blockRows, blockCols, blockRows, periodic: false };
+  const cells = (mm) => Math.floor(Math.max(100, Math.min(10000000, parseInt(mm, 10) || 500)) / 100);
+  return {
+    cols: Math.max(blockCols, cells(data.canvas_width)),
+    rows: Math.max(blockRows, cells(data.canvas_height)),
+    blockCols, blockRows, periodic: true
+  };
+}
+
+// Where cell (gx, gy) is painted: offset + (gx - 1) * tileSize in layout units (the
+// canvas' intrinsic size), scaled by scaleX/scaleY into backing pixels.
+function patternLayout(dims, width, height, backing) {
+  const tileSize = Math.min(width / dims.cols, height / dims.rows);
+  return {
+    dims, tileSize,
+    offsetX: (width - tileSize * dims.cols) / 2,
+    offsetY: (height - tileSize * dims.rows) / 2,
+    scaleX: backing.drawScaleX,
+    scaleY: backing.drawScaleY,
+    marginRatio: TILE_MARGIN_RATIO
+  };
+}
+
+let currentPattern = [];
+// Settings currentPattern was drawn with (wallpaper mode changes how it is laid out)
+let currentPatternData = null;
+async function drawPattern() {
+  const pattern = await loadJSON('pattern.json');
+  await showPattern(pattern, await loadJSON('data.json'));
 }
 
-// Pattern history management
-let patternHistory = [];
-let historyIndex = -1;
+// Undo/redo lives on the server as a per-session op log (see /history); the client only
+// tracks where it is so the back/forward buttons can be enabled.
+let historyStatus = { position: -1, length: 0, can_undo: false, can_redo: false };
 let debounceTimer = null;
 // Flag to indicate a generation is in progress (server processing + waiting for pattern.json)
 let isGenerationInProgress = false;
 // If a generation request arrives while another is in progress, queue one follow-up run
 let needsGenerateAfterCurrent = false;
+// How the next generation runs: 'resize' keeps the layout and only fills the size change.
+// Any full request before it starts wins (null = nothing pending, i.e. full).
+let nextGenerateMode = null;
+function requestGenerateMode(mode) {
+  nextGenerateMode = (mode === 'resize' && nextGenerateMode !== 'full') ? 'resize' : 'full';
+}
 
 // Small helper to reflect generation state in the UI
 function updateGenIndicator() {
@@ -506,194 +488,167 @@ function patternsAreEqual(a, b) {
   return JSON.stringify(a) === JSON.stringify(b);
 }
 
-function loadHistory() {
-  const hist = localStorage.getItem('patternHistory');
-  if (hist) {
-    patternHistory = JSON.parse(hist);
-    // support legacy entries that were only arrays
-    patternHistory = patternHistory.map(e => {
-      if (Array.isArray(e)) return { pattern: e, data: null };
-      return e;
-    });
-    historyIndex = parseInt(localStorage.getItem('historyIndex')) || (patternHistory.length - 1);
+async function loadHistory() {
+  try {
+    setHistoryStatus(await loadJSON('/history'));
+  } catch (e) {
+    console.warn('loadHistory failed', e);
   }
-  updateHistoryButtons();
 }
 
-function saveHistory() {
-  const MIN_HISTORY = 15;  // user-requested minimum steps if space allows
-  const MAX_HISTORY = 100; // hard cap to keep storage sane
-
-  // Ensure we don't exceed MAX_HISTORY entries in memory
-  if (patternHistory.length > MAX_HISTORY) {
-    patternHistory = patternHistory.slice(patternHistory.length - MAX_HISTORY);
-    historyIndex = Math.max(0, Math.min(historyIndex, patternHistory.length - 1));
-  }
+// The pattern on screen is the server's current step: remember it under that step's id
+function setHistoryStatus(status) {
+  if (status) historyStatus = status;
+  updateHistoryButtons();
+  if (status && status.id && currentPattern.length) historyCache.put(status.id, currentPattern);
+}
 
-  // Before saving, opportunistically convert any legacy full patterns into compressed form
-  for (let i = 0; i < patternHistory.length; i++) {
-    const e = patternHistory[i];
-    if (e && e.pattern && !e.p) {
-      // compress and drop the full pattern to save space
-      patternHistory[i] = { p: compressPatternRows(e.pattern), d: e.data || null, v: 1 };
+// Patterns of history steps already shown, kept in IndexedDB as typed arrays (see
+// PatternPainter.packTiles) under the step's op log id. Undo/redo to a cached step skips
+// downloading and parsing pattern.json; the server's log stays the source of truth, and a
+// miss (or no IndexedDB) just fetches the pattern. Everything here is asynchronous.
+const HISTORY_CACHE_MAX = 60;
+const historyCache = (function(){
+  let dbPromise = null;
+  let lastPut = null;
+
+  function open() {
+    if (!dbPromise) {
+      dbPromise = new Promise((resolve) => {
+        if (typeof indexedDB === 'undefined') return resolve(null);
+        const req = indexedDB.open('pepe-history', 1);
+        req.onupgradeneeded = () => {
+          req.result.createObjectStore('patterns', { keyPath: 'id' }).createIndex('saved', 'saved');
+        };
+        req.onsuccess = () => resolve(req.result);
+        req.onerror = () => resolve(null);
+      });
     }
+    return dbPromise;
   }
 
-  // helper to identify quota errors across browsers
-  function isQuotaExceeded(err) {
-    if (!err) return false;
-    return err.name === 'QuotaExceededError' || err.name === 'NS_ERROR_DOM_QUOTA_REACHED' ||
-           err.code === 22 || err.code === 1014;
+  async function put(id, pattern) {
+    if (id === lastPut) return;
+    lastPut = id;
+    const db = await open();
+    if (!db) return;
+    const packed = PatternPainter.packTiles(pattern);
+    const regions = new Int32Array(pattern.length);
+    pattern.forEach((t, i) => { regions[i] = t.region_id || 0; });
+    const store = db.transaction('patterns', 'readwrite').objectStore('patterns');
+    store.put(Object.assign({ id, saved: Date.now(), regions }, packed));
+    // Keep the newest HISTORY_CACHE_MAX steps
+    const countReq = store.count();
+    countReq.onsuccess = () => {
+      let extra = countReq.result - HISTORY_CACHE_MAX;
+      if (extra <= 0) return;
+      const cursorReq = store.index('saved').openCursor();
+      cursorReq.onsuccess = () => {
+        const cursor = cursorReq.result;
+        if (cursor && extra-- > 0) { cursor.delete(); cursor.continue(); }
+      };
+    };
   }
 
-  // Try to persist; on quota error evict oldest entries until it fits.
-  try {
-    localStorage.setItem('patternHistory', JSON.stringify(patternHistory));
-  } catch (e) {
-    if (isQuotaExceeded(e)) {
-      // First pass: ensure all entries are compressed
-      let changed = false;
-      for (let i = 0; i < patternHistory.length; i++) {
-        const ent = patternHistory[i];
-        if (ent && ent.pattern && !ent.p) {
-          patternHistory[i] = { p: compressPatternRows(ent.pattern), d: ent.data || null, v: 1 };
-          changed = true;
-        }
-      }
-      if (changed) {
-        try {
-          localStorage.setItem('patternHistory', JSON.stringify(patternHistory));
-        } catch (err2) {
-          // proceed to eviction if still too big
-        }
-      }
-
-      // Evict oldest until we fit, but aim to preserve at least MIN_HISTORY
-      while (patternHistory.length > MIN_HISTORY) {
-        patternHistory.shift(); // evict oldest
-        try {
-          localStorage.setItem('patternHistory', JSON.stringify(patternHistory));
-          break; // saved successfully
-        } catch (err) {
-          if (!isQuotaExceeded(err)) {
-            // unknown error, rethrow
-            throw err;
-          }
-          // still quota exceeded -> continue evicting
-        }
-      }
-      // If we still can't save, keep trimming even below MIN_HISTORY if necessary
-      while (patternHistory.length > 1) {
-        try {
-          localStorage.setItem('patternHistory', JSON.stringify(patternHistory));
-          break;
-        } catch (err) {
-          patternHistory.shift();
-        }
-      }
-      // If still can't save (single huge entry), fall back to empty history persist while keeping in-memory
-      if (patternHistory.length <= 1) {
-        try {
-          // As a last resort, persist an empty history, but do not change the in-memory
-          // historyIndex here so the current view remains stable.
-          localStorage.setItem('patternHistory', JSON.stringify([]));
-        } catch (err) {
-          // give up silently; nothing more we can do in localStorage
-          console.warn('saveHistory: unable to persist even minimal history', err);
-        }
-      }
-    } else {
-      // not a quota problem -> rethrow so it surfaces
-      throw e;
+  // { pattern: tile dicts, packed: typed arrays for the painter } or null
+  async function get(id) {
+    const db = await open();
+    if (!db) return null;
+    const rec = await new Promise((resolve) => {
+      const req = db.transaction('patterns').objectStore('patterns').get(id);
+      req.onsuccess = () => resolve(req.result || null);
+      req.onerror = () => resolve(null);
+    });
+    if (!rec) return null;
+    const pattern = new Array(rec.xs.length);
+    for (let i = 0; i < pattern.length; i++) {
+      const g = rec.table[rec.glyphs[i]];
+      pattern[i] = {
+        tile: g[0], rotation: g[1], color_fundo: g[2], color_padrao: g[3],
+        region_id: rec.regions[i] || null, grid_x: rec.xs[i], grid_y: rec.ys[i]
+      };
     }
+    lastPut = id;
+    return { pattern, packed: { xs: rec.xs, ys: rec.ys, glyphs: rec.glyphs, table: rec.table } };
   }
 
-  // Try to persist historyIndex (best-effort)
-  try {
-    localStorage.setItem('historyIndex', historyIndex);
-  } catch (e) {
-    // ignore failures here (historyIndex is small)
-    console.warn('saveHistory: failed to save historyIndex', e);
-  }
-
-  updateHistoryButtons();
-}
+  return { get, put };
+})();
 
 function updateHistoryButtons() {
-  document.getElementById('backBtn').disabled = historyIndex <= 0;
-  document.getElementById('forwardBtn').disabled = historyIndex >= patternHistory.length - 1;
+  document.getElementById('backBtn').disabled = !historyStatus.can_undo;
+  document.getElementById('forwardBtn').disabled = !historyStatus.can_redo;
 }
 
 async function fetchCurrentPattern() {
   return await loadJSON('pattern.json');
 }
 
-async function drawPatternFromHistory(idx) {
-  if (patternHistory[idx]) {
-    const entry = patternHistory[idx];
-    // Decompress if stored compactly
-    let pattern;
-    if (entry.p && Array.isArray(entry.p)) {
-      pattern = decompressPatternRows(entry.p);
-    } else {
-      pattern = entry.pattern || entry; // support legacy
-    }
-    currentPattern = Array.isArray(pattern) ? pattern : [];
-    // prefer saved data that matches this pattern; fallback to current data.json
-    let data = entry.data;
-    if (!data) {
-      data = await loadJSON('data.json');
-    }
-    const canvas = document.getElementById('patternCanvas');
-    const width = data.canvas_width || 500;
-    const height = data.canvas_height || 500;
-
-    const backing = computeBackingSize(width, height);
-    canvas.width = backing.width;
-    canvas.height = backing.height;
-    applyCanvasDisplaySize(canvas, width, height);
-
-    const drawScaleX = backing.drawScaleX;
-    const drawScaleY = backing.drawScaleY;
-    let maxX = 0, maxY = 0;
-     pattern.forEach(tile => {
-       if (tile.grid_x > maxX) maxX = tile.grid_x;
-       if (tile.grid_y > maxY) maxY = tile.grid_y;
-     });
-     const cols = Math.max(1, maxX);
-     const rows = Math.max(1, maxY);
-     const tileSize = Math.min(width / cols, height / rows);
-     const margin = tileSize * TILE_MARGIN_RATIO;
-     const drawSize = tileSize - margin;
-     const offsetX = (width - tileSize * cols) / 2;
-     const offsetY = (height - tileSize * rows) / 2;
- 
-     const ctx = canvas.getContext('2d');
-
-     ctx.clearRect(0, 0, canvas.width, canvas.height);
- 
-     // Fill background with white for margins
-     ctx.fillStyle = "#fff";
-     ctx.fillRect(0, 0, canvas.width, canvas.height);
- 
-     pattern.forEach(tile => {
-       const x_disp = offsetX + (tile.grid_x - 1) * tileSize + margin / 2;
-       const y_disp = offsetY + (tile.grid_y - 1) * tileSize + margin / 2;
-       const x = x_disp * drawScaleX;
-       const y = y_disp * drawScaleY;
-       const size = drawSize * Math.min(drawScaleX, drawScaleY);
-       drawTile(ctx, tile, x, y, size);
-     });
-   }
-   updateHistoryButtons();
-  // ensure canvas CSS fits the patternArea after drawing history
+// Draw a pattern the server just returned, with the settings that produced it
+// (packed: the same tiles already as PatternPainter.packTiles output)
+async function showPattern(pattern, data, packed) {
+  currentPattern = Array.isArray(pattern) ? pattern : [];
+  if (!data) {
+    data = await loadJSON('data.json');
+  }
+  currentPatternData = data;
+  const canvas = document.getElementById('patternCanvas');
+  const width = data.canvas_width || 500;
+  const height = data.canvas_height || 500;
+
+  // Backing size follows the visible viewport (avoid rendering invisible pixels)
+  const backing = computeBackingSize(width, height);
+  applyCanvasDisplaySize(canvas, width, height);
+  const layout = patternLayout(patternGridDims(currentPattern, data), width, height, backing);
+  patternPainter.paint({
+    type: 'pattern', width: backing.width, height: backing.height, layout,
+    tiles: packed || PatternPainter.packTiles(currentPattern)
+  });
+  // ensure canvas CSS fits the patternArea after drawing
   recomputeCanvasSize();
-  // Enable floating bars once positioned for history draws too
+  // Enable floating bars once positioned
   const areaReady2 = document.getElementById('patternArea');
   if (areaReady2) areaReady2.classList.add('pattern-ui-ready');
- }
- 
- // On new generation, always append to end of history (never erase forward)
+}
+
+// Progressive preview of the run in progress (see /generate/preview): its layout is drawn as
+// flat color blocks, then filled tiles are painted over them as they arrive, one page per poll.
+// Wallpaper-mode blocks are small and finish quickly, so they are not previewed.
+async function refinePreview(preview) {
+  const js = await loadJSON(`/generate/preview?offset=${preview.version ? preview.offset : 0}`);
+  if (!js || js.status !== 'running' || !js.version) return preview;
+  if (js.version !== preview.version) {
+    // A newer run started: its layout comes with offset 0
+    if (!js.regions) return { version: null, offset: 0 };
+    const data = preview.data || await loadJSON('data.json');
+    if (data && data.periodic) return { version: js.version, offset: 0, data, skip: true };
+    preview = { version: js.version, offset: 0, data };
+    preview.layout = drawPreviewLayout(js.regions, data);
+  }
+  if (preview.skip || !preview.layout) return preview;
+  patternPainter.paint({ type: 'tiles', layout: preview.layout, tiles: PatternPainter.packTiles(js.tiles || []) });
+  preview.offset = js.next_offset || preview.offset;
+  return preview;
+}
+
+function drawPreviewLayout(regions, data) {
+  const canvas = document.getElementById('patternCanvas');
+  const width = data.canvas_width || 500;
+  const height = data.canvas_height || 500;
+  const backing = computeBackingSize(width, height);
+  applyCanvasDisplaySize(canvas, width, height);
+  let maxX = 0, maxY = 0;
+  regions.forEach(r => { if (r.x2 > maxX) maxX = r.x2; if (r.y2 > maxY) maxY = r.y2; });
+  const layout = patternLayout(patternGridDims([{ grid_x: maxX, grid_y: maxY }], null), width, height, backing);
+  patternPainter.paint({
+    type: 'regions', width: backing.width, height: backing.height, layout,
+    regions: regions.map(r => [r.x1, r.y1, r.x2, r.y2, r.color_fundo])
+  });
+  recomputeCanvasSize();
+  return layout;
+}
+
+// Each finished generation is the newest step of the server-side history
 async function generateAndSaveHistory() {
   // Avoid starting another generation if one is already in progress
   if (isGenerationInProgress) return;
@@ -705,7 +660,14 @@ isGenerationInProgress = true;
 updateGenIndicator();
   try {
     // send generate request and then poll server status for completion
-    const genResp = await fetch('/generate', { method: 'POST', credentials: 'same-origin' });
+    const mode = nextGenerateMode || 'full';
+    nextGenerateMode = null;
+    const genResp = await fetch('/generate', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ mode: mode }),
+      credentials: 'same-origin'
+    });
     if (!genResp.ok) {
       try { const js = await genResp.json(); showToast(js && js.message ? js.message : 'Generation failed to start', 'error'); } catch {}
       throw new Error('Failed to start generation');
@@ -715,12 +677,19 @@ updateGenIndicator();
     const pollInterval = 400; // 0.4s
     const deadline = Date.now() + timeoutMs;
     let status = 'running';
+    let preview = { version: null, offset: 0 };
     while (Date.now() < deadline) {
       try {
         const resp = await fetch('/generate/status', { credentials: 'same-origin' });
         const js = await resp.json();
         status = js && js.status || 'idle';
         if (status === 'done') break;
+        if (status === 'error') {
+          showToast(js.message || 'Generation failed', 'error');
+          return;
+        }
+        // Progressive run: layout known, detail still arriving
+        if (js.stage === 'fill' || js.stage === 'saving') preview = await refinePreview(preview);
       } catch (e) {
         // ignore transient errors
       }
@@ -734,18 +703,8 @@ updateGenIndicator();
 let pattern = [];
 try { pattern = await fetchCurrentPattern(); } catch (e) { pattern = []; showToast('Failed to fetch pattern.json', 'error'); }
 
-const data = await loadJSON('data.json'); // capture the data that produced this pattern
-// Append compressed pattern+data to end of history
-patternHistory.push({ p: compressPatternRows(pattern), d: data, v: 1 });
-    // Limit history to 100 generations
-    if (patternHistory.length > 100) {
-      patternHistory = patternHistory.slice(patternHistory.length - 100);
-    }
-// Move draw before save so UI updates immediately even if localStorage is slow or fails
-historyIndex = patternHistory.length - 1;
-drawPatternFromHistory(historyIndex);
-// Persist history best-effort (may evict older entries on quota pressure)
-saveHistory();
+await showPattern(pattern, null);
+await loadHistory();
   } finally {
     isGenerationInProgress = false;
     generateBtn.disabled = false;
@@ -761,7 +720,29 @@ saveHistory();
   }
 }
 
-document.getElementById('generateBtn').onclick = generateAndSaveHistory;
+document.getElementById('generateBtn').onclick = function() {
+  // The button always asks for a brand-new layout
+  if (isGenerationInProgress) return;
+  nextGenerateMode = 'full';
+  generateAndSaveHistory();
+};
+
+// Palette-only change: recolor the current layout (generate one if there is none yet)
+async function recolorOrGenerate() {
+  try {
+    await recolorAllAndSaveHistory();
+  } catch (e) {
+    const msg = (e && e.message) ? e.message : String(e || '');
+    if (msg.includes('No regions available to recolor')) {
+      // If there are no regions yet, do a one-time generate to create layout
+      showToast('No regions yet. Generating a base pattern…', 'info');
+      await generateAndSaveHistory();
+    } else {
+      // Other errors: surface and do not auto-generate
+      showToast(msg || 'Recolor failed.', 'error');
+    }
+  }
+}
 
 // Recolor-all path shared by button and palette-change flow
 async function recolorAllAndSaveHistory() {
@@ -775,29 +756,37 @@ async function recolorAllAndSaveHistory() {
     const msg = (js && js.message) ? js.message : 'Recolor-all failed';
     throw new Error(msg);
   }
-  const pattern = js.pattern || [];
-  const data = await loadJSON('data.json');
-  patternHistory.push({ p: compressPatternRows(pattern), d: data, v: 1 });
-  if (patternHistory.length > 100) patternHistory = patternHistory.slice(-100);
-  historyIndex = patternHistory.length - 1;
-  await drawPatternFromHistory(historyIndex);
-  saveHistory();
+  await showPattern(js.pattern || [], null);
+  setHistoryStatus(js.history);
 }
 
-document.getElementById('backBtn').onclick = function() {
-  if (historyIndex > 0) {
-    historyIndex--;
-    saveHistory();
-    drawPatternFromHistory(historyIndex);
+// Undo/redo: the server rebuilds that step (pattern and the settings that produced it)
+async function moveInHistory(direction) {
+  if (isGenerationInProgress) return;
+  const backBtn = document.getElementById('backBtn');
+  const forwardBtn = document.getElementById('forwardBtn');
+  backBtn.disabled = forwardBtn.disabled = true;
+  try {
+    const resp = await fetch(`/history/${direction}`, { method: 'POST', credentials: 'same-origin' });
+    const js = await resp.json();
+    if (!resp.ok) throw new Error(js && js.message || 'Undo failed');
+    await fillForm();
+    const cached = js.history && js.history.id ? await historyCache.get(js.history.id) : null;
+    if (cached) await showPattern(cached.pattern, null, cached.packed);
+    else await drawPattern();
+    setHistoryStatus(js.history);
+  } catch (e) {
+    showToast(e.message || 'Undo failed', 'error');
+    await loadHistory();
   }
+}
+
+document.getElementById('backBtn').onclick = function() {
+  if (historyStatus.can_undo) moveInHistory('undo');
 };
 
 document.getElementById('forwardBtn').onclick = function() {
-  if (historyIndex < patternHistory.length - 1) {
-    historyIndex++;
-    saveHistory();
-    drawPatternFromHistory(historyIndex);
-  }
+  if (historyStatus.can_redo) moveInHistory('redo');
 };
 
 // Debounced auto-save and generate
@@ -823,6 +812,7 @@ async function autoSaveAndGenerate() {
   // Convert from cm (UI) to mm (stored/used)
   data.canvas_width = parseInt(document.getElementById('canvas_width').value) * 10;
   data.canvas_height = parseInt(document.getElementById('canvas_height').value) * 10;
+  applyPeriodicFormFields(data);
   // Persist all visible buttons from DOM
   for (let i = 0; i < VISIBLE_PALETTE_COUNT; i++) {
     const btnKey = `button_${i}`;
@@ -831,12 +821,23 @@ async function autoSaveAndGenerate() {
     const state = (swatch && !swatch.classList.contains('inactive')) ? "on" : "off";
     data[btnKey] = { state: state, color: color };
   }
-  await postJSON('/data.json', data);
+  const saved = await postJSON('/data.json', data);
+  const changed = (saved && saved.changed) || 'layout';
+  // Nothing generation-relevant changed (e.g. the same knob value again): keep the pattern
+  if (changed === 'none') return;
+  // Only colors changed: a recolor keeps the layout and is much cheaper than regenerating
+  // (unless a generation is already pending; it will pick up the new colors)
+  if (changed === 'palette' && !isGenerationInProgress && !debounceTimer) {
+    await recolorOrGenerate();
+    return;
+  }
+  // Only the canvas size changed: keep the layout and fill just the added strips
+  requestGenerateMode(changed === 'resize' ? 'resize' : 'full');
 
   // Debounce pattern generation. If a generation is already in progress, queue one follow-up.
   if (debounceTimer) clearTimeout(debounceTimer);
   if (!isGenerationInProgress) {
-    debounceTimer = setTimeout(generateAndSaveHistory, 400);
+    debounceTimer = setTimeout(() => { debounceTimer = null; generateAndSaveHistory(); }, 400);
   } else {
     // mark that we need one generation after current finishes
     needsGenerateAfterCurrent = true;
@@ -1015,16 +1016,14 @@ ensureSessionId();
   await fillForm();
   attachAutoSave();
   await maybeApplyNewDefaultPalette();
-  loadHistory();
   updateGenIndicator();
-  if (patternHistory.length > 0) {
-    drawPatternFromHistory(historyIndex);
-  } else {
-    const booted = await firstRunBootstrap();
-    if (!booted) {
-      // Fallback: draw whatever is in pattern.json (may be empty)
-      await drawPattern();
-    }
+  // Patterns used to be kept in localStorage; the server keeps the history now
+  try { localStorage.removeItem('patternHistory'); localStorage.removeItem('historyIndex'); } catch (e) { /* ignore */ }
+  await loadHistory();
+  const booted = await firstRunBootstrap();
+  if (!booted) {
+    // Draw whatever is in pattern.json (may be empty)
+    await drawPattern();
   }
 })();
 
@@ -1040,75 +1039,22 @@ function getDrawingInstructions(pattern) {
   return instructions.join('\n');
 }
 
-// Export current pattern as a JPEG image (fits within device capabilities)
-async function exportPatternJPEG(pattern, data, filename = 'pepe_pattern.jpg', quality = 0.92) {
-  try {
-    const intrinsicW = parseInt((data && data.canvas_width) || 500);
-    const intrinsicH = parseInt((data && data.canvas_height) || 500);
-    const limited = ensureCanvasSizeWithinLimits(intrinsicW, intrinsicH);
-    const outW = Math.max(1, limited.width);
-    const outH = Math.max(1, limited.height);
-
-    // Offscreen canvas render
-    const off = document.createElement('canvas');
-    off.width = outW; off.height = outH;
-    const ctx = off.getContext('2d');
-    // white background
-    ctx.fillStyle = '#fff';
-    ctx.fillRect(0, 0, outW, outH);
-
-    // Layout same as drawPattern but using export dimensions
-    let maxX = 0, maxY = 0;
-    pattern.forEach(tile => {
-      if (tile.grid_x > maxX) maxX = tile.grid_x;
-      if (tile.grid_y > maxY) maxY = tile.grid_y;
-    });
-    const cols = Math.max(1, maxX);
-    const rows = Math.max(1, maxY);
-    const tileSize = Math.min(outW / cols, outH / rows);
-    const margin = tileSize * TILE_MARGIN_RATIO;
-    const drawSize = tileSize - margin;
-    const offsetX = (outW - tileSize * cols) / 2;
-    const offsetY = (outH - tileSize * rows) / 2;
-
-    pattern.forEach(tile => {
-      const x = offsetX + (tile.grid_x - 1) * tileSize + margin / 2;
-      const y = offsetY + (tile.grid_y - 1) * tileSize + margin / 2;
-      drawTile(ctx, tile, x, y, drawSize);
-    });
-
-    const doDownload = (blob) => {
-      const url = URL.createObjectURL(blob);
-      const a = document.createElement('a');
-      a.href = url; a.download = filename;
-      document.body.appendChild(a);
-      a.click();
-      setTimeout(() => { document.body.removeChild(a); URL.revokeObjectURL(url); }, 250);
-    };
-
-    if (off.toBlob) {
-      off.toBlob((blob) => { if (blob) doDownload(blob); }, 'image/jpeg', quality);
-    } else {
-      const dataUrl = off.toDataURL('image/jpeg', quality);
-      // Convert dataURL to Blob
-      const byteString = atob(dataUrl.split(',')[1]);
-      const mimeString = dataUrl.split(',')[0].split(':')[1].split(';')[0];
-      const ab = new ArrayBuffer(byteString.length);
-      const ia = new Uint8Array(ab);
-      for (let i = 0; i < byteString.length; i++) ia[i] = byteString.charCodeAt(i);
-      doDownload(new Blob([ab], { type: mimeString }));
-    }
-  } catch (e) {
-    console.warn('exportPatternJPEG failed', e);
-    showToast('Could not export JPG.', 'error');
-  }
+// Export the current pattern as vector SVG at print size. The server writes it from the
+// saved pattern (one symbol per tile shape, one fill per repeating region) and streams it,
+// so nothing is rasterized here whatever the canvas size.
+function exportPatternSVG(filename = 'pepe_pattern.svg') {
+  const a = document.createElement('a');
+  a.href = '/render.svg?download=1';
+  a.download = filename;
+  document.body.appendChild(a);
+  a.click();
+  setTimeout(() => document.body.removeChild(a), 250);
 }
 
-// Print button logic — now also downloads a JPG snapshot of the pattern
+// Print button logic — also downloads the pattern drawing as SVG
 document.getElementById('printBtn').onclick = async function() {
-  const entry = patternHistory[historyIndex];
-  // Prefer the currently drawn pattern to guarantee latest edits are included
-  const pattern = (currentPattern && currentPattern.length) ? currentPattern : (entry ? (entry.pattern || entry) : []);
+  // The currently drawn pattern includes the latest edits
+  const pattern = currentPattern || [];
   // 1) Download instructions txt
   const instructions = getDrawingInstructions(pattern);
   const blob = new Blob([instructions], { type: 'text/plain' });
@@ -1123,10 +1069,8 @@ document.getElementById('printBtn').onclick = async function() {
     URL.revokeObjectURL(url);
   }, 100);
 
-  // 2) Also export a JPG of the pattern drawing
-  let data;
-  try { data = await loadJSON('data.json'); } catch(e) { data = { canvas_width: 500, canvas_height: 500 }; }
-  await exportPatternJPEG(pattern, data, 'pepe_pattern.jpg', 0.92);
+  // 2) Also export the pattern drawing (vector, at the canvas size in mm)
+  if (pattern.length) exportPatternSVG('pepe_pattern.svg');
 };
 
 // Keep displayed canvas scaled properly when the window resizes
@@ -1428,10 +1372,9 @@ function syncOverlayToCanvas() {
     const iw = parseInt(canvas.dataset.intrinsicWidth || canvas.width, 10);
     const ih = parseInt(canvas.dataset.intrinsicHeight || canvas.height, 10);
     if (!iw || !ih || !currentPattern || !currentPattern.length) return null;
-    let maxX = 0, maxY = 0;
-    currentPattern.forEach(t => { if (t.grid_x > maxX) maxX = t.grid_x; if (t.grid_y > maxY) maxY = t.grid_y; });
-    const cols = Math.max(1, maxX);
-    const rows = Math.max(1, maxY);
+    const dims = patternGridDims(currentPattern, currentPatternData);
+    const cols = dims.cols;
+    const rows = dims.rows;
     const tileSize = Math.min(iw / cols, ih / rows);
     const margin = tileSize * TILE_MARGIN_RATIO;
     const offsetX = (iw - tileSize * cols) / 2;
@@ -1496,10 +1439,9 @@ function syncOverlayToCanvas() {
     const height = ih || canvas.height;
 
     // reconstruct layout like drawPattern
-    let maxX = 0, maxY = 0;
-    currentPattern.forEach(t => { if (t.grid_x > maxX) maxX = t.grid_x; if (t.grid_y > maxY) maxY = t.grid_y; });
-    const cols = Math.max(1, maxX);
-    const rows = Math.max(1, maxY);
+    const dims = patternGridDims(currentPattern, currentPatternData);
+    const cols = dims.cols;
+    const rows = dims.rows;
     const tileSize = Math.min(width / cols, height / rows);
     const margin = tileSize * TILE_MARGIN_RATIO;
     const offsetX = (width - tileSize * cols) / 2;
@@ -1518,6 +1460,29 @@ function syncOverlayToCanvas() {
     return { grid_x: gx, grid_y: gy };
   }
 
+  // Tile under a canvas cell (a periodic pattern stores one block: wrap into it)
+  function tileAtCell(g){
+    const dims = patternGridDims(currentPattern, currentPatternData);
+    const gx = ((g.grid_x - 1) % dims.blockCols) + 1;
+    const gy = ((g.grid_y - 1) % dims.blockRows) + 1;
+    return currentPattern.find(t => t.grid_x === gx && t.grid_y === gy);
+  }
+
+  // Wand selection in stored-pattern coordinates. A periodic selection wraps into the
+  // block; one that crosses a block edge covers the whole block on that axis.
+  function wandRectInPattern(a, b){
+    const dims = patternGridDims(currentPattern, currentPatternData);
+    const axis = (p, q, n) => {
+      const lo = Math.min(p, q), hi = Math.max(p, q);
+      if (hi - lo + 1 >= n) return [1, n];
+      const l = ((lo - 1) % n) + 1, h = ((hi - 1) % n) + 1;
+      return l <= h ? [l, h] : [1, n];
+    };
+    const [x1, x2] = axis(a.grid_x, b.grid_x, dims.blockCols);
+    const [y1, y2] = axis(a.grid_y, b.grid_y, dims.blockRows);
+    return { x1, y1, x2, y2 };
+  }
+
 async function postWand(x1,y1,x2,y2){
     try{
       const resp = await fetch('/magic-wand', {
@@ -1528,36 +1493,43 @@ async function postWand(x1,y1,x2,y2){
       });
       const js = await resp.json();
       if (!resp.ok) throw new Error(js && js.message || 'Magic wand failed');
-      const pattern = js.pattern || [];
-      const data = await loadJSON('data.json');
-      patternHistory.push({ p: compressPatternRows(pattern), d: data, v: 1 });
-      if (patternHistory.length > 100) patternHistory = patternHistory.slice(-100);
-      historyIndex = patternHistory.length - 1;
-      await drawPatternFromHistory(historyIndex);
-      saveHistory();
+      await showPattern(js.pattern || [], null);
+      setHistoryStatus(js.history);
     }catch(err){ console.warn('magic-wand failed', err); showToast('Magic wand failed. Please try again.', 'error'); }
   }
 
-async function postEdit(region_id, action){
+// Region edits fired in quick succession are sent as one /edit-regions batch
+  const EDIT_BATCH_DELAY_MS = 150;
+  let pendingEditOps = [];
+  let editFlushTimer = null;
+
+  function postEdit(region_id, action){
+    pendingEditOps.push({ region_id, action });
+    if (editFlushTimer) clearTimeout(editFlushTimer);
+    editFlushTimer = setTimeout(flushEdits, EDIT_BATCH_DELAY_MS);
+  }
+
+  async function flushEdits(){
+    editFlushTimer = null;
+    const ops = pendingEditOps;
+    pendingEditOps = [];
+    if (!ops.length) return;
     try{
-      const resp = await fetch('/edit-region', {
+      const resp = await fetch('/edit-regions', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         credentials: 'same-origin',
-        body: JSON.stringify({ region_id, action })
+        body: JSON.stringify({ ops })
       });
       const js = await resp.json();
       if (!resp.ok) throw new Error(js && js.message || 'Edit failed');
-      const pattern = js.pattern || [];
-      // push compressed to history and draw
-      const data = await loadJSON('data.json');
-      patternHistory.push({ p: compressPatternRows(pattern), d: data, v: 1 });
-      if (patternHistory.length > 100) patternHistory = patternHistory.slice(-100);
-      historyIndex = patternHistory.length - 1;
-      await drawPatternFromHistory(historyIndex);
-      saveHistory();
+      // The drawn pattern is the server's current step (undo/redo redraw from the server)
+      const ids = new Set(js.region_ids || []);
+      const pattern = currentPattern.filter(t => !ids.has(t.region_id)).concat(js.tiles || []);
+      await showPattern(pattern, currentPatternData);
+      setHistoryStatus(js.history);
     }catch(err){
-      console.warn('edit-region failed', err);
+      console.warn('edit-regions failed', err);
       showToast('Edit failed. Please try again.', 'error');
     }
   }
@@ -1593,12 +1565,13 @@ async function postEdit(region_id, action){
         const a = wandFirst; const b = g;
         setWand(false);
         clearOverlay();
-        await postWand(a.grid_x, a.grid_y, b.grid_x, b.grid_y);
+        const r = wandRectInPattern(a, b);
+        await postWand(r.x1, r.y1, r.x2, r.y2);
       }
       return;
     }
     // find tile
-    const tile = currentPattern.find(t => t.grid_x === g.grid_x && t.grid_y === g.grid_y);
+    const tile = tileAtCell(g);
     if (!tile || tile.region_id == null) return;
     await postEdit(tile.region_id, 'reroll');
   });
@@ -1609,7 +1582,7 @@ async function postEdit(region_id, action){
     const g = getGridFromEvent(e);
     if (!g) return false;
     if (wandMode){ return false; }
-    const tile = currentPattern.find(t => t.grid_x === g.grid_x && t.grid_y === g.grid_y);
+    const tile = tileAtCell(g);
     if (!tile || tile.region_id == null) return false;
     await postEdit(tile.region_id, 'recolor');
     return false;
@@ -1625,7 +1598,7 @@ async function postEdit(region_id, action){
     touchTimer = setTimeout(async ()=>{
       const g = getGridFromEvent(ev);
       if (!g) return;
-      const tile = currentPattern.find(t => t.grid_x === g.grid_x && t.grid_y === g.grid_y);
+      const tile = tileAtCell(g);
       if (!tile || tile.region_id == null) return;
       await postEdit(tile.region_id, 'recolor');
     }, 550);
@@ -1642,40 +1615,6 @@ async function postEdit(region_id, action){
   canvas.addEventListener('mouseleave', ()=>{ clearOverlay(); });
 })();
 
-// Compact pattern codec to store more steps in localStorage
-// Row format: [gx, gy, t, r, cf, cp, rid] where t: 0=Quadrado,1=Triangulos
-function compressPatternRows(pattern){
-  const rows = [];
-  for (let i = 0; i < pattern.length; i++){
-    const t = pattern[i];
-    const tt = (t.tile === 'Padrao Quadrado') ? 0 : 1;
-    rows.push([
-      t.grid_x|0, t.grid_y|0,
-      tt,
-      (t.rotation|0) || 0,
-      t.color_fundo || '#000',
-      t.color_padrao || '#000',
-      (t.region_id==null? null : (t.region_id|0))
-    ]);
-  }
-  return rows;
-}
-function decompressPatternRows(rows){
-  const out = new Array(rows.length);
-  for (let i = 0; i < rows.length; i++){
-    const r = rows[i];
-    out[i] = {
-      grid_x: r[0]|0,
-      grid_y: r[1]|0,
-      tile: (r[2] === 0) ? 'Padrao Quadrado' : 'Padrao Triangulos',
-      rotation: r[3]|0,
-      color_fundo: r[4],
-      color_padrao: r[5],
-      region_id: (r[6] == null ? null : (r[6]|0))
-    };
-  }
-  return out;
-}
 // Simple toast helper
 function showToast(message, type = 'info', ms = 3200) {
   try {
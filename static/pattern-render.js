@@ -0,0 +1,176 @@
+// Pattern canvas painting, shared by the page and its render worker. Loaded with a <script>
+// tag it defines PatternPainter; started as a Web Worker it paints on the OffscreenCanvas
+// the page transfers to it, so drawing big patterns never blocks the page.
+//
+// Tiles travel as typed arrays ({ xs, ys, glyphs } plus a glyph table of
+// [tile, rotation, color_fundo, color_padrao]) so they can be transferred without copying.
+// Each glyph is drawn once per tile size into a small canvas and then copied with drawImage.
+(function(scope){
+  const GLYPH_CACHE_MAX = 2048;
+
+  // Normalized motif paths in [0,1]x[0,1] (drawTile geometry, see render.py)
+  const PATHS = (function(){
+    const tri = new Path2D();
+    tri.moveTo(0, 0.5); tri.lineTo(0, 1); tri.lineTo(0.5, 1); tri.closePath();
+    tri.moveTo(0.5, 0); tri.lineTo(1, 0); tri.lineTo(1, 0.5); tri.closePath();
+    const half = new Path2D();
+    half.rect(0, 0, 0.5, 1);
+    return { 'Padrao Triangulos': tri, 'Padrao Quadrado': half };
+  })();
+
+  function makeCanvas(w, h) {
+    if (typeof OffscreenCanvas !== 'undefined') return new OffscreenCanvas(w, h);
+    const c = document.createElement('canvas');
+    c.width = w; c.height = h;
+    return c;
+  }
+
+  // Pack tile dicts ({ tile, rotation, color_fundo, color_padrao, grid_x, grid_y }) for paint()
+  function packTiles(tiles) {
+    const n = tiles.length;
+    const xs = new Int32Array(n), ys = new Int32Array(n), glyphs = new Uint32Array(n);
+    const table = [];
+    const ids = new Map();
+    for (let i = 0; i < n; i++) {
+      const t = tiles[i];
+      const rot = t.rotation || 0;
+      const key = t.tile + '|' + rot + '|' + t.color_fundo + '|' + t.color_padrao;
+      let id = ids.get(key);
+      if (id === undefined) {
+        id = table.length;
+        ids.set(key, id);
+        table.push([t.tile, rot, t.color_fundo, t.color_padrao]);
+      }
+      xs[i] = t.grid_x; ys[i] = t.grid_y; glyphs[i] = id;
+    }
+    return { xs, ys, glyphs, table };
+  }
+
+  function transferables(op) {
+    return op.tiles ? [op.tiles.xs.buffer, op.tiles.ys.buffer, op.tiles.glyphs.buffer] : [];
+  }
+
+  function create(canvas) {
+    const ctx = canvas.getContext('2d');
+    const glyphCache = new Map();  // "tile|rotation|fundo|padrao|px" -> canvas
+
+    function glyph(g, px) {
+      const key = g.join('|') + '|' + px;
+      let c = glyphCache.get(key);
+      if (c) return c;
+      if (glyphCache.size >= GLYPH_CACHE_MAX) glyphCache.clear();
+      c = makeCanvas(px, px);
+      const gctx = c.getContext('2d');
+      gctx.fillStyle = g[2] || '#000';
+      gctx.fillRect(0, 0, px, px);
+      const path = PATHS[g[0]];
+      if (path) {
+        gctx.translate(px / 2, px / 2);
+        if (g[1]) gctx.rotate(g[1] * Math.PI / 180);
+        gctx.translate(-px / 2, -px / 2);
+        gctx.scale(px, px);
+        gctx.fillStyle = g[3] || '#000';
+        gctx.fill(path);
+      }
+      glyphCache.set(key, c);
+      return c;
+    }
+
+    // Cell (gx, gy) sits at offset + (gx - 1) * tileSize in layout units, scaled into pixels
+    function paintTiles(target, tiles, L, offsetX, offsetY) {
+      const margin = L.tileSize * L.marginRatio;
+      const size = (L.tileSize - margin) * Math.min(L.scaleX, L.scaleY);
+      const px = Math.max(1, Math.ceil(size));
+      const sprites = tiles.table.map(g => glyph(g, px));
+      const { xs, ys, glyphs } = tiles;
+      for (let i = 0; i < xs.length; i++) {
+        target.drawImage(sprites[glyphs[i]],
+          (offsetX + (xs[i] - 1) * L.tileSize + margin / 2) * L.scaleX,
+          (offsetY + (ys[i] - 1) * L.tileSize + margin / 2) * L.scaleY, size, size);
+      }
+    }
+
+    function clear(width, height) {
+      if (canvas.width !== width) canvas.width = width;
+      if (canvas.height !== height) canvas.height = height;
+      ctx.fillStyle = '#fff';
+      ctx.fillRect(0, 0, width, height);
+    }
+
+    // A periodic block is painted once offscreen and then copied over the grid
+    function paintPattern(op) {
+      const L = op.layout, dims = L.dims;
+      clear(op.width, op.height);
+      if (!dims.periodic) {
+        paintTiles(ctx, op.tiles, L, L.offsetX, L.offsetY);
+        return;
+      }
+      const block = makeCanvas(Math.max(1, Math.ceil(dims.blockCols * L.tileSize * L.scaleX)),
+                               Math.max(1, Math.ceil(dims.blockRows * L.tileSize * L.scaleY)));
+      paintTiles(block.getContext('2d'), op.tiles, L, 0, 0);
+      ctx.save();
+      ctx.beginPath();
+      ctx.rect(L.offsetX * L.scaleX, L.offsetY * L.scaleY, dims.cols * L.tileSize * L.scaleX, dims.rows * L.tileSize * L.scaleY);
+      ctx.clip();
+      for (let by = 0; by < dims.rows; by += dims.blockRows) {
+        for (let bx = 0; bx < dims.cols; bx += dims.blockCols) {
+          ctx.drawImage(block, (L.offsetX + bx * L.tileSize) * L.scaleX, (L.offsetY + by * L.tileSize) * L.scaleY);
+        }
+      }
+      ctx.restore();
+    }
+
+    // Preview layout: each region as a flat block of its background color
+    function paintRegions(op) {
+      const L = op.layout;
+      const margin = L.tileSize * L.marginRatio;
+      clear(op.width, op.height);
+      op.regions.forEach(r => {
+        ctx.fillStyle = r[4] || '#000';
+        ctx.fillRect((L.offsetX + (r[0] - 1) * L.tileSize + margin / 2) * L.scaleX,
+                     (L.offsetY + (r[1] - 1) * L.tileSize + margin / 2) * L.scaleY,
+                     ((r[2] - r[0] + 1) * L.tileSize - margin) * L.scaleX,
+                     ((r[3] - r[1] + 1) * L.tileSize - margin) * L.scaleY);
+      });
+    }
+
+    // op.type: 'pattern' (clear + draw), 'regions' (clear + preview layout), 'tiles' (draw over)
+    function paint(op) {
+      if (op.type === 'pattern') paintPattern(op);
+      else if (op.type === 'regions') paintRegions(op);
+      else if (op.type === 'tiles') paintTiles(ctx, op.tiles, op.layout, op.layout.offsetX, op.layout.offsetY);
+    }
+
+    return { paint };
+  }
+
+  scope.PatternPainter = { packTiles, transferables, create };
+
+  if (typeof WorkerGlobalScope !== 'undefined' && scope instanceof WorkerGlobalScope) {
+    // Ops that arrive while one is painting are taken together: everything before the
+    // last op that clears the canvas would be painted over anyway.
+    let painter = null;
+    let queue = [];
+    let scheduled = false;
+    function run() {
+      scheduled = false;
+      let start = 0;
+      queue.forEach((op, i) => { if (op.type !== 'tiles') start = i; });
+      const ops = queue.slice(start);
+      queue = [];
+      ops.forEach(op => painter.paint(op));
+    }
+    scope.onmessage = (e) => {
+      const op = e.data;
+      if (op.type === 'init') {
+        painter = create(op.canvas);
+        return;
+      }
+      queue.push(op);
+      if (!scheduled) {
+        scheduled = true;
+        setTimeout(run, 0);
+      }
+    };
+  }
+})(self);
@@ -0,0 +1,29 @@
+import os
+import re
+import sys
+
+import pytest
+
+# The modules live at the repository root (flat layout, no package)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """The Flask app module with its user_data in tmp_path."""
+    app = pytest.importorskip("app")
+    monkeypatch.setattr(app, 'USER_DATA_DIR', str(tmp_path))
+    return app
+
+
+@pytest.fixture
+def sid(request):
+    # One session per test: the job store and scheduler are module globals
+    return re.sub(r'\W', '_', request.node.name)
+
+
+@pytest.fixture
+def client(app_module, sid):
+    c = app_module.app.test_client()
+    c.set_cookie('session_id', sid)
+    return c
@@ -0,0 +1,65 @@
+import json
+import os
+import time
+
+SETTINGS = {"canvas_width": 1000, "canvas_height": 800, "knob_down": 1, "button_1": "#ff0000", "button_2": "#0000ff"}
+
+
+def _save_settings(app, sid, settings=SETTINGS):
+    with open(app._data_path_for(sid), 'w') as f:
+        json.dump(settings, f)
+
+
+def _wait_done(app, client, sid, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while client.get('/generate/status').get_json()['status'] != 'done' or sid in app._admitted_bytes:
+        assert time.monotonic() < deadline, "generation did not finish"
+        time.sleep(0.02)
+
+
+def test_small_canvas_runs_in_memory(app_module, client, sid):
+    _save_settings(app_module, sid)
+    resp = client.post('/generate')
+    assert resp.status_code == 200
+    assert resp.get_json()['mode'] == 'memory'
+    _wait_done(app_module, client, sid)
+    assert os.path.exists(app_module._pattern_path_for(sid))
+    assert not os.path.exists(app_module._tile_store_path_for(sid))
+    assert len(client.get('/pattern.json').get_json()) == 10 * 8
+
+
+def test_over_the_request_budget_switches_to_streaming(app_module, client, sid, monkeypatch):
+    _save_settings(app_module, sid)
+    estimate = app_module._admission_estimate(SETTINGS)
+    # Too much for the list-of-dicts pattern, enough for two column strips
+    monkeypatch.setattr(app_module, 'GEN_REQUEST_MEMORY_BYTES', estimate['stream_memory_bytes'])
+    resp = client.post('/generate')
+    assert resp.status_code == 200
+    assert resp.get_json()['mode'] == 'streaming'
+    _wait_done(app_module, client, sid)
+    assert os.path.exists(app_module._tile_store_path_for(sid))
+    assert not os.path.exists(app_module._pattern_path_for(sid))
+    # /pattern.json streams out of the tile store
+    assert len(client.get('/pattern.json').get_json()) == 10 * 8
+
+
+def test_too_large_either_way_is_413(app_module, client, sid, monkeypatch):
+    _save_settings(app_module, sid)
+    monkeypatch.setattr(app_module, 'GEN_REQUEST_MEMORY_BYTES', 1)
+    resp = client.post('/generate')
+    assert resp.status_code == 413
+    assert resp.get_json()['estimate']['mode'] is None
+    assert sid not in app_module._admitted_bytes
+    assert client.get('/generate/status').get_json()['status'] == 'idle'
+
+
+def test_busy_server_is_429_with_retry_after(app_module, client, sid, monkeypatch):
+    _save_settings(app_module, sid)
+    estimate = app_module._admission_estimate(SETTINGS)
+    monkeypatch.setattr(app_module, 'GEN_GLOBAL_MEMORY_BYTES', estimate['working_bytes'] * 2)
+    # Another session's admitted run already holds most of the budget
+    monkeypatch.setitem(app_module._admitted_bytes, sid + '_other', estimate['working_bytes'] + 1)
+    resp = client.post('/generate')
+    assert resp.status_code == 429
+    assert int(resp.headers['Retry-After']) >= 1
+    assert sid not in app_module._admitted_bytes
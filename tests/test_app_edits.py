@@ -0,0 +1,79 @@
+import json
+import threading
+
+import PepesMachine as pm
+
+SETTINGS = {
+    "canvas_width": 1000, "canvas_height": 800, "knob_down": 1,
+    "button_1": {"state": "on", "color": "#ff0000"},
+    "button_2": {"state": "on", "color": "#00ff00"},
+    "button_3": {"state": "on", "color": "#0000ff"},
+}
+
+
+def _seed_session(app, sid, seed=5):
+    """A generated pattern saved for sid, as a finished /generate leaves it."""
+    with open(app._data_path_for(sid), 'w') as f:
+        json.dump(SETTINGS, f)
+    pattern = pm.generate(settings=SETTINGS, seed=seed)
+    regions = [dict(r) for r in pm.REGIONS]
+    app._json_dump_file(pattern, app._pattern_path_for(sid))
+    app._json_dump_file(regions, app._regions_path_for(sid))
+    app._record_history(sid, {"op": "generate", "seed": seed, "settings": SETTINGS})
+    return pattern, regions
+
+
+def _saved(app, sid):
+    with open(app._pattern_path_for(sid)) as f:
+        pattern = json.load(f)
+    with open(app._regions_path_for(sid)) as f:
+        regions = {r['id']: r for r in json.load(f)}
+    return pattern, regions
+
+
+def test_batch_returns_a_delta_and_records_history(app_module, client, sid):
+    pattern, regions = _seed_session(app_module, sid)
+    ids = [regions[0]['id'], regions[1]['id']]
+    resp = client.post('/edit-regions', json={"ops": [{"region_id": i, "action": "reroll"} for i in ids]})
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert sorted(body['region_ids']) == sorted(ids)
+    assert {t['region_id'] for t in body['tiles']} == set(ids)
+    assert body['history']['position'] == 1
+    saved_pattern, saved_regions = _saved(app_module, sid)
+    untouched = [t for t in pattern if t.get('region_id') not in ids]
+    assert [t for t in saved_pattern if t.get('region_id') not in ids] == untouched
+    assert sorted(saved_regions) == sorted(r['id'] for r in regions)
+    assert client.get('/history').get_json()['ops'] == ['generate', 'regions']
+
+
+def test_one_bad_op_rejects_the_whole_batch(app_module, client, sid):
+    _seed_session(app_module, sid)
+    before = _saved(app_module, sid)
+    ops = [{"region_id": 1, "action": "reroll"}, {"region_id": 99999, "action": "reroll"}]
+    assert client.post('/edit-regions', json={"ops": ops}).status_code == 404
+    assert client.post('/edit-regions', json={"ops": [{"region_id": 1, "action": "explode"}]}).status_code == 400
+    assert client.post('/edit-regions', json={"ops": []}).status_code == 400
+    assert _saved(app_module, sid) == before
+    assert client.get('/history').get_json()['ops'] == ['generate']
+
+
+def test_concurrent_batches_keep_every_edit(app_module, sid):
+    _pattern, regions = _seed_session(app_module, sid)
+    ids = [r['id'] for r in regions[:6]]
+    statuses = []
+
+    def edit(region_id):
+        c = app_module.app.test_client()
+        c.set_cookie('session_id', sid)
+        statuses.append(c.post('/edit-regions', json={"ops": [{"region_id": region_id, "action": "recolor"}]}).status_code)
+    threads = [threading.Thread(target=edit, args=(i,)) for i in ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert statuses == [200] * len(ids)
+    _saved_pattern, saved_regions = _saved(app_module, sid)
+    # Each batch saw the one before it: every region carries its own recolor
+    assert all(saved_regions[i].get('recolor_count') == 1 for i in ids)
+    assert len(app_module._history_for(sid).entries) == 1 + len(ids)
@@ -0,0 +1,66 @@
+import os
+
+import tilestore
+
+
+def _tiles(cols, rows, color='#ff0000'):
+    return [{'tile': 'Padrao Quadrado', 'rotation': 0, 'color_fundo': color, 'color_padrao': '#ffffff',
+             'region_id': 1, 'grid_x': gx, 'grid_y': gy}
+            for gx in range(1, cols + 1) for gy in range(1, rows + 1)]
+
+
+def _pages(client, **args):
+    """Every page of a /pattern query, following next_offset with the first page's version."""
+    first = client.get('/pattern', query_string=args).get_json()
+    pages = [first]
+    while pages[-1].get('truncated'):
+        resp = client.get('/pattern', query_string=dict(args, offset=pages[-1]['next_offset'], version=first['version']))
+        assert resp.status_code == 200
+        pages.append(resp.get_json())
+    return pages
+
+
+def test_viewport_pages(app_module, client, sid):
+    app_module._json_dump_file(_tiles(6, 5), app_module._pattern_path_for(sid))
+    pages = _pages(client, x0=2, y0=2, x1=4, y1=3, limit=4)
+    assert [len(p['tiles']) for p in pages] == [4, 2]
+    assert len({p['version'] for p in pages}) == 1
+    cells = sorted((t['grid_x'], t['grid_y']) for p in pages for t in p['tiles'])
+    assert cells == [(x, y) for x in range(2, 5) for y in range(2, 4)]
+    assert pages[0]['cols'] == 6 and pages[0]['rows'] == 5
+
+
+def test_same_size_rewrite_is_a_new_version(app_module, client, sid):
+    path = app_module._pattern_path_for(sid)
+    app_module._json_dump_file(_tiles(3, 3), path)
+    first = client.get('/pattern', query_string={'limit': 4}).get_json()
+    st = os.stat(path)
+    app_module._json_dump_file(_tiles(3, 3, color='#00ff00'), path)
+    # Same size, and the same mtime as on a coarse-timestamp filesystem
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert os.stat(path).st_size == st.st_size
+    stale = client.get('/pattern', query_string={'limit': 4, 'offset': 4, 'version': first['version']})
+    assert stale.status_code == 412
+    body = stale.get_json()
+    assert body['version'] != first['version']
+    fresh = client.get('/pattern', query_string={'limit': 4}).get_json()
+    assert fresh['version'] == body['version']
+    assert {t['color_fundo'] for t in fresh['tiles']} == {'#00ff00'}
+
+
+def test_tile_store_patch_is_a_new_version(app_module, client, sid):
+    path = app_module._tile_store_path_for(sid)
+    with tilestore.TileStore.create(path, 4, 4, 1) as store:
+        store.put_tiles(_tiles(4, 4))
+    first = client.get('/pattern', query_string={'limit': 5}).get_json()
+    assert first['truncated'] and len(first['tiles']) == 5
+    st = os.stat(path)
+    tilestore.Patch(tiles=_tiles(4, 4, color='#00ff00')).apply(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    resp = client.get('/pattern', query_string={'limit': 5, 'offset': 5, 'version': first['version']})
+    assert resp.status_code == 412
+
+
+def test_no_pattern(client):
+    body = client.get('/pattern').get_json()
+    assert body['version'] is None and body['tiles'] == []
@@ -0,0 +1,52 @@
+import json
+import os
+
+import pytest
+
+SETTINGS = {"canvas_width": 1000, "canvas_height": 800, "knob_down": 1, "switch": "center", "slider": 50,
+            "button_1": {"state": "on", "color": "#ff0000"},
+            "button_2": {"state": "on", "color": "#0000ff"}}
+
+
+def _save(client, settings):
+    resp = client.post('/data.json', data=json.dumps(settings))
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def test_identical_save_is_a_no_op(app_module, client, sid):
+    assert _save(client, SETTINGS) == {"status": "ok", "changed": "layout", "saved": True}
+    mtime = os.stat(app_module._data_path_for(sid)).st_mtime_ns
+    assert _save(client, dict(SETTINGS)) == {"status": "ok", "changed": "none", "saved": False}
+    assert os.stat(app_module._data_path_for(sid)).st_mtime_ns == mtime
+
+
+@pytest.mark.parametrize("edit, changed", [
+    ({"button_1": {"state": "on", "color": "#00ff00"}}, "palette"),
+    ({"button_1": {"state": "on", "color": "#0000ff"}, "button_2": {"state": "on", "color": "#ff0000"}}, "none"),
+    ({"canvas_width": 1200}, "resize"),
+    ({"canvas_width": 1200, "button_2": {"state": "off", "color": "#0000ff"}}, "layout"),
+    ({"knob_down": 3}, "layout"),
+    ({"switch": "left"}, "layout"),
+    ({"slider": 40}, "none"),
+])
+def test_what_a_save_changed(client, edit, changed):
+    _save(client, SETTINGS)
+    assert _save(client, dict(SETTINGS, **edit))['changed'] == changed
+
+
+def test_get_revalidates_on_content(app_module, client, sid):
+    _save(client, SETTINGS)
+    first = client.get('/data.json')
+    assert first.get_json() == SETTINGS
+    assert first.headers['Cache-Control'].startswith('no-store')
+    etag = first.headers['ETag']
+    assert client.get('/data.json', headers={'If-None-Match': etag}).status_code == 304
+    path = app_module._data_path_for(sid)
+    st = os.stat(path)
+    # Same size and mtime, different content
+    _save(client, dict(SETTINGS, knob_down=2))
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    resp = client.get('/data.json', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.get_json()['knob_down'] == 2
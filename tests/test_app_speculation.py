@@ -0,0 +1,62 @@
+import json
+import os
+import time
+
+import pytest
+
+import PepesMachine as pm
+
+SETTINGS = {"canvas_width": 1000, "canvas_height": 800, "knob_down": 1, "button_1": "#ff0000", "button_2": "#0000ff"}
+
+
+@pytest.fixture
+def buffered(app_module, sid, monkeypatch):
+    """sid with saved settings and one speculative pattern buffered for them."""
+    monkeypatch.setattr(app_module, 'GEN_SPECULATIVE_DEPTH', 1)
+    with open(app_module._data_path_for(sid), 'w') as f:
+        json.dump(SETTINGS, f)
+    pattern = pm.generate(settings=SETTINGS, seed=77)
+    item = {'pattern': app_module._pattern_path_for(sid) + '.spec77',
+            'regions': app_module._regions_path_for(sid) + '.spec77', 'seed': 77}
+    app_module._json_dump_file(pattern, item['pattern'])
+    app_module._json_dump_file(list(pm.REGIONS), item['regions'])
+    # scheduled=True: no background top-up starts behind the test's back
+    monkeypatch.setitem(app_module._speculative, sid, {
+        'fingerprint': app_module._settings_fingerprint(SETTINGS), 'settings': SETTINGS, 'items': [item],
+        'scheduled': True, 'touched': time.time()})
+    return item, pattern
+
+
+def test_matching_buffer_is_served_at_once(app_module, client, sid, buffered):
+    item, pattern = buffered
+    resp = client.post('/generate')
+    assert resp.status_code == 200
+    assert resp.get_json()['speculative'] is True
+    assert client.get('/generate/status').get_json() == {"status": "done"}
+    assert client.get('/pattern.json').get_json() == pattern
+    with open(app_module._meta_path_for(sid)) as f:
+        assert json.load(f)['pattern_seed'] == 77
+    assert client.get('/history').get_json()['ops'] == ['generate']
+    assert not os.path.exists(item['pattern'])
+
+
+def test_not_served_over_a_queued_run(app_module, client, sid, buffered):
+    # A run this session already has queued (or running in another process)
+    assert app_module._jobs.bump(sid)[1]
+    try:
+        resp = client.post('/generate')
+        assert resp.status_code == 200
+        assert 'speculative' not in resp.get_json()
+        # The request coalesced into the queued run; the buffer is left alone
+        assert app_module._speculative[sid]['items'] == [buffered[0]]
+        assert not os.path.exists(app_module._pattern_path_for(sid))
+    finally:
+        app_module._jobs.release(sid)
+
+
+def test_settings_change_drops_the_buffer(app_module, client, sid, buffered):
+    item, _pattern = buffered
+    changed = dict(SETTINGS, button_2="#00ff00")
+    assert client.post('/data.json', data=json.dumps(changed)).get_json()['changed'] == 'palette'
+    assert sid not in app_module._speculative
+    assert not os.path.exists(item['pattern'])
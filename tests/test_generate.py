@@ -0,0 +1,87 @@
+import copy
+
+import pytest
+
+import PepesMachine as pm
+
+SETTINGS = {
+    "canvas_width": 1200, "canvas_height": 800, "knob_down": 1, "switch": "center", "slider": 50,
+    "button_1": {"state": "on", "color": "#ff0000"},
+    "button_2": {"state": "on", "color": "#00ff00"},
+    "button_3": {"state": "on", "color": "#0000ff"},
+    "button_4": {"state": "on", "color": "#ffff00"},
+}
+
+
+def _generate(settings, seed):
+    pattern = pm.generate(settings=settings, seed=seed)
+    return pattern, copy.deepcopy(pm.REGIONS)
+
+
+def test_seeded_generate_is_reproducible():
+    assert _generate(SETTINGS, 42) == _generate(SETTINGS, 42)
+    assert _generate(SETTINGS, 42) != _generate(SETTINGS, 43)
+
+
+def test_seeded_resize_is_reproducible():
+    pattern, regions = _generate(SETTINGS, 7)
+    bigger = dict(SETTINGS, canvas_width=1700, canvas_height=1100)
+    first = pm.resize(copy.deepcopy(pattern), copy.deepcopy(regions), settings=bigger, seed=99)
+    # Unrelated random draws in between must not leak into a seeded run
+    pm.random.random()
+    second = pm.resize(copy.deepcopy(pattern), copy.deepcopy(regions), settings=bigger, seed=99)
+    assert first == second
+    tiles, new_regions = first
+    assert len(tiles) == 17 * 11
+    assert {r['id'] for r in regions} <= {r['id'] for r in new_regions}
+
+
+def test_resize_smaller_keeps_clipped_regions():
+    pattern, regions = _generate(SETTINGS, 3)
+    tiles, kept = pm.resize(pattern, regions, settings=dict(SETTINGS, canvas_width=600), seed=1)
+    assert all(t['grid_x'] <= 6 for t in tiles)
+    assert all(r['x2'] <= 6 for r in kept)
+
+
+def test_single_color_palette_terminates():
+    settings = {"canvas_width": 600, "canvas_height": 600,
+                "button_1": {"state": "on", "color": "black"}, "button_2": "black"}
+    pattern = pm.generate(settings=settings, seed=5)
+    assert {t['color_fundo'] for t in pattern} | {t['color_padrao'] for t in pattern} == {"black", "white"}
+
+
+def _wrap_touching(a, b, width, height):
+    # Regions as (x0, y0, x1, y1) with exclusive ends; edges and corners count
+    return any((dx or dy) and b[2] + dx >= a[0] and b[0] + dx <= a[2] and b[3] + dy >= a[1] and b[1] + dy <= a[3]
+               for dx in (-width, 0, width) for dy in (-height, 0, height))
+
+
+def test_periodic_block_colors_differ_across_seams():
+    colors = ["#%06x" % (i * 0x131313 + 0x050505) for i in range(12)]
+    settings = {"canvas_width": 3000, "canvas_height": 3000, "periodic": True,
+                "period_width": 600, "period_height": 500, "knob_down": 2}
+    settings.update({f"button_{i}": {"state": "on", "color": c} for i, c in enumerate(colors)})
+    layout = pm.periodic_layout(settings)
+    pairs = 0
+    for seed in range(10):
+        pm.generate(settings=settings, seed=seed)
+        regions = [(r['x1'] - 1, r['y1'] - 1, r['x2'], r['y2'], {r['color_fundo'], r['color_padrao']})
+                   for r in pm.REGIONS]
+        for i, a in enumerate(regions):
+            for b in regions[:i]:
+                if _wrap_touching(a, b, layout['block_cols'], layout['block_rows']):
+                    pairs += 1
+                    assert not (a[4] & b[4]), (seed, a, b)
+    assert pairs
+
+
+def test_generate_region_restores_settings_on_failure(monkeypatch):
+    before = pm.SETTINGS
+
+    def boom(self, variant):
+        raise RuntimeError("region failed")
+    monkeypatch.setattr(pm.PatternStyles, 'aleluia_quadrados', boom)
+    with pytest.raises(RuntimeError):
+        pm.generate_region(1, 1, 1, 2, 2, "aleluia_quadrados", 1, "#ff0000", "#00ff00",
+                           settings=dict(SETTINGS, canvas_width=3000), seed=1)
+    assert pm.SETTINGS is before
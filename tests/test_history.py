@@ -0,0 +1,93 @@
+import json
+import os
+
+import history
+
+
+def _log(tmp_path, max_entries=50, snapshot_every=20):
+    return history.OpLog(str(tmp_path / "history_s.json"), max_entries, snapshot_every)
+
+
+def _record(log, entry):
+    # What app._record_history does: write the state whole when asked for a snapshot
+    path = log.append(entry)
+    if path:
+        with open(path, 'w') as f:
+            json.dump({"pattern": [], "regions": []}, f)
+    log.save()
+    return path
+
+
+def test_generate_entries_are_anchors(tmp_path):
+    log = _log(tmp_path)
+    assert _record(log, {"op": "generate", "seed": 1}) is None
+    _record(log, {"op": "regions", "regions": []})
+    _record(log, {"op": "wand", "region": {}})
+    assert log.anchor_for(2) == 0
+    assert log.status() == {"id": log.entries[2]["id"], "position": 2, "length": 3,
+                            "can_undo": True, "can_redo": False}
+
+
+def test_first_entry_without_generation_is_snapshotted(tmp_path):
+    log = _log(tmp_path)
+    path = _record(log, {"op": "regions", "regions": []})
+    assert path and os.path.exists(path)
+    assert history.is_anchor(log.entries[0])
+
+
+def test_snapshot_every_bounds_replay(tmp_path):
+    log = _log(tmp_path, snapshot_every=3)
+    _record(log, {"op": "generate", "seed": 1})
+    for _ in range(7):
+        _record(log, {"op": "recolor-all"})
+    anchors = [i for i, e in enumerate(log.entries) if history.is_anchor(e)]
+    assert anchors == [0, 3, 6]
+    for position in range(len(log.entries)):
+        assert position - log.anchor_for(position) < 3
+
+
+def test_missing_snapshot_falls_back_to_earlier_anchor(tmp_path):
+    log = _log(tmp_path, snapshot_every=2)
+    _record(log, {"op": "generate", "seed": 1})
+    _record(log, {"op": "recolor-all"})
+    _record(log, {"op": "recolor-all"})
+    os.remove(log.snapshot_path(log.entries[2]))
+    assert log.anchor_for(2) == 0
+
+
+def test_append_after_undo_drops_redo_tail(tmp_path):
+    log = _log(tmp_path, snapshot_every=2)
+    _record(log, {"op": "generate", "seed": 1})
+    _record(log, {"op": "recolor-all"})
+    dropped = _record(log, {"op": "recolor-all"})
+    log.position = 0
+    _record(log, {"op": "wand", "region": {}})
+    assert [e["op"] for e in log.entries] == ["generate", "wand"]
+    assert not os.path.exists(dropped)
+    assert not log.status()["can_redo"]
+
+
+def test_compaction_keeps_an_anchor_first(tmp_path):
+    log = _log(tmp_path, max_entries=4, snapshot_every=3)
+    _record(log, {"op": "generate", "seed": 1})
+    first_snapshot = None
+    for i in range(9):
+        path = _record(log, {"op": "recolor-all"})
+        first_snapshot = first_snapshot or path
+    assert len(log.entries) <= 4 + 2
+    assert history.is_anchor(log.entries[0])
+    assert log.position == len(log.entries) - 1
+    assert not os.path.exists(first_snapshot)
+
+
+def test_save_and_reload(tmp_path):
+    log = _log(tmp_path)
+    _record(log, {"op": "generate", "seed": 5})
+    _record(log, {"op": "resize", "seed": 6})
+    log.position = 0
+    log.save()
+    again = _log(tmp_path)
+    assert again.entries == log.entries and again.position == 0
+    again.clear()
+    again.save()
+    assert not os.path.exists(again.path)
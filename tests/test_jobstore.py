@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+import jobstore
+
+
+@pytest.fixture(params=['local', 'sqlite'])
+def store(request, tmp_path):
+    return jobstore.make_job_store(request.param, str(tmp_path / "jobs.sqlite3"), lease_seconds=60)
+
+
+def _set_owner(store, sid, owner, lease_until):
+    # Another process's claim: the store's owner is the pid
+    store._conn().execute("UPDATE jobs SET owner = ?, lease_until = ? WHERE sid = ?", (owner, lease_until, sid))
+
+
+def test_bumps_coalesce_into_one_worker(store):
+    assert store.bump('s') == (1, True)
+    assert store.bump('s') == (2, False)
+    assert store.running('s')
+    version = store.begin('s')
+    assert version == 2
+    assert store.bump('s') == (3, False)
+    # The run of version 2 is stale: the worker loops for the latest
+    assert not store.finish('s', version)
+    assert store.begin('s') == 3
+    assert store.finish('s', 3)
+    assert not store.running('s')
+    assert store.bump('s') == (4, True)
+
+
+def test_sessions_are_independent(store):
+    assert store.bump('a')[1]
+    assert store.bump('b')[1]
+    assert store.finish('a', store.begin('a'))
+    assert store.running('b') and not store.running('a')
+
+
+def test_release_clears_only_own_claim(store):
+    store.bump('s')
+    store.release('s')
+    assert not store.running('s')
+    assert store.bump('s')[1]
+
+
+def test_sqlite_expired_lease_is_taken_over(tmp_path):
+    store = jobstore.SqliteJobStore(str(tmp_path / "jobs.sqlite3"), lease_seconds=60)
+    store.bump('s')
+    _set_owner(store, 's', 'other', time.time() + 60)
+    assert store.bump('s') == (2, False)
+    _set_owner(store, 's', 'other', time.time() - 1)
+    assert not store.running('s')
+    assert store.bump('s') == (3, True)
+
+
+def test_sqlite_renew_extends_own_lease(tmp_path):
+    store = jobstore.SqliteJobStore(str(tmp_path / "jobs.sqlite3"), lease_seconds=60)
+    store.bump('s')
+    store._conn().execute("UPDATE jobs SET lease_until = ? WHERE sid = 's'", (time.time() + 1,))
+    assert store.renew('s')
+    lease_until = store._conn().execute("SELECT lease_until FROM jobs WHERE sid = 's'").fetchone()[0]
+    assert lease_until > time.time() + 50
+    _set_owner(store, 's', 'other', time.time() + 60)
+    assert not store.renew('s')
+
+
+def test_sqlite_finish_after_takeover_stops_the_worker(tmp_path):
+    store = jobstore.SqliteJobStore(str(tmp_path / "jobs.sqlite3"), lease_seconds=60)
+    store.bump('s')
+    version = store.begin('s')
+    store.bump('s')
+    _set_owner(store, 's', 'other', time.time() + 60)
+    # Not the latest version, but the new owner runs it: the old worker must not loop
+    assert store.finish('s', version)
+    # ... and leaves the other process's claim alone
+    store.release('s')
+    assert store.running('s')
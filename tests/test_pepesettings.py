@@ -0,0 +1,72 @@
+import json
+import os
+import random
+
+import pepesettings
+
+
+def test_defaults_and_invalid_values():
+    s = pepesettings.from_dict({"canvas_width": "wide", "knob_down": -3, "slider": None})
+    assert s.dims == (500, 500, 5, 5)
+    assert s.knob == 0
+    assert s.palette == ()
+    assert s.shapes == (pepesettings.TRIANGLES, pepesettings.SQUARES)
+    assert pepesettings.from_dict(None) == pepesettings.from_dict({})
+
+
+def test_canvas_is_clamped():
+    s = pepesettings.from_dict({"canvas_width": 50, "canvas_height": 2500})
+    assert (s.canvas_width, s.canvas_height, s.cols, s.rows) == (100, 2500, 1, 25)
+
+
+def test_palette_is_unique_in_button_order():
+    s = pepesettings.from_dict({
+        "button_1": {"state": "on", "color": "#00ff00"},
+        "button_2": "#ff0000",
+        "button_3": {"state": "off", "color": "#0000ff"},
+        "button_4": "off",
+        "button_5": {"state": "on", "color": "#00ff00"},
+        "knob_down": 2,
+    })
+    assert s.palette == ("#00ff00", "#ff0000")
+    assert s.knob == 2
+
+
+def test_shape_policy():
+    shapes = lambda **kw: pepesettings.from_dict(kw).shapes
+    assert shapes(switch="left") == (pepesettings.SQUARES,)
+    assert shapes(switch="right") == (pepesettings.TRIANGLES,)
+    assert shapes(switch="center", slider=20) == (pepesettings.SQUARES, pepesettings.TRIANGLES)
+    assert shapes(switch="center", slider=80) == (pepesettings.TRIANGLES, pepesettings.SQUARES)
+    rng = random.Random(1)
+    assert pepesettings.pick_shape(pepesettings.from_dict({"switch": "left"}), rng) == pepesettings.SQUARES
+
+
+def test_pick_two_colors():
+    one = pepesettings.from_dict({"button_1": "#111111", "button_2": "#111111"})
+    assert pepesettings.pick_two_colors(one) == ("black", "white")
+    many = pepesettings.from_dict({f"button_{i}": "#%06x" % i for i in range(5)})
+    a, b = pepesettings.pick_two_colors(many, random.Random(3))
+    assert a != b and {a, b} <= set(many.palette)
+
+
+def test_load_follows_same_size_rewrites(tmp_path):
+    path = str(tmp_path / "data_s.json")
+    with open(path, "w") as f:
+        json.dump({"knob_down": 1}, f)
+    first = pepesettings.load(path)
+    assert first.knob == 1
+    assert pepesettings.load(path) is first
+    st = os.stat(path)
+    with open(path, "w") as f:
+        json.dump({"knob_down": 2}, f)
+    # Same size and the same mtime, as on a coarse-timestamp filesystem
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert pepesettings.load(path).knob == 2
+
+
+def test_load_missing_or_broken_file(tmp_path):
+    assert pepesettings.load(str(tmp_path / "missing.json")) == pepesettings.from_dict({})
+    path = tmp_path / "broken.json"
+    path.write_text("{not json")
+    assert pepesettings.load(str(path)) == pepesettings.from_dict({})
@@ -0,0 +1,75 @@
+import struct
+import threading
+import xml.etree.ElementTree as ET
+import zlib
+
+import render
+import tilestore
+
+
+def _pattern(cols=4, rows=3):
+    return [{'tile': 'Padrao Quadrado' if (gx + gy) % 2 else 'Padrao Triangulos', 'rotation': 90 * (gx % 4),
+             'color_fundo': '#ff0000', 'color_padrao': '#0000ff', 'region_id': 1 + (gx > 2),
+             'grid_x': gx, 'grid_y': gy}
+            for gx in range(1, cols + 1) for gy in range(1, rows + 1)]
+
+
+def test_parse_color():
+    assert render.parse_color('#0f8') == (0, 255, 136)
+    assert render.parse_color('#FF0000') == (255, 0, 0)
+    assert render.parse_color('not a color') == (0, 0, 0)
+
+
+def test_store_grid_renders_like_the_pattern(tmp_path):
+    pattern = _pattern()
+    with tilestore.TileStore.create(str(tmp_path / "tiles_s.bin"), 4, 3, 4) as store:
+        store.put_tiles(pattern)
+        grid = render.grid_from_store(store)
+        for cell_px in (1.5, 16):
+            assert render.render_rgb(grid, 64, 48, cell_px) == render.render_rgb(render.build_grid(pattern), 64, 48, cell_px)
+
+
+def test_periodic_grid_repeats_the_block():
+    block = render.build_grid(_pattern(2, 2))
+    grid = render.periodic_grid(block, 6, 4)
+    assert grid['cells'].get((5, 3)) == block['cells'].get((1, 1))
+    assert grid['cells'].get((4, 4)) == block['cells'].get((2, 2))
+
+
+def test_png_round_trip():
+    rgb = render.render_full(render.build_grid(_pattern()), 40, 30)
+    png = render.encode_png(rgb, 40, 30)
+    assert png.startswith(b'\x89PNG\r\n\x1a\n')
+    width, height = struct.unpack('>II', png[16:24])
+    assert (width, height) == (40, 30)
+    (length,) = struct.unpack('>I', png[33:37])
+    raw = zlib.decompress(png[41:41 + length])
+    assert b''.join(raw[y * 121 + 1:(y + 1) * 121] for y in range(30)) == bytes(rgb)
+
+
+def test_svg_is_well_formed():
+    tiles, cols, rows = render.svg_tiles(_pattern())
+    svg = ''.join(render.iter_svg(tiles, cols, rows, 200, 150, region_x2={1: 2, 2: 4}))
+    root = ET.fromstring(svg.split('\n', 1)[1])
+    assert root.get('width') == '200mm'
+    uses = root.iter('{http://www.w3.org/2000/svg}use')
+    assert sum(1 for _ in uses) >= 1
+
+
+def test_glyph_cache_under_concurrent_renders(monkeypatch):
+    monkeypatch.setattr(render, 'GLYPH_CACHE_MAX', 4)
+    grid = render.build_grid(_pattern(8, 8))
+    expected = bytes(render.render_rgb(grid, 96, 96, 12))
+    results = []
+
+    def work():
+        for cell_px in (12, 5, 7, 12):
+            results.append((cell_px, bytes(render.render_rgb(grid, 96, 96, cell_px))))
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 32
+    assert all(rgb == expected for cell_px, rgb in results if cell_px == 12)
+    assert len(render._glyphs) <= 4
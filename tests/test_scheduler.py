@@ -0,0 +1,92 @@
+import threading
+import time
+
+import scheduler
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def _blocked(s, key='blocker'):
+    """Occupy a worker until the returned event is set."""
+    gate, started = threading.Event(), threading.Event()
+    s.submit(key, 1, lambda: (started.set(), gate.wait()))
+    started.wait(5)
+    return gate
+
+
+def test_shortest_response_ratio_first():
+    s = scheduler.FairScheduler(workers=1)
+    order = []
+    gate = _blocked(s)
+    s.submit('big', 1e6, order.append, 'big')
+    s.submit('small', 10, order.append, 'small')
+    s.submit('medium', 1000, order.append, 'medium')
+    assert s.position('small')['queue_position'] == 1
+    assert s.position('big')['queue_position'] == 3
+    gate.set()
+    _wait_for(lambda: len(order) == 3)
+    assert order == ['small', 'medium', 'big']
+    s.shutdown()
+
+
+def test_long_wait_outranks_a_small_job():
+    s = scheduler.FairScheduler(workers=1)
+    order = []
+    gate = _blocked(s)
+    s.submit('big', 1e6, order.append, 'big')
+    s.submit('small', 10, order.append, 'small')
+    with s._cv:
+        # big has waited far longer than its own cost: its ratio now wins
+        next(j for j in s._pending if j['key'] == 'big')['enqueued_at'] -= 1e12 * s.seconds_per_unit
+    gate.set()
+    _wait_for(lambda: len(order) == 2)
+    assert order == ['big', 'small']
+    s.shutdown()
+
+
+def test_per_key_limit():
+    s = scheduler.FairScheduler(workers=2, per_key_limit=1)
+    order = []
+    gate = _blocked(s, key='a')
+    s.submit('a', 1, order.append, 'a2')
+    s.submit('b', 1000, order.append, 'b')
+    _wait_for(lambda: order == ['b'])
+    # The idle worker may not start a's second job while its first one runs
+    assert s.position('a')['state'] == 'running'
+    assert s.stats()['pending'] == 1
+    gate.set()
+    _wait_for(lambda: order == ['b', 'a2'])
+    s.shutdown()
+
+
+def test_background_jobs_yield_to_foreground():
+    s = scheduler.FairScheduler(workers=1)
+    order = []
+    gate = _blocked(s)
+    s.submit('spec', 1, order.append, 'spec', background=True)
+    s.submit('real', 1e6, order.append, 'real')
+    assert s.foreground_waiting() == 1
+    # Background jobs are left out of queue positions
+    assert s.position('spec') is None
+    assert s.position('real')['queue_position'] == 1
+    gate.set()
+    _wait_for(lambda: len(order) == 2)
+    assert order == ['real', 'spec']
+    s.shutdown()
+
+
+def test_reprice_and_observe():
+    s = scheduler.FairScheduler(workers=1)
+    gate = _blocked(s)
+    s.submit('a', 10, lambda: None, info={'v': 1})
+    s.reprice('a', 5000, info={'v': 2})
+    assert s.position('a')['info'] == {'v': 2}
+    s.observe(1000, 2.0)
+    assert s.seconds_per_unit == 2.0 / 1000
+    gate.set()
+    s.shutdown()
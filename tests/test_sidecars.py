@@ -0,0 +1,61 @@
+import gzip
+import json
+import os
+
+import pytest
+
+app = pytest.importorskip("app")
+
+
+def _get(path, encoding='gzip'):
+    with app.app.test_request_context(headers={'Accept-Encoding': encoding}):
+        resp = app._send_json_artifact(str(path))
+        resp.direct_passthrough = False
+        body = resp.get_data()
+        resp.close()
+    if resp.headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return resp.headers.get('Content-Encoding'), json.loads(body)
+
+
+def _big(n):
+    return [{"grid_x": i, "grid_y": i, "color_fundo": "#ff0000"} for i in range(n)]
+
+
+def test_fresh_sidecar_is_served(tmp_path):
+    path = tmp_path / "pattern_s.json"
+    assert app._json_dump_file(_big(200), str(path), precompress=True)
+    assert _get(path) == ('gzip', _big(200))
+    assert _get(path, encoding='identity') == (None, _big(200))
+
+
+def test_main_replaced_without_sidecars_is_served_plain(tmp_path):
+    path = tmp_path / "pattern_s.json"
+    app._json_dump_file(_big(200), str(path), precompress=True)
+    # Same size, possibly the same mtime tick: only the record tells them apart
+    app._json_dump_file(_big(200)[::-1], str(path))
+    assert _get(path) == (None, _big(200)[::-1])
+
+
+def test_record_of_an_older_write_is_ignored(tmp_path):
+    path = tmp_path / "pattern_s.json"
+    app._json_dump_file(_big(200), str(path), precompress=True)
+    with open(app._sidecar_record_path(str(path)), 'rb') as f:
+        stale_record = f.read()
+    app._json_dump_file(_big(300), str(path), precompress=True)
+    assert _get(path) == ('gzip', _big(300))
+    # A slower writer of the first version finishing last
+    with open(str(path) + '.gz', 'wb') as f:
+        f.write(gzip.compress(json.dumps(_big(200)).encode()))
+    with open(app._sidecar_record_path(str(path)), 'wb') as f:
+        f.write(stale_record)
+    assert _get(path) == (None, _big(300))
+
+
+def test_small_files_get_no_sidecars(tmp_path):
+    path = tmp_path / "regions_s.json"
+    app._json_dump_file(_big(200), str(path), precompress=True)
+    app._json_dump_file([], str(path), precompress=True)
+    assert not os.path.exists(str(path) + '.gz')
+    assert not os.path.exists(app._sidecar_record_path(str(path)))
+    assert _get(path) == (None, [])
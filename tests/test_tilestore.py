@@ -0,0 +1,72 @@
+import pytest
+
+import tilestore
+
+
+def _tile(gx, gy, color='#ff0000', rid=1, tile='Padrao Quadrado', rotation=90):
+    return {'tile': tile, 'rotation': rotation, 'color_fundo': color, 'color_padrao': '#ffffff',
+            'region_id': rid, 'grid_x': gx, 'grid_y': gy}
+
+
+def _region(rid, **kw):
+    region = {'id': rid, 'x1': 1, 'y1': 1, 'x2': 2, 'y2': 2, 'shape': 'aleluia_triangulos',
+              'variant': None, 'color_fundo': '#ff0000', 'color_padrao': '#ffffff'}
+    region.update(kw)
+    return region
+
+
+def test_tiles_and_regions_round_trip(tmp_path):
+    path = str(tmp_path / "tiles_s.bin")
+    tiles = [_tile(1, 1), _tile(1, 2, color='#00ff00', rotation=270), _tile(3, 2, tile='Padrao Triangulos', rid=2)]
+    regions = [_region(1, seed=7, recolor_count=2, last_pairs=[['#111111', '#222222']]),
+               _region(2, x1=3, x2=3, shape='aleluia_quadrados', variant=3)]
+    with tilestore.TileStore.create(path, 3, 2, 4, meta={'fingerprint': 'abc'}) as store:
+        store.put_tiles(tiles + [_tile(4, 1), _tile(0, 1)])  # off-grid tiles are dropped
+        store.put_regions(regions)
+    with tilestore.TileStore(path) as store:
+        assert store.header['meta'] == {'fingerprint': 'abc'}
+        assert store.header['region_count'] == 2
+        assert list(store.iter_tiles()) == tiles
+        assert [len(col) for col in store.iter_tile_columns()] == [2, 0, 1]
+        assert store.tile_at(2, 1) is None
+        assert store.tile_at(9, 9) is None
+        assert list(store.iter_regions()) == regions
+        assert store.region(2) == regions[1]
+        assert store.region(3) is None
+        assert store.region('x') is None
+
+
+def test_patch_clears_then_writes(tmp_path):
+    path = str(tmp_path / "tiles_s.bin")
+    with tilestore.TileStore.create(path, 3, 3, 2) as store:
+        store.put_tiles([_tile(gx, gy) for gx in range(1, 4) for gy in range(1, 4)])
+        store.put_regions([_region(1, x2=3, y2=3)])
+    tilestore.Patch(clear=[(2, 2, 5, 5)],
+                    tiles=[_tile(3, 3, color='#0000ff', rid=2)],
+                    regions=[_region(2, x1=3, y1=3, x2=3, y2=3, color_fundo='#0000ff')]).apply(path)
+    with tilestore.TileStore(path) as store:
+        assert store.header['version'] == 1
+        cells = {(t['grid_x'], t['grid_y']): t['color_fundo'] for t in store.iter_tiles()}
+        assert cells == {(1, 1): '#ff0000', (1, 2): '#ff0000', (1, 3): '#ff0000',
+                         (2, 1): '#ff0000', (3, 1): '#ff0000', (3, 3): '#0000ff'}
+        assert [r['id'] for r in store.iter_regions()] == [1, 2]
+        assert list(store.iter_range(3, 3, 3, 3)) == [_tile(3, 3, color='#0000ff', rid=2)]
+
+
+def test_region_ids_are_bounded(tmp_path):
+    with tilestore.TileStore.create(str(tmp_path / "tiles_s.bin"), 2, 2, 1) as store:
+        with pytest.raises(ValueError):
+            store.put_regions([_region(2)])
+
+
+def test_not_a_store(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        tilestore.TileStore(str(path))
+
+
+def test_sizes():
+    assert tilestore.max_regions_for(10, 10, 0) == 11 * 10
+    assert tilestore.max_regions_for(10, 10, 2) == 5 * 4
+    assert tilestore.file_size_for(2, 3, 4) == tilestore.HEADER_SIZE + 6 * tilestore.TILE.size + 4 * tilestore.REGION.size
@@ -0,0 +1,296 @@
+import os
+import json
+import mmap
+import struct
+
+# Out-of-core pattern storage: one preallocated file per session, memory-mapped.
+#
+#   [0, HEADER_SIZE)   MAGIC, u32 length, JSON header {cols, rows, max_regions, palette, region_count, meta,
+#                      version}; version counts in-place patches (the file keeps its inode and size)
+#   tiles              cols x rows TILE records, column-major: cell (gx, gy) is record (gx-1)*rows + (gy-1),
+#                      so a generation column strip is one contiguous run of records
+#   regions            max_regions REGION records; region id N is record N-1
+#
+# Colors are stored as indexes into the header palette (patterns use a handful of colors).
+# Every record has a fixed size, so any cell or region is read or rewritten in place
+# without parsing the rest of the file.
+
+MAGIC = b'ALTILES1'
+HEADER_SIZE = 64 * 1024
+TILE = struct.Struct('<BBHHI')           # kind, rotation // 90, color_fundo, color_padrao, region_id
+REGION = struct.Struct('<IIIIIHHBBH6H')  # x1, y1, x2, y2, seed, color_fundo, color_padrao, shape, variant,
+                                         # recolor_count, last_pairs (3 x (fundo, padrao))
+NO_COLOR = 0xFFFF
+NO_SEED = 0xFFFFFFFF
+
+TILE_NAMES = (None, 'Padrao Quadrado', 'Padrao Triangulos')  # index = kind (0 = empty cell)
+SHAPES = (None, 'aleluia_quadrados', 'aleluia_triangulos')
+_TILE_KINDS = {name: i for i, name in enumerate(TILE_NAMES) if name}
+_SHAPE_IDS = {name: i for i, name in enumerate(SHAPES) if name}
+
+
+def max_regions_for(cols, rows, knob_value):
+    """Upper bound on the regions StartPepeFunction.start() can produce (steps are >= knob+1;
+    the column walk can end with one empty strip)."""
+    step = max(1, 1 + int(knob_value or 0))
+    return (-(-cols // step) + 1) * -(-rows // step)
+
+
+def file_size_for(cols, rows, max_regions):
+    return HEADER_SIZE + cols * rows * TILE.size + max_regions * REGION.size
+
+
+class TileStore:
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        self._f = open(path, 'r+b' if writable else 'rb')
+        try:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        except Exception:
+            self._f.close()
+            raise
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a tile store")
+        (length,) = struct.unpack_from('<I', self._mm, len(MAGIC))
+        self.header = json.loads(bytes(self._mm[len(MAGIC) + 4:len(MAGIC) + 4 + length]))
+        self.cols = int(self.header['cols'])
+        self.rows = int(self.header['rows'])
+        self.max_regions = int(self.header['max_regions'])
+        self.palette = list(self.header.get('palette') or [])
+        self._color_ids = {c: i for i, c in enumerate(self.palette)}
+        self._regions_at = HEADER_SIZE + self.cols * self.rows * TILE.size
+        self._dirty_header = False
+
+    @classmethod
+    def create(cls, path, cols, rows, max_regions, meta=None):
+        """Preallocate a store (sparse on most filesystems: untouched records read as empty)."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            f.truncate(file_size_for(cols, rows, max_regions))
+            f.write(cls._encode_header({
+                'cols': int(cols),
+                'rows': int(rows),
+                'max_regions': int(max_regions),
+                'palette': [],
+                'region_count': 0,
+                'version': 0,
+                'meta': meta or {},
+            }))
+        return cls(path, writable=True)
+
+    @staticmethod
+    def _encode_header(header):
+        body = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        if len(MAGIC) + 4 + len(body) > HEADER_SIZE:
+            raise ValueError("tile store header full (too many distinct colors)")
+        return MAGIC + struct.pack('<I', len(body)) + body
+
+    def close(self):
+        if getattr(self, '_mm', None) is not None:
+            if self.writable:
+                self.flush()
+            self._mm.close()
+            self._mm = None
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def flush(self):
+        if self._dirty_header:
+            self.header['palette'] = self.palette
+            data = self._encode_header(self.header)
+            self._mm[:len(data)] = data
+            self._dirty_header = False
+        self._mm.flush()
+
+    # ----- colors -----
+
+    def _color_id(self, color):
+        if color is None:
+            return NO_COLOR
+        cid = self._color_ids.get(color)
+        if cid is None:
+            cid = len(self.palette)
+            self.palette.append(color)
+            self._color_ids[color] = cid
+            self._dirty_header = True
+        return cid
+
+    def _color(self, cid):
+        return self.palette[cid] if cid != NO_COLOR and cid < len(self.palette) else None
+
+    # ----- tiles -----
+
+    def _offset(self, gx, gy):
+        return HEADER_SIZE + ((gx - 1) * self.rows + (gy - 1)) * TILE.size
+
+    def _in_grid(self, gx, gy):
+        return 1 <= gx <= self.cols and 1 <= gy <= self.rows
+
+    def put_tiles(self, tiles):
+        """Write tile dicts (the generator's format) into their cells; off-grid tiles are ignored."""
+        mm = self._mm
+        for t in tiles:
+            gx = int(t['grid_x'])
+            gy = int(t['grid_y'])
+            if not self._in_grid(gx, gy):
+                continue
+            TILE.pack_into(mm, self._offset(gx, gy),
+                           _TILE_KINDS.get(t.get('tile'), 0),
+                           (int(t.get('rotation') or 0) % 360) // 90,
+                           self._color_id(t.get('color_fundo')),
+                           self._color_id(t.get('color_padrao')),
+                           int(t.get('region_id') or 0))
+
+    def clear_rect(self, x1, y1, x2, y2):
+        x1, y1 = max(1, x1), max(1, y1)
+        x2, y2 = min(self.cols, x2), min(self.rows, y2)
+        if x1 > x2 or y1 > y2:
+            return
+        blank = bytes(TILE.size * (y2 - y1 + 1))
+        for gx in range(x1, x2 + 1):
+            o = self._offset(gx, y1)
+            self._mm[o:o + len(blank)] = blank
+
+    def record(self, gx, gy):
+        """Raw (kind, rotation // 90, fundo id, padrao id, region_id) or None outside the grid."""
+        if not self._in_grid(gx, gy):
+            return None
+        return TILE.unpack_from(self._mm, self._offset(gx, gy))
+
+    def _tile_dict(self, rec, gx, gy):
+        kind, rot, cf, cp, rid = rec
+        return {
+            'tile': TILE_NAMES[kind],
+            'rotation': rot * 90,
+            'color_fundo': self._color(cf),
+            'color_padrao': self._color(cp),
+            'region_id': rid or None,
+            'grid_x': gx,
+            'grid_y': gy,
+        }
+
+    def tile_at(self, gx, gy):
+        rec = self.record(gx, gy)
+        if rec is None or rec[0] == 0:
+            return None
+        return self._tile_dict(rec, gx, gy)
+
+    def iter_column(self, gx, y0=1, y1=None):
+        """Records of column gx between rows y0..y1 as (gy, record), skipping empty cells."""
+        y0 = max(1, y0)
+        y1 = min(self.rows, self.rows if y1 is None else y1)
+        if not (1 <= gx <= self.cols) or y0 > y1:
+            return
+        start = self._offset(gx, y0)
+        # Slicing copies one column out of the map; no buffer export outlives a partial iteration
+        data = self._mm[start:start + (y1 - y0 + 1) * TILE.size]
+        for i, rec in enumerate(TILE.iter_unpack(data)):
+            if rec[0]:
+                yield y0 + i, rec
+
+    def iter_range(self, x0, y0, x1, y1):
+        """Tile dicts inside the inclusive rectangle, column-major."""
+        for gx in range(max(1, x0), min(self.cols, x1) + 1):
+            for gy, rec in self.iter_column(gx, y0, y1):
+                yield self._tile_dict(rec, gx, gy)
+
+    def iter_tiles(self):
+        return self.iter_range(1, 1, self.cols, self.rows)
+
+    def iter_tile_columns(self):
+        """Whole pattern as one list of tile dicts per grid column (bounded memory per step)."""
+        for gx in range(1, self.cols + 1):
+            yield [self._tile_dict(rec, gx, gy) for gy, rec in self.iter_column(gx)]
+
+    # ----- regions -----
+
+    def _region_offset(self, region_id):
+        return self._regions_at + (region_id - 1) * REGION.size
+
+    def put_regions(self, regions):
+        for r in regions:
+            rid = int(r['id'])
+            if not (1 <= rid <= self.max_regions):
+                raise ValueError(f"region id {rid} beyond preallocated {self.max_regions}")
+            pairs = [c for pair in (r.get('last_pairs') or [])[-3:] for c in pair[:2]]
+            pairs = [self._color_id(c) for c in pairs] + [NO_COLOR] * (6 - len(pairs))
+            seed = r.get('seed')
+            REGION.pack_into(self._mm, self._region_offset(rid),
+                             int(r['x1']), int(r['y1']), int(r['x2']), int(r['y2']),
+                             NO_SEED if seed is None else int(seed) & 0xFFFFFFFF,
+                             self._color_id(r.get('color_fundo')), self._color_id(r.get('color_padrao')),
+                             _SHAPE_IDS.get(r.get('shape'), 0), int(r.get('variant') or 0),
+                             min(0xFFFF, int(r.get('recolor_count') or 0)), *pairs)
+            if rid > self.header.get('region_count', 0):
+                self.header['region_count'] = rid
+                self._dirty_header = True
+
+    def _region_dict(self, rid, rec):
+        x1, y1, x2, y2, seed, cf, cp, shape, variant, recolor_count = rec[:10]
+        region = {
+            'id': rid,
+            'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2,
+            'shape': SHAPES[shape] if shape < len(SHAPES) else None,
+            'variant': variant or None,
+            'color_fundo': self._color(cf),
+            'color_padrao': self._color(cp),
+        }
+        if seed != NO_SEED:
+            region['seed'] = seed
+        if recolor_count:
+            region['recolor_count'] = recolor_count
+        pairs = rec[10:]
+        last_pairs = [[self._color(pairs[i]), self._color(pairs[i + 1])] for i in range(0, 6, 2) if pairs[i] != NO_COLOR]
+        if last_pairs:
+            region['last_pairs'] = last_pairs
+        return region
+
+    def region(self, region_id):
+        try:
+            rid = int(region_id)
+        except (TypeError, ValueError):
+            return None
+        if not (1 <= rid <= self.header.get('region_count', 0)):
+            return None
+        rec = REGION.unpack_from(self._mm, self._region_offset(rid))
+        if rec[0] == 0:
+            return None
+        return self._region_dict(rid, rec)
+
+    def iter_regions(self):
+        count = self.header.get('region_count', 0)
+        chunk = 4096
+        for first in range(0, count, chunk):
+            n = min(chunk, count - first)
+            start = self._regions_at + first * REGION.size
+            for i, rec in enumerate(REGION.iter_unpack(self._mm[start:start + n * REGION.size])):
+                if rec[0]:
+                    yield self._region_dict(first + i + 1, rec)
+
+
+class Patch:
+    """Pending in-place edit of a store: clear rectangles, then write tiles and regions."""
+
+    def __init__(self, clear=(), tiles=(), regions=()):
+        self.clear = list(clear)
+        self.tiles = list(tiles)
+        self.regions = list(regions)
+
+    def apply(self, path):
+        with TileStore(path, writable=True) as store:
+            for rect in self.clear:
+                store.clear_rect(*rect)
+            store.put_tiles(self.tiles)
+            store.put_regions(self.regions)
+            # With the file's stat, this is the store's version for caches and ETags
+            store.header['version'] = store.header.get('version', 0) + 1
+            store._dirty_header = True
+        # mmap writes do not always bump mtime (cleanup_user_data evicts by it)
+        os.utime(path)